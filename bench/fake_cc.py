@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""A deterministic stand-in for gcc.
+
+Accepts the command lines built by `FileINFO.compile_cmd` and writes an
+"executable" that prints a checksum of the source. With `-c` it writes an
+"object" holding the checksum instead, and objects given as inputs are
+linked into an executable printing their checksum. Function attributes are
+stripped before hashing, so a mutant prints the same checksum as its
+original unless the (file, options) pair is picked for a miscompilation.
+A multi-variant program (see `variants.combine`) gets an executable printing
+the checksum of each variant followed by its marker.
+Crashes and miscompilations are drawn from a hash of the source and the
+options, so a given input always gets the same verdict.
+
+Environment:
+    FAKE_CC_LATENCY: Seconds a compilation takes (default 0).
+    FAKE_CC_CRASH_RATE: The fraction of compilations that crash (default 0).
+    FAKE_CC_MISCOMPILE_RATE: The fraction of compilations of a program with
+        optimize attributes that change its checksum (default 0).
+    FAKE_CC_BUGGY_FLAGS: Comma-separated options; if set, only programs with
+        one of them in an optimize attribute can be miscompiled.
+    FAKE_RUN_LATENCY: Seconds the executable sleeps before printing (default 0).
+"""
+import os
+import re
+import sys
+import time
+import hashlib
+
+ATTRIBUTE = re.compile(r"\s*__attribute__\s*\(\((?:[^()]|\([^()]*\))*\)\)")
+VARIANT = re.compile(r"\n/\* --- VARIANT \d+ --- \*/\n")
+DRIVER = "\n/* --- MULTI-VARIANT DRIVER --- */"
+
+
+def draw(*parts: str) -> float:
+    """A number in [0, 1) derived from `parts`."""
+    digest = hashlib.sha256("\0".join(parts).encode()).digest()
+    return int.from_bytes(digest[:8], "big") / (1 << 64)
+
+
+def main(argv: list[str]) -> int:
+    if "--version" in argv:
+        print("fake-cc (bench) 1.0")
+        return 0
+
+    out = "a.out"
+    sources = []
+    objects = []
+    options = []
+    compile_only = False
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "-o":
+            out = argv[i + 1]
+            i += 1
+        elif arg == "-x":
+            i += 1
+        elif arg == "-c":
+            compile_only = True
+        elif arg.endswith(".o"):
+            with open(arg) as f:
+                objects.append(f.read().split()[-1])
+        elif arg == "-":
+            sources.append(sys.stdin.read())
+        elif arg.endswith(".c"):
+            with open(arg) as f:
+                sources.append(f.read())
+        elif arg.startswith("-O") or arg.startswith("-f"):
+            options.append(arg)
+        i += 1
+    if objects and not sources:
+        if len(objects) > 1:
+            # a split program: its checksum follows the checksums of its units
+            return link(hashlib.sha256(" ".join(objects).encode()).hexdigest()[:8].upper(), out)
+        return link(objects[0], out)
+    if not sources:
+        print("fake-cc: fatal error: no input files", file=sys.stderr)
+        return 1
+
+    text = "\n".join(sources)
+    opts = " ".join(options)
+    time.sleep(float(os.environ.get("FAKE_CC_LATENCY", 0)))
+    if draw("crash", text, opts) < float(os.environ.get("FAKE_CC_CRASH_RATE", 0)):
+        print("during GIMPLE pass: fake\n"
+              "internal compiler error: Segmentation fault\n"
+              "0x1234567 fake_pass::execute(function*)", file=sys.stderr)
+        return 4
+
+    if DRIVER in text:
+        variants = VARIANT.split(text[:text.index(DRIVER)])[1:]
+        # each variant prints as if it was compiled alone
+        return link([checksum(re.sub(r"\bv\d+_", "", variant), opts) for variant in variants], out)
+    if compile_only:
+        with open(out, "w") as f:
+            f.write(f"fake-object {checksum(text, opts)}\n")
+        return 0
+    return link(checksum(text, opts), out)
+
+
+def checksum(text: str, opts: str) -> str:
+    stripped = ATTRIBUTE.sub("", text)
+    buggy = [flag for flag in os.environ.get("FAKE_CC_BUGGY_FLAGS", "").split(",") if flag]
+    if stripped != text and \
+            (not buggy or any(f'"{flag}' in text or f',{flag}' in text for flag in buggy)) and \
+            draw("miscompile", text, opts) < float(os.environ.get("FAKE_CC_MISCOMPILE_RATE", 0)):
+        return hashlib.sha256((text + opts).encode()).hexdigest()[:8].upper()
+    return hashlib.sha256(stripped.encode()).hexdigest()[:8].upper()
+
+
+def link(checksum: str | list[str], out: str) -> int:
+    """Write an executable printing `checksum`, or every checksum of a list
+    followed by the marker of its variant."""
+    latency = float(os.environ.get("FAKE_RUN_LATENCY", 0))
+    variants = isinstance(checksum, list)
+    with open(out, "w") as f:
+        f.write("#!/bin/sh\n")
+        for i, value in enumerate(checksum if variants else [checksum]):
+            if latency:
+                f.write(f"sleep {latency}\n")
+            f.write(f"echo 'checksum = {value}'\n")
+            if variants:
+                f.write(f"echo '@@cbouncy variant {i} 0 0 0'\n")
+    os.chmod(out, 0o755)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""A deterministic stand-in for csmith.
+
+Emits small but valid csmith-like C programs, with the same
+`FORWARD DECLARATIONS` / `FUNCTIONS` markers the mutator relies on.
+The n-th program emitted for a given state file is always the same.
+
+Environment:
+    FAKE_CSMITH_STATE: A file holding the number of programs emitted so far.
+    FAKE_CSMITH_FUNCS: The number of functions per program (default 8).
+    FAKE_CSMITH_LATENCY: Seconds to sleep before emitting (default 0).
+"""
+import os
+import sys
+import time
+import fcntl
+import random
+
+HEADER = """/*
+ * This is a RANDOMLY GENERATED PROGRAM.
+ *
+ * Generator: fake csmith (seed {seed})
+ */
+#include "csmith.h"
+
+
+static long __undefined;
+
+/* --- Struct/Union Declarations --- */
+/* --- GLOBAL VARIABLES --- */
+"""
+
+
+def next_seed(state: str) -> int:
+    with open(state, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        seed = int(f.read().strip() or 0) + 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(seed))
+    return seed
+
+
+def program(seed: int, num_funcs: int) -> str:
+    rng = random.Random(seed)
+    lines = [HEADER.format(seed=seed)]
+    for i in range(1, num_funcs + 1):
+        lines.append(f"static uint32_t g_{i} = {rng.randint(0, 1 << 16)}UL;")
+
+    lines.append("\n\n/* --- FORWARD DECLARATIONS --- */")
+    for i in range(1, num_funcs + 1):
+        lines.append(f"static uint32_t  func_{i}(uint32_t  p_{i});")
+
+    lines.append("\n\n/* --- FUNCTIONS --- */")
+    for i in range(1, num_funcs + 1):
+        call = f"func_{i + 1}(g_{i} + {rng.randint(1, 97)}UL)" if i < num_funcs else f"g_{i}"
+        lines.append(f"""/* ------------------------------------------ */
+/*
+ * reads : g_{i}
+ * writes: g_{i}
+ */
+static uint32_t  func_{i}(uint32_t  p_{i})
+{{ /* block id: {i} */
+    uint32_t l_{i};
+    for (l_{i} = 0; l_{i} < {rng.randint(1, 64)}UL; l_{i}++)
+        g_{i} = (g_{i} * {rng.randint(3, 1 << 10)}UL) ^ (p_{i} + l_{i});
+    return {call};
+}}
+""")
+
+    lines.append("""
+/* ---------------------------------------- */
+int main (int argc, char* argv[])
+{
+    int print_hash_value = 0;
+    if (argc == 2 && argv[1][0] == '1') print_hash_value = 1;
+    platform_main_begin();
+    crc32_gentab();""")
+    lines.append(f"    func_1({seed}UL);")
+    for i in range(1, num_funcs + 1):
+        lines.append(f'    transparent_crc(g_{i}, "g_{i}", print_hash_value);')
+    lines.append("""    platform_main_end(crc32_context ^ 0xFFFFFFFFUL, print_hash_value);
+    return 0;
+}
+""")
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> int:
+    if "--version" in argv:
+        print("csmith 0.0.0 (fake)")
+        return 0
+    if "--seed" in argv:
+        seed = int(argv[argv.index("--seed") + 1])
+    else:
+        seed = next_seed(os.environ.get("FAKE_CSMITH_STATE", "fake_csmith.state"))
+    time.sleep(float(os.environ.get("FAKE_CSMITH_LATENCY", 0)))
+    sys.stdout.write(program(seed, int(os.environ.get("FAKE_CSMITH_FUNCS", 8))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""An offline, reproducible benchmark of the whole CBouncy pipeline.
+
+Runs generate -> mutate -> oracle -> reduce on a fixed number of cases
+with deterministic stand-ins for csmith and gcc (see `fake_csmith.py`
+and `fake_cc.py`), then reports the throughput (cases/sec), the
+utilization of every stage and the end-to-end latency of a case.
+Mail is disabled and everything lives in a temporary directory.
+
+Examples:
+    python3 bench/pipeline.py --cases 200 --json > base.json
+    python3 bench/pipeline.py --cases 200 --baseline base.json --tolerance 0.1
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from contextlib import redirect_stdout
+from tempfile import mkdtemp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+CSMITH_H = """#ifndef CSMITH_H
+#define CSMITH_H
+#include <stdio.h>
+#include <stdint.h>
+static uint32_t crc32_context = 0xFFFFFFFFUL;
+static void crc32_gentab(void) {}
+static void transparent_crc(uint64_t val, char* vname, int flag)
+{
+    crc32_context = (crc32_context * 31u) ^ (uint32_t)val;
+}
+static void platform_main_begin(void) {}
+static void platform_main_end(uint32_t crc, int flag)
+{
+    printf("checksum = %X\\n", crc);
+}
+#endif
+"""
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--cases", type=int, default=100, help="number of cases to generate")
+parser.add_argument("--mutate_num", type=int, default=5)
+parser.add_argument("--workers", type=int, default=0,
+                    help="total number of worker processes (default: cpu count)")
+parser.add_argument("--schedule_interval", type=float, default=0,
+                    help="seconds between two rebalances (default: fixed worker counts)")
+parser.add_argument("--cases_per_worker", type=int, default=1)
+parser.add_argument("--in_memory", action="store_true")
+parser.add_argument("--complex_opts", action="store_true",
+                    help="mutate with the complex option set instead of the opt levels")
+parser.add_argument("--adaptive", action="store_true",
+                    help="sample mutation options by their past results")
+parser.add_argument("--buggy_flags", type=str, default="",
+                    help="comma-separated options the fake compiler only miscompiles with")
+parser.add_argument("--object_hash", action="store_true",
+                    help="skip running binaries identical to one already run for the case")
+parser.add_argument("--multi_variant", action="store_true",
+                    help="run the files of a case from one binary per level")
+parser.add_argument("--split", action="store_true",
+                    help="compile programs function by function with cached objects")
+parser.add_argument("--funcs", type=int, default=8, help="functions per program")
+parser.add_argument("--csmith_latency", type=float, default=0.0)
+parser.add_argument("--cc_latency", type=float, default=0.0)
+parser.add_argument("--run_latency", type=float, default=0.0)
+parser.add_argument("--crash_rate", type=float, default=0.0)
+parser.add_argument("--miscompile_rate", type=float, default=0.01)
+parser.add_argument("--real_cc", action="store_true",
+                    help="compile with the real gcc instead of the stand-in")
+parser.add_argument("--keep", action="store_true", help="keep the work directory")
+parser.add_argument("--json", action="store_true", help="print the report as JSON")
+parser.add_argument("--baseline", type=str, default="",
+                    help="a JSON report to compare against; exit 1 on a regression")
+parser.add_argument("--tolerance", type=float, default=0.1,
+                    help="the allowed relative regression against the baseline")
+
+
+def shim(path: str, script: str):
+    with open(path, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+    os.chmod(path, 0o755)
+
+
+def setup(work_dir: str, args) -> dict[str, str]:
+    """Lay out the stand-in tools under `work_dir` and return the environment to run with."""
+    csmith_home = os.path.join(work_dir, "csmith")
+    os.makedirs(os.path.join(csmith_home, "bin"))
+    os.makedirs(os.path.join(csmith_home, "include"))
+    shim(os.path.join(csmith_home, "bin", "csmith"), os.path.join(BENCH_DIR, "fake_csmith.py"))
+    with open(os.path.join(csmith_home, "include", "csmith.h"), "w") as f:
+        f.write(CSMITH_H)
+
+    env = {
+        "CSMITH_HOME": csmith_home,
+        "FAKE_CSMITH_STATE": os.path.join(work_dir, "fake_csmith.state"),
+        "FAKE_CSMITH_FUNCS": str(args.funcs),
+        "FAKE_CSMITH_LATENCY": str(args.csmith_latency),
+        "FAKE_CC_LATENCY": str(args.cc_latency),
+        "FAKE_CC_CRASH_RATE": str(args.crash_rate),
+        "FAKE_CC_MISCOMPILE_RATE": str(args.miscompile_rate),
+        "FAKE_CC_BUGGY_FLAGS": args.buggy_flags,
+        "FAKE_RUN_LATENCY": str(args.run_latency),
+    }
+    if not args.real_cc:
+        bin_dir = os.path.join(work_dir, "bin")
+        os.makedirs(bin_dir)
+        shim(os.path.join(bin_dir, "gcc"), os.path.join(BENCH_DIR, "fake_cc.py"))
+        env["PATH"] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    # CBouncy reads its mail config from the working directory
+    with open(os.path.join(work_dir, "config.json"), "w") as f:
+        json.dump({}, f)
+    return env
+
+
+def percentile(hist: dict, buckets: list[str], q: float) -> float:
+    """The upper bound of the bucket holding the `q`-th quantile of a histogram."""
+    rank = q * hist["count"]
+    seen = 0
+    for bound, count in zip(buckets, hist["buckets"]):
+        seen += count
+        if seen >= rank:
+            return float(bound)
+    return float("inf")
+
+
+def report(cb, elapsed: float) -> dict:
+    snapshot = cb.metrics.snapshot()
+    counters = snapshot["counters"]
+    utilization = {}
+    for stage in cb.stages:
+        with stage.busy_time.get_lock():
+            busy = stage.busy_time.value
+        utilization[stage.name] = round(busy / (elapsed * stage.num_workers), 4)
+
+    latency = {}
+    case_hist = snapshot["histograms"].get("case_latency_seconds", {}).get("oracle")
+    if case_hist:
+        latency = {
+            "mean": round(case_hist["sum"] / case_hist["count"], 4),
+            "p50": percentile(case_hist, snapshot["buckets"], 0.5),
+            "p95": percentile(case_hist, snapshot["buckets"], 0.95),
+        }
+    return {
+        "elapsed": round(elapsed, 3),
+        "cases_per_sec": round(counters["cases_tested"] / elapsed, 4),
+        "counters": counters,
+        "workers": {stage.name: stage.num_workers for stage in cb.stages},
+        "utilization": utilization,
+        "case_latency": latency,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    if result["cases_per_sec"] < baseline["cases_per_sec"] * (1 - tolerance):
+        regressions.append(f"throughput {result['cases_per_sec']} cases/sec < "
+                           f"baseline {baseline['cases_per_sec']}")
+    mean, base_mean = result["case_latency"].get("mean"), baseline["case_latency"].get("mean")
+    if mean is not None and base_mean and mean > base_mean * (1 + tolerance):
+        regressions.append(f"mean case latency {mean}s > baseline {base_mean}s")
+    return regressions
+
+
+def main() -> int:
+    args = parser.parse_args()
+    work_dir = mkdtemp(prefix="cbouncy_bench_")
+    os.environ.update(setup(work_dir, args))
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    # the configuration is resolved from the environment and the working directory
+    from cbouncy import CBouncy
+    from filemanager import (set_object_hashing, set_split_compilation, set_multi_variant,
+                             set_pch_dir)
+
+    set_object_hashing(args.object_hash)
+    set_multi_variant(args.multi_variant)
+    if args.split:
+        set_split_compilation(os.path.join(work_dir, "objects"))
+        set_pch_dir(os.path.join(work_dir, "pch"))
+
+    scratch_dir = None
+    if args.in_memory:
+        scratch_dir = mkdtemp(prefix="scratch_", dir="/dev/shm" if os.path.isdir("/dev/shm") else work_dir)
+    try:
+        cb = CBouncy(os.path.join(work_dir, "cases"), generate_num=args.cases,
+                     mutate_num=args.mutate_num, timeout=1, jobs=None, lazy=True,
+                     scratch_dir=scratch_dir, budget=args.workers or None,
+                     schedule_interval=args.schedule_interval,
+                     cases_per_worker=args.cases_per_worker,
+                     metrics_interval=0, notify=False, complex_opts=args.complex_opts,
+                     max_opts=8, signatures=os.path.join(work_dir, "signatures.json"),
+                     adaptive=args.adaptive)
+        start = time.time()
+        # keep the progress output of the pipeline out of a JSON report
+        with redirect_stdout(sys.stderr if args.json else sys.stdout):
+            cb.run()
+        result = report(cb, time.time() - start)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if scratch_dir:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['counters']['cases_tested']} cases in {result['elapsed']}s: "
+              f"{result['cases_per_sec']} cases/sec, {result['counters']['bugs_found']} bugs")
+        for stage, value in result["utilization"].items():
+            print(f"  {stage:<10} {result['workers'][stage]:>3} workers  {value:.1%} busy")
+        if result["case_latency"]:
+            print("  case latency: mean {mean}s, p50 <= {p50}s, p95 <= {p95}s"
+                  .format(**result["case_latency"]))
+        if args.keep:
+            print(f"  work directory: {work_dir}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
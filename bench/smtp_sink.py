@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""A local SMTP stand-in that stores every message it receives.
+
+Speaks just enough plain (non-SSL) SMTP for `smtplib`: EHLO/HELO, AUTH
+(any credentials are accepted), MAIL, RCPT, DATA, RSET, NOOP and QUIT.
+Each message is written to `<out_dir>/<n>.eml`. Point CBouncy at it with
+a config.json such as:
+
+    {"smtp_server": "127.0.0.1", "smtp_port": 8025, "ssl": false,
+     "From": "cbouncy", "To": "me", "sender": "cbouncy@localhost",
+     "receiver": "me@localhost"}
+
+Example:
+    python3 bench/smtp_sink.py --port 8025 --out_dir mails
+"""
+import os
+import time
+import argparse
+import itertools
+import socketserver
+from threading import Lock
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--host", type=str, default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8025)
+parser.add_argument("--out_dir", type=str, default="mails")
+parser.add_argument("--delay", type=float, default=0,
+                    help="seconds to wait before answering DATA (to mimic a slow server)")
+parser.add_argument("--fail", type=int, default=0,
+                    help="reject the first N messages with a temporary error")
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        self.reply("220 smtp-sink ready")
+        for raw in self.rfile:
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-smtp-sink")
+                self.reply("250-AUTH PLAIN LOGIN")
+                self.reply("250 8BITMIME")
+            elif verb in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "AUTH":
+                self.reply("235 Authentication successful")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for line in self.rfile:
+                    if line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+                time.sleep(server.delay)
+                n = next(server.counter)
+                if n < server.fail:
+                    self.reply("451 Try again later")
+                    continue
+                with server.lock:
+                    with open(os.path.join(server.out_dir, f"{n}.eml"), "wb") as f:
+                        f.writelines(lines)
+                self.reply("250 OK: queued")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], out_dir: str,
+                 delay: float = 0, fail: int = 0):
+        super().__init__(address, SMTPHandler)
+        self.out_dir = out_dir
+        self.delay = delay
+        self.fail = fail
+        self.counter = itertools.count()
+        self.lock = Lock()
+        os.makedirs(out_dir, exist_ok=True)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with SMTPSink((args.host, args.port), args.out_dir, args.delay, args.fail) as sink:
+        print(f"Storing mails received on {args.host}:{args.port} in {args.out_dir}")
+        sink.serve_forever()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Measure the startup time of CBouncy's entry points against a budget.
+
+Every measurement runs in a fresh interpreter, from an empty directory
+without config.json and without $CSMITH_HOME, so it also checks that
+importing does not depend on the configuration. Reported times are the
+median over `--repeat` runs, in milliseconds:
+
+    python:         `python3 -c pass`, for reference
+    reduce_client:  one interestingness test (`python3 -S reduce.py`)
+                    answered by a stub server
+    import_reduce:  `import reduce`
+    import_filemanager: `import filemanager`
+
+Exits 1 if an entry point exceeds its budget.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import socketserver
+from threading import Thread
+from tempfile import mkdtemp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--repeat", type=int, default=10)
+parser.add_argument("--budget_reduce_client", type=float, default=100,
+                    help="milliseconds an interestingness test may take on top of the answer")
+parser.add_argument("--budget_import_reduce", type=float, default=100)
+parser.add_argument("--budget_import_filemanager", type=float, default=300)
+parser.add_argument("--json", action="store_true", help="print the report as JSON")
+
+
+class StubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.rfile.readline()
+        self.wfile.write(b"0\n")
+
+
+def median_ms(cmd: list[str], cwd: str, env: dict[str, str], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 2)
+
+
+def main() -> int:
+    args = parser.parse_args()
+    work_dir = mkdtemp(prefix="cbouncy_startup_")
+    env = {k: v for k, v in os.environ.items() if k != "CSMITH_HOME"}
+    env["PYTHONPATH"] = REPO_DIR
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    socket_path = os.path.join(work_dir, "stub.sock")
+    candidate = os.path.join(work_dir, "orig.c")
+    open(candidate, "w").close()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    server = Server(socket_path, StubHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    py = sys.executable
+    try:
+        result = {
+            "python": median_ms([py, "-c", "pass"], work_dir, env, args.repeat),
+            "reduce_client": median_ms([py, "-S", os.path.join(REPO_DIR, "reduce.py"),
+                                        socket_path, candidate], work_dir, env, args.repeat),
+            "import_reduce": median_ms([py, "-c", "import reduce"], work_dir, env, args.repeat),
+            "import_filemanager": median_ms([py, "-c", "import filemanager"],
+                                            work_dir, env, args.repeat),
+        }
+    finally:
+        server.shutdown()
+        server.server_close()
+        for file in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, file))
+        os.rmdir(work_dir)
+
+    budgets = {name: getattr(args, f"budget_{name}") for name in result if name != "python"}
+    over = [name for name, budget in budgets.items() if result[name] > budget]
+    if args.json:
+        print(json.dumps({"median_ms": result, "budget_ms": budgets, "over": over}, indent=2))
+    else:
+        for name, ms in result.items():
+            budget = f"(budget {budgets[name]:.0f} ms)" if name in budgets else ""
+            print(f"{name:<20} {ms:>8.2f} ms {budget}")
+    for name in over:
+        print(f"OVER BUDGET: {name} took {result[name]} ms > {budgets[name]} ms", file=sys.stderr)
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import os
+import json
+import fcntl
+import hashlib
+import shutil
+import subprocess
+from functools import lru_cache
+from tempfile import mkstemp
+
+
+@lru_cache(maxsize=None)
+def compiler_identity(compiler: str) -> str:
+    """Identify a compiler by its resolved path, mtime and version banner.
+
+    Any upgrade of the compiler changes the identity, which invalidates
+    every cache entry built with the old one.
+    """
+    path = shutil.which(compiler) or compiler
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    try:
+        version = subprocess.run([compiler, "--version"], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, timeout=30).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        version = b""
+    return f"{os.path.realpath(path)}:{mtime}:{version.decode('utf-8', 'replace')}"
+
+
+class ResultCache:
+    """A content-addressed, on-disk cache of compile/run results.
+
+    An entry is keyed by the hash of the source text, the compiler identity
+    and the full argument list, and stores the result string produced by
+    `FileINFO.process_file`. Entries are sharded by the first two hex digits
+    of their key. The cache is shared by all processes using the same
+    directory; its total size is bounded by evicting the least recently
+    used entries (hits refresh the entry's mtime).
+
+    The disk usage of the entries (in allocated blocks, not bytes) is kept
+    in a `size` file, updated under an `flock` by every put, so the
+    entries are only scanned when the cache is actually over its size.
+
+    Attributes:
+        cache_dir: The directory holding the entries.
+        max_size: The maximum total disk usage of the entries in bytes.
+    """
+    SIZE_FILE = "size"
+
+    def __init__(self, cache_dir: str, max_size: int = 1 << 30):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def usage(path: str) -> int:
+        """The bytes of disk used by the file at `path` (0 if there is none)."""
+        try:
+            return os.stat(path).st_blocks * 512
+        except OSError:
+            return 0
+
+    @staticmethod
+    def key(text: str, compiler: str, args: list[str], timeout: float = None) -> str:
+        h = hashlib.sha256()
+        h.update(text.encode('utf-8'))
+        h.update(b"\0")
+        h.update(compiler_identity(compiler).encode('utf-8'))
+        h.update(b"\0")
+        h.update(json.dumps([list(args), timeout]).encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key: str, entry: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        self._replace(tmp, path)
+
+    def _replace(self, tmp: str, path: str):
+        """Move the new entry `tmp` to `path`, accounting for its size.
+
+        The entry is replaced under the lock of the recorded size, so that
+        concurrent puts of the same key only count it once.
+        """
+        with open(os.path.join(self.cache_dir, self.SIZE_FILE), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            delta = self.usage(tmp) - self.usage(path)
+            os.replace(tmp, path)
+            f.seek(0)
+            recorded = f.read().strip()
+            # a cache without a recorded size (e.g. made by an older version) is measured once
+            total = int(recorded) + delta if recorded else self.scan()[1]
+            f.truncate(0)
+            f.write(str(total))
+        if total > self.max_size:
+            self.evict()
+
+    def scan(self) -> tuple[list[tuple[float, int, str]], int]:
+        """The (mtime, disk usage, path) of every entry, and their total usage."""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            if root == self.cache_dir:
+                continue
+            for file in files:
+                if file.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_blocks * 512, path))
+                total += st.st_blocks * 512
+        return entries, total
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in 90% of `max_size`.
+
+        Eviction holds the lock of the recorded size, so processes going
+        over the size together evict once, and it records the size it
+        measured, which corrects any drift of the recorded one.
+        """
+        with open(os.path.join(self.cache_dir, self.SIZE_FILE), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            recorded = f.read().strip()
+            if recorded and int(recorded) <= self.max_size:
+                return
+            entries, total = self.scan()
+            if total > self.max_size:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_size * 0.9:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+            f.truncate(0)
+            f.write(str(total))
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+class ObjectCache(ResultCache):
+    """A content-addressed, on-disk cache of object files.
+
+    Keys are built like those of `ResultCache`, from the text of a
+    translation unit and the arguments it is compiled with. Objects are
+    linked straight from the cache, and evicted the same way as results.
+    """
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.o")
+
+    def get(self, key: str) -> str | None:
+        """The path of the cached object of `key` (None if there is none)."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key: str, obj: str) -> str:
+        """Move the object file `obj` into the cache, returning its new path."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        shutil.move(obj, tmp)
+        self._replace(tmp, path)
+        return path
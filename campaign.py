@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+from threading import Thread, Event
+from multiprocessing import Value
+
+from metrics import write_atomic
+
+CAMPAIGN_FILE = "campaign.json"
+STATE_DIR = ".campaign"
+
+
+def case_seed(seed: int, number: int) -> int:
+    """The seed of case `number` of the campaign seeded with `seed`."""
+    digest = hashlib.sha256(f"{seed}:{number}".encode()).digest()
+    return int.from_bytes(digest[:4], "big") & 0x7fffffff
+
+
+def last_case(test_dir: str) -> int:
+    """The highest case number of the case directories in `test_dir`."""
+    numbers = [int(match.group(1)) for match in
+               map(re.compile(r"case_(\d+)$").match, os.listdir(test_dir)) if match]
+    return max(numbers, default=0)
+
+
+class Campaign:
+    """A `Campaign` keeps the state of a fuzzing campaign in its test directory.
+
+    Case numbers are reserved here, so a campaign started in a directory
+    that already holds cases continues after the last one. Every reserved
+    case is registered as in flight (a marker file in `.campaign/inflight`)
+    until the oracle is done with it, and the last reserved number is kept
+    in `.campaign/epoch`; both are updated as cases go, so nothing is lost
+    on a crash. Each case gets a seed derived from the campaign seed and
+    its number, from which csmith and the mutator regenerate exactly the
+    same case. A resumed campaign regenerates its in-flight cases first,
+    then goes on from its last case until `generate_num` cases in total.
+    `campaign.json` is a periodic checkpoint of this state. Cases that
+    stay in flight for too long (e.g. their node died) can be handed out
+    again with `expire`.
+
+    Reductions are resumed from their own `reduce_state.json` (see
+    `Reducer.pending`).
+
+    Attributes:
+        test_dir: The directory of the cases.
+        seed: The seed of the campaign.
+        base: The case number the campaign started after.
+        generate_num: The number of cases of the campaign (0 means no limit).
+        epoch: The last reserved case number, shared by the workers.
+        replay: The numbers of the cases to regenerate before new ones.
+    """
+    def __init__(self, test_dir: str, generate_num: int = 0, seed: int = None,
+                 resume: bool = False):
+        self.test_dir = test_dir
+        self.generate_num = generate_num
+        self.state_dir = os.path.join(test_dir, STATE_DIR)
+        self.inflight_dir = os.path.join(self.state_dir, "inflight")
+        os.makedirs(self.inflight_dir, exist_ok=True)
+
+        state = self.load() if resume else None
+        inflight = self.inflight()
+        if state is not None:
+            self.seed = state["seed"]
+            self.base = state["base"]
+            self.generate_num = state["generate_num"]
+            epoch = max(state["epoch"], self.saved_epoch(), last_case(test_dir), *inflight)
+            self.replay = []
+            for number in inflight:
+                if os.path.exists(os.path.join(test_dir, f"case_{number}", "log.json")):
+                    # saved by the oracle just before the crash
+                    self.finish(f"case_{number}")
+                else:
+                    self.replay.append(number)
+        else:
+            self.seed = seed if seed is not None else random.randrange(1 << 31)
+            epoch = self.base = max(self.saved_epoch(), last_case(test_dir), *inflight)
+            self.replay = []
+            # cases of a campaign that is not resumed are lost
+            for number in inflight:
+                self.finish(f"case_{number}")
+        self.epoch = Value('i', epoch)
+        self._replayed = Value('i', 0)
+        self._stop_event = Event()
+        self._thread = None
+        self.checkpoint()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.test_dir, CAMPAIGN_FILE)
+
+    def load(self) -> dict | None:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def saved_epoch(self) -> int:
+        try:
+            with open(os.path.join(self.state_dir, "epoch"), "r") as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def inflight(self) -> list[int]:
+        return sorted(int(name[len("case_"):]) for name in os.listdir(self.inflight_dir)
+                      if name.startswith("case_"))
+
+    def case_seed(self, number: int) -> int:
+        return case_seed(self.seed, number)
+
+    def next_case(self) -> int | None:
+        """Reserve the next case: an interrupted one first, then a new one.
+
+        Returns:
+            The case number, or None once the campaign generated all its cases.
+        """
+        with self._replayed.get_lock():
+            while self._replayed.value < len(self.replay):
+                self._replayed.value += 1
+                number = self.replay[self._replayed.value - 1]
+                marker = os.path.join(self.inflight_dir, f"case_{number}")
+                if os.path.exists(marker):
+                    # the lease of the case starts again
+                    os.utime(marker)
+                    return number
+        with self.epoch.get_lock():
+            if self.generate_num and self.epoch.value - self.base >= self.generate_num:
+                return None
+            self.epoch.value += 1
+            number = self.epoch.value
+            open(os.path.join(self.inflight_dir, f"case_{number}"), "w").close()
+            write_atomic(os.path.join(self.state_dir, "epoch"), str(number))
+        return number
+
+    @property
+    def done(self) -> bool:
+        """True once every case of the campaign was reserved and tested."""
+        with self.epoch.get_lock():
+            reserved = self.generate_num and self.epoch.value - self.base >= self.generate_num
+        return bool(reserved) and self._replayed.value >= len(self.replay) \
+            and not self.inflight()
+
+    def expire(self, lease: float) -> list[int]:
+        """Hand out again the cases reserved more than `lease` seconds ago.
+
+        The cases are regenerated from their seed by whoever reserves them
+        next; if the first one finishes after all, the other is skipped
+        (or tested twice). Only a campaign reserving its cases from a
+        single process (e.g. a coordinator) sees the expired cases.
+
+        Returns:
+            The numbers of the expired cases.
+        """
+        deadline = time.time() - lease
+        expired = []
+        with self._replayed.get_lock():
+            waiting = set(self.replay[self._replayed.value:])
+            for number in self.inflight():
+                if number in waiting:
+                    continue
+                try:
+                    reserved = os.stat(os.path.join(self.inflight_dir, f"case_{number}")).st_mtime
+                except FileNotFoundError:
+                    continue
+                if reserved < deadline:
+                    self.replay.append(number)
+                    expired.append(number)
+        return expired
+
+    def finish(self, case_name: str):
+        """Unregister a case the oracle is done with."""
+        try:
+            os.remove(os.path.join(self.inflight_dir, case_name))
+        except FileNotFoundError:
+            pass
+
+    def checkpoint(self) -> dict:
+        with self.epoch.get_lock():
+            state = {
+                "seed": self.seed,
+                "base": self.base,
+                "generate_num": self.generate_num,
+                "epoch": self.epoch.value,
+                "in_flight": self.inflight(),
+                "updated": time.time()
+            }
+        write_atomic(self.path, json.dumps(state, indent=2))
+        return state
+
+    def start(self, interval: float = 60):
+        """Write a checkpoint every `interval` seconds (from a thread)."""
+        def run():
+            while not self._stop_event.wait(interval):
+                self.checkpoint()
+        self._thread = Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.checkpoint()
@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from tempfile import mkstemp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    case_dir TEXT PRIMARY KEY,
+    signature TEXT,
+    saved REAL NOT NULL,
+    seed INTEGER,
+    recipe TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    case_dir TEXT NOT NULL,
+    basename TEXT NOT NULL,
+    is_mutant INTEGER NOT NULL,
+    info TEXT NOT NULL,
+    blob TEXT,
+    PRIMARY KEY (case_dir, basename)
+);
+CREATE TABLE IF NOT EXISTS results (
+    case_dir TEXT NOT NULL,
+    basename TEXT NOT NULL,
+    level TEXT NOT NULL,
+    result TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    PRIMARY KEY (case_dir, basename, level)
+);
+CREATE TABLE IF NOT EXISTS options (
+    case_dir TEXT NOT NULL,
+    basename TEXT NOT NULL,
+    func TEXT NOT NULL,
+    opt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_verdict ON results (level, verdict);
+CREATE INDEX IF NOT EXISTS options_opt ON options (opt, case_dir, basename);
+CREATE INDEX IF NOT EXISTS cases_signature ON cases (signature);
+"""
+# columns added to the tables of older stores
+COLUMNS = {"cases": (("seed", "INTEGER"), ("recipe", "TEXT"))}
+
+
+class CaseStore:
+    """A `CaseStore` keeps saved cases in a SQLite database.
+
+    Each case is stored as it is logged by `CaseManager.log`: its
+    signature, seed and recipe, and for every file the compiler, arguments, results, run
+    stats, compile errors and (for mutants) the options of each function.
+    The results, with their verdict against the orig, and the options are
+    also indexed, so cases can be queried without walking their
+    directories. Sources are kept as zlib-compressed blobs named by their
+    hash, in a directory tree sharded by the first bytes of the hash.
+    The database is opened per process and thread, so a store can be
+    shared by forked workers and by the threads of each.
+
+    Attributes:
+        store_dir: The directory holding `cases.db` and the `blobs` tree.
+    """
+    def __init__(self, store_dir: str):
+        self.store_dir = os.path.abspath(store_dir)
+        self.blob_dir = os.path.join(self.store_dir, "blobs")
+        self.db_path = os.path.join(self.store_dir, "cases.db")
+        self._local = threading.local()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.db.executescript(SCHEMA)
+        for table, columns in COLUMNS.items():
+            known = {row[1] for row in self.db.execute(f"PRAGMA table_info({table})")}
+            for name, type in columns:
+                if name not in known:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {type}")
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        local = self._local
+        # a forked child inherits the connection of the thread that forked it
+        if getattr(local, "pid", None) != os.getpid():
+            local.db = sqlite3.connect(self.db_path, timeout=60)
+            local.db.execute("PRAGMA journal_mode=WAL")
+            local.pid = os.getpid()
+        return local.db
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest[2:4], digest)
+
+    def put_blob(self, text: str) -> str:
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp, path)
+        return digest
+
+    def get_blob(self, digest: str) -> str:
+        with open(self.blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def put(self, log: dict, sources: dict[str : str] = None):
+        """Store (or replace) the case of `log`, with the `sources` of its files by name."""
+        from signature import verdict
+
+        sources = sources or {}
+        case_dir = log["case_dir"]
+        orig = log["orig"]["res_dict"]
+        checksums = [res for res in orig.values() if verdict(res, None) == "ok"]
+        majority = max(set(checksums), key=checksums.count) if checksums else None
+        blobs = {name: self.put_blob(text) for name, text in sources.items()}
+        with self.db as db:
+            for table in ("cases", "files", "results", "options"):
+                db.execute(f"DELETE FROM {table} WHERE case_dir = ?", (case_dir,))
+            db.execute("INSERT INTO cases (case_dir, signature, saved, seed, recipe) "
+                       "VALUES (?, ?, ?, ?, ?)",
+                       (case_dir, log.get("signature"), time.time(), log.get("seed"),
+                        json.dumps(log["recipe"]) if log.get("recipe") else None))
+            for info in [log["orig"], *log["mutants"]]:
+                name = info["basename"]
+                db.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                           (case_dir, name, int(info["isMutant"]), json.dumps(info),
+                            blobs.get(name)))
+                db.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?)", [
+                    (case_dir, name, level, res,
+                     verdict(res, orig.get(level) if info["isMutant"] else majority))
+                    for level, res in info["res_dict"].items()])
+                db.executemany("INSERT INTO options VALUES (?, ?, ?, ?)", [
+                    (case_dir, name, func, opt)
+                    for func, opts in info.get("function_dict", {}).items() for opt in opts])
+
+    def get(self, case_dir: str) -> dict | None:
+        """The log of the case stored for `case_dir` (None if there is none)."""
+        case = self.db.execute("SELECT signature, seed, recipe FROM cases WHERE case_dir = ?",
+                               (case_dir,)).fetchone()
+        if case is None:
+            return None
+        rows = self.db.execute("SELECT is_mutant, info FROM files WHERE case_dir = ? "
+                               "ORDER BY is_mutant, rowid", (case_dir,)).fetchall()
+        infos = [json.loads(info) for _, info in rows]
+        return {
+            "case_dir": case_dir,
+            "orig": infos[0],
+            "mutants": infos[1:],
+            "signature": case[0],
+            "seed": case[1],
+            "recipe": json.loads(case[2]) if case[2] else None
+        }
+
+    def source(self, case_dir: str, basename: str) -> str | None:
+        row = self.db.execute("SELECT blob FROM files WHERE case_dir = ? AND basename = ?",
+                              (case_dir, basename)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return self.get_blob(row[0])
+
+    def query(self, level: str = None, verdict: str = None, option: str = None,
+              signature: str = None) -> list[str]:
+        """The case directories with a file matching every given condition.
+
+        Args:
+            level: The opt level the verdict is seen at (any level if None).
+            verdict: The verdict of the file at `level`, e.g. `diff` or
+                `compiler crashed` (any verdict if None).
+            option: An option the file applies to one of its functions.
+            signature: The bug signature key of the case.
+        """
+        sql = ["SELECT DISTINCT c.case_dir FROM cases c"]
+        where, params = [], []
+        if level is not None or verdict is not None:
+            sql.append("JOIN results r ON r.case_dir = c.case_dir")
+            if level is not None:
+                where.append("r.level = ?")
+                params.append(level)
+            if verdict is not None:
+                where.append("r.verdict = ?")
+                params.append(verdict)
+        if option is not None:
+            # the option must be applied by the file showing the verdict
+            join = " AND o.basename = r.basename" if len(sql) > 1 else ""
+            sql.append(f"JOIN options o ON o.case_dir = c.case_dir{join}")
+            where.append("o.opt = ?")
+            params.append(option)
+        if signature is not None:
+            where.append("c.signature = ?")
+            params.append(signature)
+        if where:
+            sql.append("WHERE " + " AND ".join(where))
+        sql.append("ORDER BY c.saved")
+        return [row[0] for row in self.db.execute(" ".join(sql), params)]
+
+    def import_dir(self, test_dir: str) -> int:
+        """Store every case directory of `test_dir` holding a `log.json`."""
+        count = 0
+        for name in sorted(os.listdir(test_dir)):
+            log_path = os.path.join(test_dir, name, "log.json")
+            if not os.path.exists(log_path):
+                continue
+            with open(log_path, "r") as f:
+                log = json.load(f)
+            sources = {}
+            for info in [log["orig"], *log["mutants"]]:
+                path = os.path.join(log["case_dir"], info["basename"])
+                if os.path.exists(path):
+                    with open(path, "r") as f:
+                        sources[info["basename"]] = f.read()
+            self.put(log, sources)
+            count += 1
+        return count
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Query the cases of a case store")
+    parser.add_argument("store_dir", type=str)
+    parser.add_argument("--level", type=str, default=None, help="e.g. --level=-O2")
+    parser.add_argument("--verdict", type=str, default=None,
+                        help="ok, diff, compile timeout, compiler crashed, "
+                             "runtime timeout or runtime crashed")
+    parser.add_argument("--option", type=str, default=None, help="e.g. --option=-ftree-vrp")
+    parser.add_argument("--signature", type=str, default=None)
+    parser.add_argument("--show", type=str, default=None, help="print the log of a case")
+    parser.add_argument("--import_dir", type=str, default=None,
+                        help="store the saved cases of a test directory")
+    args = parser.parse_args()
+
+    store = CaseStore(args.store_dir)
+    if args.import_dir:
+        print(f"Imported {store.import_dir(args.import_dir)} cases")
+    elif args.show:
+        print(json.dumps(store.get(args.show), indent=2))
+    else:
+        for case_dir in store.query(args.level, args.verdict, args.option, args.signature):
+            print(case_dir)
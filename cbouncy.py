@@ -2,53 +2,298 @@
 
 import asyncio
 import os
+import sys
+import shutil
 import time
 import argparse
-from tempfile import mkdtemp
+from tempfile import mkdtemp, gettempdir
 
 from filemanager import *
 from generator import ProgramGenerator
 from mutator import CodeMutator
 from oracle import Oracle
 from reducer import Reducer
+from scheduler import StageScheduler, default_workers
+from engine import configure_engine
+from sandbox import configure_sandbox
+from metrics import Metrics, MetricsWriter, set_metrics
+from stage import Stage
+from signature import SignatureIndex
+from notifier import Notifier
+from campaign import Campaign
+from sampler import OptionSampler
+from configs import get_config
 
 args = argparse.ArgumentParser()
-args.add_argument("-t", "--timeout", type=float, default=0.3)
+args.add_argument("-t", "--timeout", type=float, default=10,
+                  help="CPU seconds a test program may use before it is deemed to time out")
 args.add_argument("-c", "--complex_opts", action='store_true')
 args.add_argument("-m", "--max_opts", type=int, default=35)
 args.add_argument("--tmp_path", type=str, default="")
+args.add_argument("--coordinator", type=str, default="",
+                  help="host:port of the coordinator of a distributed campaign (see distributed.py)")
+args.add_argument("--authkey", type=str, default="",
+                  help="shared secret of the coordinator")
+args.add_argument("--resume", action="store_true",
+                  help="resume the campaign checkpointed in --tmp_path where it stopped")
+args.add_argument("--seed", type=int, default=None,
+                  help="seed of the campaign, from which every case is generated (default: random)")
+args.add_argument("--checkpoint_interval", type=float, default=60,
+                  help="seconds between two checkpoints of the campaign (0 disables them)")
 args.add_argument("--gen_clang", action="store_true")
 args.add_argument("--gen_gcc", action="store_true")
-args.add_argument("--generate_num", type=int, default=100)
+args.add_argument("--generate_num", type=int, default=100,
+                  help="number of programs to generate (0 means no limit)")
 args.add_argument("--mutate_num", type=int, default=5)
+args.add_argument("-j", "--jobs", type=int, default=None,
+                  help="compile/run jobs in flight per case (default: cpu count)")
+args.add_argument("--concurrency", type=int, default=0,
+                  help="compile (and run) jobs in flight per worker process "
+                       "(default: cpu count divided among the oracle workers)")
+args.add_argument("--cases_per_worker", type=int, default=1,
+                  help="cases evaluated concurrently by each oracle worker")
+args.add_argument("--full_eval", action="store_true",
+                  help="evaluate every mutant of a case even after a bug is found")
+args.add_argument("--in_memory", action="store_true",
+                  help="keep cases in memory and only write bug-carrying cases to disk")
+args.add_argument("--scratch_dir", type=str, default="",
+                  help="memory-backed directory for executables in --in_memory mode "
+                       "(default: /dev/shm)")
+args.add_argument("--run_memory", type=int, default=1024,
+                  help="address space limit of a test program in MB")
+args.add_argument("--run_output", type=int, default=1024,
+                  help="output size limit of a test program in KB")
+args.add_argument("--cache_dir", type=str, default="",
+                  help="directory of the persistent compile/run result cache")
+args.add_argument("--cache_size", type=int, default=1024,
+                  help="maximum size of the result cache in MB")
+args.add_argument("--pch", action="store_true",
+                  help="compile against precompiled csmith.h headers built for this run")
+args.add_argument("--pch_dir", type=str, default="",
+                  help="directory of precompiled csmith.h headers kept across runs (implies --pch)")
+args.add_argument("--multi_variant", action="store_true",
+                  help="run the orig and the mutants of a case from one binary per level")
+args.add_argument("--split", action="store_true",
+                  help="compile mutants patching few functions function by function, reusing "
+                       "the objects of unchanged functions (no inlining across functions, "
+                       "implies --pch)")
+args.add_argument("--split_dir", type=str, default="",
+                  help="directory of the function objects kept across runs (implies --split)")
+args.add_argument("--case_store", type=str, default="",
+                  help="directory of a database of the saved cases (see casestore.py)")
+args.add_argument("--adaptive", action="store_true",
+                  help="favour the mutation options that made mutants diverge or change code")
+args.add_argument("--explore", type=float, default=0.1,
+                  help="probability of sampling options uniformly with --adaptive")
+args.add_argument("--object_hash", action="store_true",
+                  help="compile to objects and skip running binaries identical to one already run for the case")
+args.add_argument("--workers", type=int, default=0,
+                  help="total number of worker processes (default: cpu count)")
+args.add_argument("--gen_workers", type=int, default=0)
+args.add_argument("--mutate_workers", type=int, default=0)
+args.add_argument("--oracle_workers", type=int, default=0)
+args.add_argument("--reduce_workers", type=int, default=0)
+args.add_argument("--schedule_interval", type=float, default=10,
+                  help="seconds between two rebalances of the stage workers (0 disables)")
+args.add_argument("--no_mail", action="store_true",
+                  help="save bugs without mailing them")
+args.add_argument("--mail_interval", type=float, default=60,
+                  help="seconds between two bug digests mailed")
+args.add_argument("--mail_batch", type=int, default=50,
+                  help="maximum number of bugs in a digest")
+args.add_argument("--mail_attach_size", type=int, default=10,
+                  help="maximum size of the zips attached to a digest in MB")
+args.add_argument("--signatures", type=str, default=None,
+                  help="index of the bug signatures seen so far, shared across runs "
+                       "(default: signatures.json in --tmp_path)")
+args.add_argument("--no_dedup", action="store_true",
+                  help="save every ICE, even if its signature is already known "
+                       "(other bugs are always saved)")
+args.add_argument("--no_reduce", action="store_true",
+                  help="do not reduce the bugs found")
+args.add_argument("--reduce_wall", type=float, default=600,
+                  help="wall seconds the reduction of a case may take")
+args.add_argument("--reduce_cpu", type=float, default=1200,
+                  help="CPU seconds the reduction of a case may use")
+args.add_argument("--max_reductions", type=int, default=1,
+                  help="maximum number of cases reduced at once")
+args.add_argument("--metrics_interval", type=float, default=30,
+                  help="seconds between two metrics snapshots written to the test dir (0 disables)")
 
 class CBouncy:
     def __init__(self, test_dir : str, generate_num: int = 100, mutate_num: int = 10,
-                 timeout: float = 0.3, max_opts: int = 35,
+                 timeout: float = 10, max_opts: int = 35,
                  gen_gcc: bool = True, gen_clang: bool = False,
-                 complex_opts: bool = False, csmith_args=None):
-        buffer1 = CaseBuffer(20)
-        buffer2 = CaseBuffer(5)
-        buffer3 = CaseBuffer(5)
-        self.generator = ProgramGenerator(test_dir, generate_num, csmith_args, output_buffer=buffer1)
-        self.mutator = CodeMutator(mutate_num, complex_opts, max_opts, gen_gcc, gen_clang, input_buffer=buffer1, output_buffer=buffer2)
-        self.oracle = Oracle(timeout, input_buffer=buffer2)
-        self.reducer = Reducer(input_buffer=buffer3, timeout=timeout)
+                 complex_opts: bool = False, csmith_args=None,
+                 jobs: int = None, lazy: bool = True, scratch_dir: str = None,
+                 budget: int = None, workers: dict[str, int] = None,
+                 schedule_interval: float = 10, cases_per_worker: int = 1,
+                 metrics_interval: float = 30, notify: bool = True,
+                 signatures: str = None, mail_interval: float = 60,
+                 mail_batch: int = 50, mail_attach_size: int = 10 << 20,
+                 reduce: bool = True, reduce_wall: float = 600,
+                 reduce_cpu: float = 1200, max_reductions: int = 1,
+                 resume: bool = False, seed: int = None,
+                 checkpoint_interval: float = 60, campaign: Campaign = None,
+                 reductions: ReductionQueue = None, adaptive: bool = False,
+                 explore: float = 0.1, concurrency: int = None):
+        """
+        Args:
+            signatures: The path of the signature index, or the index itself.
+            campaign: The campaign handing out case numbers (by default
+                one in `test_dir`, see `resume` and `seed`).
+            reductions: Where the oracle sends saved bugs (by default the
+                queue of the local reducer, which only runs without it).
+            adaptive: Sample mutation options by their past results
+                (kept in `sampler.json`), exploring uniformly with
+                probability `explore`.
+            concurrency: The compile/run jobs in flight per worker process
+                (by default the CPU count divided among the oracle workers).
+        """
+        budget = budget or os.cpu_count() or 1
+        num_workers = default_workers(budget)
+        num_workers.update({k: v for k, v in (workers or {}).items() if v})
+        # every oracle worker runs its own engine, so they share the cores
+        # rather than each keeping one job per core in flight
+        configure_engine(concurrency or max(1, (os.cpu_count() or 1) // num_workers["oracle"]))
+
+        buffer1 = CaseBuffer(max(4, budget // 2))
+        buffer2 = CaseBuffer(max(4, budget // 2))
+        # saved bugs are small on the queue (a case dir each), so it can be deep
+        buffer3 = ReductionQueue(1024)
+        self.buffers = {"generated": buffer1, "mutated": buffer2, "bugs": buffer3}
+        # shared metrics must exist before the workers are forked
+        self.metrics = Metrics()
+        set_metrics(self.metrics)
+        self.campaign = campaign or Campaign(test_dir, generate_num, seed, resume)
+        self.checkpoint_interval = checkpoint_interval
+        self.sampler = None
+        self.sampler_path = os.path.join(test_dir, "sampler.json")
+        if adaptive:
+            self.sampler = OptionSampler(explore=explore)
+            if os.path.exists(self.sampler_path):
+                self.sampler.load(self.sampler_path)
+        self.generator = ProgramGenerator(test_dir, generate_num, csmith_args, output_buffer=buffer1,
+                                          scratch_dir=scratch_dir, num_workers=num_workers["generator"],
+                                          campaign=self.campaign)
+        self.mutator = CodeMutator(mutate_num, complex_opts, max_opts, gen_gcc, gen_clang, input_buffer=buffer1, output_buffer=buffer2,
+                                   num_workers=num_workers["mutator"], sampler=self.sampler)
+        self.notifier = None
+        if notify:
+            self.notifier = Notifier(get_config().mail, mail_interval, mail_batch, mail_attach_size)
+        self.oracle = Oracle(timeout, input_buffer=buffer2, jobs=jobs, lazy=lazy,
+                             num_workers=num_workers["oracle"],
+                             cases_per_worker=cases_per_worker, notifier=self.notifier,
+                             signatures=SignatureIndex(signatures)
+                                        if isinstance(signatures, str) else signatures,
+                             reductions=reductions if reductions is not None
+                                        else buffer3 if reduce else None,
+                             campaign=self.campaign, sampler=self.sampler)
+        # saved bugs sent elsewhere (e.g. to a coordinator) are reduced there
+        self.reducer = None
+        if reduce and reductions is None:
+            self.reducer = Reducer(input_buffer=buffer3, timeout=timeout,
+                                   num_workers=num_workers["reducer"],
+                                   wall_budget=reduce_wall, cpu_budget=reduce_cpu,
+                                   max_reductions=max_reductions)
+        self.scheduler = None
+        if schedule_interval > 0:
+            self.scheduler = StageScheduler([self.generator, self.mutator, self.oracle],
+                                            [buffer1, buffer2], budget, schedule_interval,
+                                            fixed=[self.reducer] if self.reducer else [])
+        self.metrics_writer = None
+        if metrics_interval > 0:
+            self.metrics_writer = MetricsWriter(self.metrics, test_dir, metrics_interval,
+                                                gauges=self.gauges)
+
+    @property
+    def stages(self) -> list[Stage]:
+        stages = [self.generator, self.mutator, self.oracle]
+        if self.reducer is not None:
+            stages.append(self.reducer)
+        if self.notifier is not None:
+            stages.append(self.notifier)
+        return stages
+
+    def gauges(self) -> dict[str, dict[str, float]]:
+        return {
+            "buffer_depth": {name: buffer.depth for name, buffer in self.buffers.items()},
+            "buffer_size": {name: buffer.size for name, buffer in self.buffers.items()},
+            "stage_workers": {stage.name: stage.size for stage in self.stages},
+            "stage_service_seconds": {stage.name: stage.service_time or 0
+                                      for stage in self.stages},
+        }
 
     def run(self):
         print("--- Start testing ---")
+        # resume the reductions interrupted by a previous run
+        if self.reducer is not None:
+            for case_dir in Reducer.pending(self.generator.test_dir):
+                self.buffers["bugs"].push(case_dir, (0, 0))
 
         self.generator.run()
         self.mutator.run()
         self.oracle.run()
-        self.reducer.run()
+        if self.reducer is not None:
+            self.reducer.run()
+        if self.notifier is not None:
+            self.notifier.run()
+        if self.metrics_writer is not None:
+            self.metrics_writer.start()
+        if self.checkpoint_interval > 0:
+            self.campaign.start(self.checkpoint_interval)
+
+        # generators return once `generate_num` cases are generated
+        while any(process.is_alive() for process, _ in self.generator.workers):
+            self.schedule()
+            time.sleep(0.5)
+        self.drain()
+        self.terminate()
 
-        self.generator.join()
-        self.mutator.join()
-        self.oracle.join()
-        self.reducer.join()
+    def schedule(self):
+        """Let the scheduler resize the stages; only called from the main thread."""
+        if self.scheduler is not None:
+            self.scheduler.tick()
+
+    def drain(self, poll: float = 0.5) -> bool:
+        """Wait until every generated case went through the oracle.
+
+        Returns:
+            bool: False if the mutator or oracle workers all died before
+        """
+        while True:
+            with self.generator.done.get_lock():
+                generated = self.generator.done.value
+            with self.oracle.done.get_lock():
+                tested = self.oracle.done.value
+            if tested >= generated:
+                return True
+            self.schedule()
+            for stage in (self.mutator, self.oracle):
+                if not any(process.is_alive() for process, _ in stage.workers):
+                    print(f"Every {stage.name} worker died, {generated - tested} cases "
+                          f"left untested", file=sys.stderr)
+                    return False
+            time.sleep(poll)
+
+    def terminate(self):
+        """Kill every stage worker."""
+        if self.notifier is not None:
+            # mail the bugs still pending before killing the notifier
+            self.notifier.stop(timeout=self.notifier.timeout * 2)
+        for stage in self.stages:
+            stage.terminate()
+        if self.metrics_writer is not None:
+            self.metrics_writer.stop()
+        self.campaign.stop()
+        if self.sampler is not None:
+            self.sampler.save(self.sampler_path)
+        self.buffers["bugs"].close()
 
 def run(args = None, csmith_args=None):
+    if args.resume and not args.tmp_path:
+        print("--resume needs the --tmp_path of the campaign")
+        return
     if args.tmp_path:
         test_dir = os.path.abspath(args.tmp_path)
         if not os.path.exists(test_dir):
@@ -67,11 +312,73 @@ def run(args = None, csmith_args=None):
     timeout = args.timeout
     max_opts = args.max_opts
     complex_opts = args.complex_opts
+    jobs = args.jobs
+    lazy = not args.full_eval
+    workers = {"generator": args.gen_workers, "mutator": args.mutate_workers,
+               "oracle": args.oracle_workers, "reducer": args.reduce_workers}
+    scratch_dir = None
+    if args.in_memory:
+        scratch_root = args.scratch_dir or ("/dev/shm" if os.path.isdir("/dev/shm") else gettempdir())
+        scratch_dir = mkdtemp(prefix="cbouncy_", dir=scratch_root)
+    configure_sandbox(args.run_memory << 20, args.run_output << 10)
+    if args.cache_dir:
+        set_result_cache(args.cache_dir, args.cache_size << 20)
+    if args.split or args.split_dir:
+        # every unit of a split program includes csmith.h again
+        args.pch = True
+    pch_dir = args.pch_dir
+    if args.pch and not pch_dir:
+        pch_dir = mkdtemp(prefix="cbouncy_pch_", dir=gettempdir())
+    if pch_dir:
+        set_pch_dir(pch_dir)
+    set_object_hashing(args.object_hash)
+    set_multi_variant(args.multi_variant)
+    split_dir = args.split_dir
+    if args.split and not split_dir:
+        split_dir = mkdtemp(prefix="cbouncy_objects_", dir=gettempdir())
+    if split_dir:
+        set_split_compilation(split_dir)
+    if args.case_store:
+        set_case_store(args.case_store)
+
+    campaign = reductions = None
+    signatures = None
+    if not args.no_dedup:
+        signatures = args.signatures or os.path.join(test_dir, "signatures.json")
+    if args.coordinator:
+        # case numbers, signatures and saved bugs are shared through the coordinator
+        import socket
+        from distributed import connect, RemoteCampaign, RemoteStore, report
+        coordinator = connect(args.coordinator, args.authkey)
+        node = f"{socket.gethostname()}:{os.getpid()}"
+        campaign = RemoteCampaign(coordinator)
+        reductions = RemoteStore(coordinator, node)
+        if not args.no_dedup:
+            signatures = reductions
 
     cb = CBouncy(test_dir, generate_num, mutate_num, timeout,
                  max_opts, gen_gcc, gen_clang, complex_opts,
-                 csmith_args)
+                 csmith_args, jobs, lazy, scratch_dir,
+                 args.workers, workers, args.schedule_interval,
+                 args.cases_per_worker, args.metrics_interval,
+                 not args.no_mail, signatures,
+                 args.mail_interval, args.mail_batch, args.mail_attach_size << 20,
+                 not args.no_reduce, args.reduce_wall, args.reduce_cpu,
+                 args.max_reductions, args.resume, args.seed,
+                 args.checkpoint_interval, campaign, reductions,
+                 args.adaptive, args.explore, args.concurrency)
+    if args.coordinator:
+        report(coordinator, node, cb.metrics, args.metrics_interval or 30)
     cb.run()
+    if args.coordinator:
+        coordinator.report(node, cb.metrics.snapshot()["counters"])
+    if args.pch and not args.pch_dir:
+        shutil.rmtree(pch_dir, ignore_errors=True)
+    if args.split and not args.split_dir:
+        shutil.rmtree(split_dir, ignore_errors=True)
+    if scratch_dir:
+        # bug-carrying cases were written to the test dir, the rest is scratch
+        shutil.rmtree(scratch_dir, ignore_errors=True)
     if not os.listdir(test_dir):
         os.rmdir(test_dir)
 
@@ -1,5 +1,6 @@
 import os
 import json
+from functools import cached_property
 
 UNCOMPILED = "uncompiled"
 COMPILE_TIMEOUT = "compile timeout"
@@ -7,10 +8,53 @@ COMPILER_CRASHED = "compiler crashed"
 RUNTIME_TIMEOUT = "runtime timeout"
 RUNTIME_CRASHED = "runtime crashed"
 
-with open("config.json", "r") as f:
-    MAIL_CONFIG = json.load(f)
 
-CSMITH_HOME = os.environ["CSMITH_HOME"]
+class Config:
+    """The settings read from the environment, each resolved on first use.
+
+    Importing this module reads nothing, so tools that never mail or run
+    csmith (e.g. the interestingness test of creduce) neither pay for the
+    settings nor fail when they are missing.
+
+    Attributes:
+        config_path: The JSON file holding the mail settings.
+        mail: The mail settings (see `utils.smtp_connect`).
+        csmith_home: The csmith installation, from `$CSMITH_HOME`.
+    """
+    def __init__(self, config_path: str = "config.json"):
+        self.config_path = os.path.abspath(config_path)
+
+    @cached_property
+    def mail(self) -> dict:
+        with open(self.config_path, "r") as f:
+            return json.load(f)
+
+    @cached_property
+    def csmith_home(self) -> str:
+        try:
+            return os.environ["CSMITH_HOME"]
+        except KeyError:
+            raise RuntimeError("CSMITH_HOME is not set") from None
+
+
+_CONFIG : Config | None = None
+
+
+def get_config() -> Config:
+    """The process-wide `Config`, created on first use."""
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = Config()
+    return _CONFIG
+
+
+def __getattr__(name: str):
+    # the former module constants, resolved lazily
+    if name == "MAIL_CONFIG":
+        return get_config().mail
+    if name == "CSMITH_HOME":
+        return get_config().csmith_home
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 SIMPLE_OPTS = (
     "-O0", "-O1", "-O2", "-O3", "-Os", "-Ofast", "-Og"
@@ -129,12 +173,8 @@ SUFFIX_TEXT = "/\* --- FUNCTIONS --- \*/"
 OPT_FORMAT = '__attribute__((optimize("{}")))'
 
 
-SCRIPT = """#!/bin/bash
-cd {} 
-echo $PWD > pwd
-python3 {}/reduce.py {} >> error 
-exit_code=$?
-echo $exit_code > exit_code
-
-exit $exit_code
+# interestingness test of creduce: ask the validator server of the case
+# (see `reduce.py`) about the candidate in creduce's working directory
+SCRIPT = """#!/bin/sh
+exec python3 -S {} {} "$PWD/{}"
 """
\ No newline at end of file
@@ -0,0 +1,54 @@
+from typing import Callable, Hashable, Sequence
+
+
+def ddmin(items: Sequence[Hashable], test: Callable[[list], bool]) -> list:
+    """Minimize `items` with the delta debugging algorithm (ddmin).
+
+    Args:
+        items: The elements to minimize, e.g. (function, option) pairs.
+        test: Returns True if the given subset of `items` is still
+            interesting (i.e. still triggers the bug). `items` itself is
+            assumed to be interesting.
+
+    Returns:
+        A 1-minimal interesting subset of `items`, in their original order.
+        Every subset is tested at most once.
+    """
+    tested: dict[frozenset, bool] = {}
+
+    def interesting(subset: list) -> bool:
+        key = frozenset(subset)
+        if key not in tested:
+            tested[key] = test(subset)
+        return tested[key]
+
+    current = list(items)
+    if interesting([]):
+        return []
+
+    n = 2
+    while len(current) >= 2:
+        chunk = len(current) / n
+        subsets = [current[int(i * chunk):int((i + 1) * chunk)] for i in range(n)]
+        reduced = False
+
+        # reduce to a subset
+        for subset in subsets:
+            if subset and interesting(subset):
+                current, n, reduced = subset, 2, True
+                break
+
+        # reduce to a complement
+        if not reduced:
+            for subset in subsets:
+                complement = [item for item in current if item not in subset]
+                if n > 2 and complement and interesting(complement):
+                    current, n, reduced = complement, max(n - 1, 2), True
+                    break
+
+        if not reduced:
+            if n >= len(current):
+                break
+            n = min(n * 2, len(current))
+
+    return current
@@ -0,0 +1,263 @@
+"""Distributed fuzzing: a coordinator serving worker nodes over TCP.
+
+The coordinator owns the campaign (case numbers and seeds), the bug
+signatures and the central store of saved bugs, which it reduces:
+
+    python3 distributed.py --listen 0.0.0.0:7878 --authkey secret \\
+        --tmp_path campaign --generate_num 100000
+
+Worker nodes run the usual pipeline (generator, mutator, oracle), take
+their case numbers from the coordinator, and upload the bugs they find:
+
+    python3 cbouncy.py --coordinator host:7878 --authkey secret --tmp_path work
+
+Nodes do not talk to each other and only call the coordinator once per
+case (and once per bug), so throughput grows with the number of nodes.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+from threading import Thread, Lock
+from multiprocessing.managers import BaseManager
+
+from campaign import Campaign, case_seed
+from signature import SignatureIndex
+from filemanager import ReductionQueue
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class Coordinator:
+    """A `Coordinator` serves the shared state of a distributed campaign.
+
+    It is hosted by a `CoordinatorManager` server, which calls it from one
+    thread per connection.
+
+    Attributes:
+        campaign: The campaign handing out case numbers.
+        store_dir: The directory of the uploaded bugs (`case_N` and `case_N.zip`).
+        signatures: The index of the bugs found by all nodes.
+        reductions: The queue of the central reducer (None disables reduction).
+        uploaded: The number of bugs uploaded.
+        queued: The number of uploaded bugs queued for reduction.
+    """
+    def __init__(self, campaign: Campaign, store_dir: str,
+                 signatures: SignatureIndex, reductions: ReductionQueue = None):
+        self.campaign = campaign
+        self.store_dir = store_dir
+        self.signatures = signatures
+        self.reductions = reductions
+        self.uploaded = 0
+        self.queued = 0
+        self.reports: dict[str, dict] = {}
+        self._lock = Lock()
+
+    def next_case(self) -> int | None:
+        return self.campaign.next_case()
+
+    def seed(self) -> int:
+        return self.campaign.seed
+
+    def finish(self, case_name: str):
+        self.campaign.finish(case_name)
+
+    def record(self, key: str, components: dict, case_dir: str) -> int:
+        return self.signatures.record(key, components, case_dir)
+
+    def upload(self, node: str, case_name: str, data: bytes, priority: tuple) -> bool:
+        """Store the zip of a saved bug and queue it for reduction.
+
+        Returns:
+            bool: False if the reduction queue is full and the bug is only stored
+
+        Raises:
+            ValueError: If `case_name` is not a case name (`case_N`), which
+                could otherwise write or remove files outside `store_dir`.
+        """
+        if os.path.basename(case_name) != case_name or not re.fullmatch(r"case_\d+", case_name):
+            raise ValueError(f"invalid case name {case_name!r}")
+        case_dir = os.path.join(self.store_dir, case_name)
+        with open(f"{case_dir}.zip", "wb") as f:
+            f.write(data)
+        shutil.rmtree(case_dir, ignore_errors=True)
+        with zipfile.ZipFile(f"{case_dir}.zip") as archive:
+            archive.extractall(case_dir)
+        # the log still points to the directory of the node
+        log_path = os.path.join(case_dir, "log.json")
+        with open(log_path, "r") as f:
+            log = json.load(f)
+        log["case_dir"] = case_dir
+        log["node"] = node
+        with open(log_path, "w") as f:
+            json.dump(log, f)
+        with self._lock:
+            self.uploaded += 1
+        if self.reductions is None:
+            return True
+        if not self.reductions.push(case_dir, tuple(priority)):
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def report(self, node: str, counters: dict):
+        with self._lock:
+            self.reports[node] = counters
+
+    def status(self) -> dict:
+        with self._lock:
+            totals = {}
+            for counters in self.reports.values():
+                for name, value in counters.items():
+                    totals[name] = totals.get(name, 0) + value
+            return {"nodes": len(self.reports), "uploaded": self.uploaded,
+                    "epoch": self.campaign.epoch.value, "counters": totals}
+
+
+def connect(address: str, authkey: str):
+    """A proxy of the `Coordinator` served at `address`."""
+    CoordinatorManager.register("coordinator")
+    manager = CoordinatorManager(address=parse_address(address), authkey=authkey.encode())
+    manager.connect()
+    return manager.coordinator()
+
+
+class RemoteCampaign:
+    """The campaign of a worker node: case numbers come from the coordinator.
+
+    Case seeds are derived locally from the campaign seed, and checkpoints
+    are left to the coordinator.
+    """
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+        self.seed = coordinator.seed()
+
+    def next_case(self) -> int | None:
+        return self.coordinator.next_case()
+
+    def case_seed(self, number: int) -> int:
+        return case_seed(self.seed, number)
+
+    def finish(self, case_name: str):
+        self.coordinator.finish(case_name)
+
+    def start(self, interval: float = 60):
+        pass
+
+    def stop(self):
+        pass
+
+
+class RemoteStore:
+    """The bug store of a worker node, standing in for its signature index
+    and reduction queue: saved bugs are deduplicated and uploaded to the
+    coordinator."""
+    def __init__(self, coordinator, node: str):
+        self.coordinator = coordinator
+        self.node = node
+
+    def record(self, key: str, components: dict, case_dir: str) -> int:
+        return self.coordinator.record(key, components, f"{self.node}:{case_dir}")
+
+    def push(self, case_dir: str, priority: tuple = ()) -> bool:
+        with open(f"{case_dir}.zip", "rb") as f:
+            data = f.read()
+        return self.coordinator.upload(self.node, os.path.basename(case_dir), data, priority)
+
+
+def report(coordinator, node: str, metrics, interval: float):
+    """Send the counters of this node to the coordinator every `interval` seconds."""
+    def run():
+        while True:
+            time.sleep(interval)
+            coordinator.report(node, metrics.snapshot()["counters"])
+    Thread(target=run, daemon=True).start()
+
+
+def serve(args):
+    from reducer import Reducer
+    from metrics import Metrics, set_metrics
+
+    store_dir = os.path.abspath(args.tmp_path)
+    os.makedirs(store_dir, exist_ok=True)
+    campaign = Campaign(store_dir, args.generate_num, args.seed, args.resume)
+    set_metrics(Metrics())
+    reductions = reducer = None
+    pending = 0
+    if not args.no_reduce:
+        reductions = ReductionQueue(1024)
+        pending = sum(reductions.push(case_dir, (0, 0))
+                      for case_dir in Reducer.pending(store_dir))
+        reducer = Reducer(reductions, args.timeout, args.reduce_workers,
+                          args.reduce_wall, args.reduce_cpu, args.max_reductions)
+    coordinator = Coordinator(campaign, store_dir,
+                              SignatureIndex(os.path.join(store_dir, "signatures.json")),
+                              reductions)
+    # reducers are forked before the server starts its threads
+    if reducer is not None:
+        reducer.run()
+    CoordinatorManager.register("coordinator", callable=lambda: coordinator)
+    manager = CoordinatorManager(address=parse_address(args.listen),
+                                 authkey=args.authkey.encode())
+    server = manager.get_server()
+    Thread(target=server.serve_forever, daemon=True).start()
+    campaign.start(args.checkpoint_interval)
+    print(f"Coordinating {store_dir} on {args.listen}")
+
+    try:
+        while not campaign.done or \
+                (reducer is not None and
+                 reducer.done.value < coordinator.queued + pending):
+            time.sleep(args.status_interval)
+            if args.lease > 0:
+                # the nodes testing these cases are presumably gone
+                expired = campaign.expire(args.lease)
+                if expired:
+                    print(f"Handing out {len(expired)} expired cases again")
+            print(json.dumps(coordinator.status()))
+    finally:
+        campaign.stop()
+        if reducer is not None:
+            reducer.terminate()
+            reductions.close()
+        print(json.dumps(coordinator.status()))
+
+
+parser = argparse.ArgumentParser(description="Coordinate a distributed CBouncy campaign")
+parser.add_argument("--listen", type=str, default="0.0.0.0:7878", help="host:port to serve nodes on")
+parser.add_argument("--authkey", type=str, required=True,
+                    help="shared secret of the coordinator and its nodes")
+parser.add_argument("--tmp_path", type=str, required=True,
+                    help="directory of the campaign and of the uploaded bugs")
+parser.add_argument("--generate_num", type=int, default=100,
+                    help="number of programs of the campaign (0 means no limit)")
+parser.add_argument("--seed", type=int, default=None)
+parser.add_argument("--resume", action="store_true")
+parser.add_argument("--checkpoint_interval", type=float, default=60)
+parser.add_argument("--status_interval", type=float, default=10)
+parser.add_argument("--lease", type=float, default=3600,
+                    help="seconds a node may keep a case before it is handed out again (0 disables)")
+parser.add_argument("--timeout", type=float, default=10,
+                    help="run timeout of the reductions of cases logged without one")
+parser.add_argument("--no_reduce", action="store_true")
+parser.add_argument("--reduce_workers", type=int, default=1)
+parser.add_argument("--reduce_wall", type=float, default=600)
+parser.add_argument("--reduce_cpu", type=float, default=1200)
+parser.add_argument("--max_reductions", type=int, default=1)
+
+
+if __name__ == "__main__":
+    serve(parser.parse_args())
+    sys.exit(0)
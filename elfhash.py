@@ -0,0 +1,101 @@
+import struct
+import hashlib
+
+SHF_ALLOC = 0x2
+SHT_SYMTAB = 2
+SHT_RELA = 4
+SHT_NOBITS = 8
+SHT_REL = 9
+STT_FILE = 4
+
+# (section header, symbol) struct formats per ELF class
+FORMATS = {
+    1: ("IIIIIIIIII", "IIIBBH"), # ELF32
+    2: ("IIQQQQIIQQ", "IBBHQQ"), # ELF64
+}
+
+
+class Section:
+    def __init__(self, name: int, type: int, flags: int, offset: int,
+                 size: int, link: int):
+        self.name = name
+        self.type = type
+        self.flags = flags
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.label = b""
+
+
+def _sections(data: bytes) -> list[Section]:
+    ei_class, endian = data[4], _endian(data)
+    shdr, _ = FORMATS[ei_class]
+    if ei_class == 2:
+        shoff, = struct.unpack_from(f"{endian}Q", data, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from(f"{endian}HHH", data, 0x3A)
+    else:
+        shoff, = struct.unpack_from(f"{endian}I", data, 0x20)
+        shentsize, shnum, shstrndx = struct.unpack_from(f"{endian}HHH", data, 0x2E)
+
+    sections = []
+    for i in range(shnum):
+        # both classes share the field order, only the widths differ
+        name, type, flags, _, offset, size, link, _, _, _ = \
+            struct.unpack_from(f"{endian}{shdr}", data, shoff + i * shentsize)
+        sections.append(Section(name, type, flags, offset, size, link))
+    names = sections[shstrndx]
+    for section in sections:
+        end = data.index(b"\0", names.offset + section.name)
+        section.label = data[names.offset + section.name:end]
+    return sections
+
+
+def _endian(data: bytes) -> str:
+    return "<" if data[5] == 1 else ">"
+
+
+def _string(data: bytes, strtab: Section, index: int) -> bytes:
+    start = strtab.offset + index
+    return data[start:data.index(b"\0", start)]
+
+
+def object_hash(path: str) -> str:
+    """Hash the code and data of a relocatable object.
+
+    Two objects hash the same if their allocated sections (code, data,
+    read-only data and the size of bss), relocations and symbols match,
+    so they link to the same program. The name of the source file (an
+    `STT_FILE` symbol) and other non-allocated sections such as
+    `.comment` are ignored. A file that is not an ELF object is hashed as
+    a whole.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    h = hashlib.sha256()
+    if data[:4] != b"\x7fELF" or data[4] not in FORMATS:
+        h.update(data)
+        return h.hexdigest()
+
+    ei_class, endian = data[4], _endian(data)
+    _, sym = FORMATS[ei_class]
+    sections = _sections(data)
+    for section in sections:
+        if section.flags & SHF_ALLOC or section.type in (SHT_REL, SHT_RELA):
+            h.update(struct.pack("<IQQ", section.type, section.flags, section.size))
+            h.update(section.label + b"\0")
+            if section.type != SHT_NOBITS:
+                h.update(data[section.offset:section.offset + section.size])
+        elif section.type == SHT_SYMTAB:
+            strtab = sections[section.link]
+            entry_size = struct.calcsize(f"{endian}{sym}")
+            for offset in range(section.offset, section.offset + section.size, entry_size):
+                fields = struct.unpack_from(f"{endian}{sym}", data, offset)
+                if ei_class == 2:
+                    name, info, other, shndx, value, size = fields
+                else:
+                    name, value, size, info, other, shndx = fields
+                if info & 0xf == STT_FILE:
+                    continue
+                h.update(_string(data, strtab, name) + b"\0")
+                h.update(struct.pack("<BBHQQ", info, other, shndx, value, size))
+    return h.hexdigest()
@@ -0,0 +1,136 @@
+import os
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from sandbox import RunResult, run_sandboxed, apply_limits
+
+
+class JobResult:
+    """The outcome of a subprocess job.
+
+    Attributes:
+        returncode: The exit code of the process (None if it timed out).
+        stdout: The captured standard output.
+        stderr: The captured standard error.
+    """
+    def __init__(self, returncode: int | None, stdout: bytes = b"", stderr: bytes = b""):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def timed_out(self) -> bool:
+        return self.returncode is None
+
+
+class ExecutionEngine:
+    """An `ExecutionEngine` runs compile and run jobs as asyncio subprocesses.
+
+    Jobs are bounded per resource class (compiling and running), so a single
+    Python process can keep hundreds of jobs in flight while never running
+    more than `limits[cls]` of a class at once. Semaphores are created per
+    event loop, so the engine may be shared by successive `asyncio.run` calls.
+
+    Attributes:
+        limits: The maximum number of concurrent jobs per resource class.
+    """
+    CLASSES = ("compile", "run")
+
+    def __init__(self, concurrency: int = None):
+        self.limits: dict[str, int] = {}
+        self.configure(concurrency)
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._executor = None
+
+    def configure(self, concurrency: int = None, **limits: int):
+        """Set the limit of every class to `concurrency` (defaults to the CPU count),
+        then override single classes with keyword arguments."""
+        concurrency = concurrency or os.cpu_count() or 1
+        self.limits = {cls: concurrency for cls in self.CLASSES}
+        self.limits.update({cls: limit for cls, limit in limits.items() if limit})
+
+    def semaphore(self, cls: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphores = self._semaphores.get(loop)
+        if semaphores is None:
+            semaphores = {c: asyncio.Semaphore(limit) for c, limit in self.limits.items()}
+            self._semaphores[loop] = semaphores
+        return semaphores[cls]
+
+    async def submit(self, cls: str, cmd: list[str], cwd: str = None,
+                     stdin: bytes = None, timeout: float = None,
+                     cpu_time: float = None, **kwargs) -> JobResult:
+        """Run `cmd` as a job of class `cls`, killing it after `timeout` seconds.
+
+        `cpu_time` limits the CPU seconds of the job (see `sandbox.apply_limits`).
+        """
+        async with self.semaphore(cls):
+            process = await asyncio.create_subprocess_exec(
+                *cmd, cwd=cwd,
+                stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                **kwargs)
+            if cpu_time is not None:
+                apply_limits(process.pid, cpu_time=cpu_time)
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(stdin), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return JobResult(None)
+            except BaseException:
+                # cancelled: do not leave the child behind
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            return JobResult(process.returncode, stdout, stderr)
+
+    async def compile(self, cmd: list[str], cwd: str = None, stdin: bytes = None,
+                      timeout: float = None, cpu_time: float = None, **kwargs) -> JobResult:
+        return await self.submit("compile", cmd, cwd, stdin, timeout, cpu_time, **kwargs)
+
+    async def execute(self, cmd: list[str], cwd: str = None,
+                      timeout: float = None, **kwargs) -> JobResult:
+        return await self.submit("run", cmd, cwd, None, timeout, **kwargs)
+
+    async def execute_sandboxed(self, cmd: list[str], cwd: str = None,
+                                cpu_time: float = 1) -> RunResult:
+        """Run a test program in the sandbox as a job of the run class.
+
+        The sandbox reaps the program itself to collect its resource usage,
+        so it runs in a worker thread rather than as an asyncio subprocess.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.limits["run"])
+        async with self.semaphore("run"):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, run_sandboxed,
+                                              cmd, cwd, cpu_time)
+
+
+# the engine shared by every compile/run job of this process
+ENGINE = ExecutionEngine()
+
+
+async def gather_jobs(*aws) -> list:
+    """Run `aws` concurrently and return their results, like `asyncio.gather`,
+    but only once all of them are done: a cancelled call cancels each of
+    them once and waits for them, so no job outlives the call."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if not tasks:
+        return []
+    try:
+        # unlike `asyncio.gather`, a cancelled `asyncio.wait` leaves the tasks alone
+        await asyncio.wait(tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        raise
+    return [task.result() for task in tasks]
+
+
+def configure_engine(concurrency: int = None, **limits: int):
+    ENGINE.configure(concurrency, **limits)
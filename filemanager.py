@@ -1,20 +1,131 @@
 import os
 import json
+import time
+import asyncio
 import copy
 import random
 import re
+import signal
+import hashlib
 import subprocess
-from multiprocessing import Queue
+import weakref
+from multiprocessing import Queue, Value
+from queue import PriorityQueue, Full
+import shutil
 from shutil import copyfile
 from copy import deepcopy
 from typing import Type
 
-from configs import (CSMITH_HOME, UNCOMPILED, 
+from cache import ResultCache, ObjectCache
+from pch import PCHCache
+from casestore import CaseStore
+from elfhash import object_hash
+from source import SourceModel
+from split import split_program
+from variants import combine, split_output
+from campaign import case_seed
+from ddmin import ddmin
+import metrics
+from engine import ENGINE, gather_jobs
+from sandbox import (COMPILE_CPU_LIMIT, WALL_FACTOR, CPU_TIME_EXCEEDED, OUTPUT_EXCEEDED,
+                     MEMORY_EXCEEDED)
+from configs import (get_config, UNCOMPILED, 
                      COMPILE_TIMEOUT, COMPILER_CRASHED,
                      RUNTIME_TIMEOUT, RUNTIME_CRASHED,
                      COMPLEX_OPTS_GCC, SIMPLE_OPTS, AGGRESIVE_OPTS,
                      OPT_FORMAT, PREFIX_TEXT, SUFFIX_TEXT)
 
+# results cache consulted by `FileINFO.process_file`, shared with child
+# processes (e.g. the interestingness tests run by creduce) via the environment
+RESULT_CACHE : ResultCache | None = None
+CACHE_DIR_ENV = "CBOUNCY_CACHE_DIR"
+CACHE_SIZE_ENV = "CBOUNCY_CACHE_SIZE"
+# bytes of compiler stderr kept per crashed compilation
+MAX_STDERR = 8192
+
+
+def set_result_cache(cache_dir: str = None, max_size: int = 1 << 30):
+    """Enable the compile/run result cache in `cache_dir` (None disables it)."""
+    global RESULT_CACHE
+    if cache_dir:
+        RESULT_CACHE = ResultCache(cache_dir, max_size)
+        os.environ[CACHE_DIR_ENV] = RESULT_CACHE.cache_dir
+        os.environ[CACHE_SIZE_ENV] = str(max_size)
+    else:
+        RESULT_CACHE = None
+        os.environ.pop(CACHE_DIR_ENV, None)
+
+
+if os.environ.get(CACHE_DIR_ENV):
+    set_result_cache(os.environ[CACHE_DIR_ENV],
+                     int(os.environ.get(CACHE_SIZE_ENV, 1 << 30)))
+
+# precompiled csmith.h headers (None compiles against the plain header)
+PCH : PCHCache | None = None
+
+
+def set_pch_dir(pch_dir: str = None):
+    """Compile against precompiled headers kept in `pch_dir` (None disables them)."""
+    global PCH
+    PCH = PCHCache(pch_dir, f"{get_config().csmith_home}/include") if pch_dir else None
+
+
+# database of saved cases written by `CaseManager.save_log` (None keeps log.json only)
+CASE_STORE : CaseStore | None = None
+
+
+def set_case_store(store_dir: str = None):
+    """Also save cases to the case store in `store_dir` (None disables it)."""
+    global CASE_STORE
+    CASE_STORE = CaseStore(store_dir) if store_dir else None
+
+
+# compile to objects and skip running binaries already run for the case
+OBJECT_HASHING = False
+
+
+def set_object_hashing(enabled: bool = True):
+    """Compile to objects first and reuse the result of an identical binary."""
+    global OBJECT_HASHING
+    OBJECT_HASHING = enabled
+
+
+# objects of the units of split programs (None compiles whole programs)
+SPLIT_CACHE : ObjectCache | None = None
+# a mutant is only split if it patches at most this fraction of its functions,
+# otherwise few of its units are found in the cache
+SPLIT_MAX_CHANGED = 0.5
+# the units being compiled in this process, by event loop then cache key (the
+# validator server runs an event loop per thread, and a future only belongs to one)
+_COMPILING : weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def set_split_compilation(cache_dir: str = None, max_size: int = 1 << 30):
+    """Compile programs function by function, keeping the objects of each
+    function in `cache_dir` (None disables split compilation)."""
+    global SPLIT_CACHE
+    SPLIT_CACHE = ObjectCache(cache_dir, max_size) if cache_dir else None
+
+
+# run the files of a case from one binary per level (see `variants.combine`)
+MULTI_VARIANT = False
+
+
+def set_multi_variant(enabled: bool = True):
+    """Compile the files of a case into one program per level, run by one process."""
+    global MULTI_VARIANT
+    MULTI_VARIANT = enabled
+
+
+def include_args(compiler: str, args: list[str]) -> list[str]:
+    """The include options to compile a csmith program with `args`."""
+    include = [f"-I{get_config().csmith_home}/include"]
+    if PCH is not None:
+        header_dir = PCH.header_dir(compiler, ["-w", *args])
+        if header_dir is not None:
+            include.insert(0, f"-I{header_dir}")
+    return include
+
 
 class FileINFO:
     """A FileINFO includes all info of a single program file.
@@ -35,6 +146,18 @@ class FileINFO:
         res: The result of executing this program, such as
             `Compile failed`, `Timeout`, etc.
         fileinfo: A dictionary contains multiple attributes of this program.
+        code: The content of this program when it is held in memory
+            (None if the program lives on disk at `filepath`). The code of
+            a derived program is regenerated on first use.
+        scratch_dir: The directory for executables (defaults to `cwd`).
+        compile_errors: The compiler stderr of each level the compiler
+            crashed at, keyed like `result_dict`.
+        source: The `SourceModel` of this program, parsed on first use
+            (shared by the mutants of an orig, never pickled).
+        builds: How the program was built at the levels it was not
+            compiled on its own, e.g. `split` (see `split_build`) or
+            `variants` (see `CaseManager.aprocess_variants`), keyed like
+            `result_dict`. Such results may not reproduce with `cmd`.
     """
     def __init__(self, filepath: str, compiler: str = "gcc",
                  args: list[str] = None):
@@ -59,8 +182,54 @@ class FileINFO:
             self.args: list[str] = []
         self.filepath = filepath
         self.result_dict = dict()
+        self.run_stats = dict() # resource usage of each run, keyed like `result_dict`
+        self.compile_errors = dict()
+        self.builds = dict() # levels not built from the whole program, keyed like `result_dict`
         self.is_infinite = False
+        self._derived = False
+        self.code : str | None = None
+        self.scratch_dir : str | None = None
+        self._source : SourceModel | None = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_source"] = None
+        if self.derived and (self._code is not None or self._derived):
+            # rendered again from the orig on first use, so queues only
+            # carry the options of a mutant
+            state["_code"] = None
+            state["_derived"] = True
+        return state
+
+    @property
+    def code(self) -> str | None:
+        if self._derived:
+            self._code = self.regenerate()
+            self._derived = False
+        return self._code
 
+    @code.setter
+    def code(self, code: str | None):
+        self._code = code
+        self._derived = False
+
+    @property
+    def derived(self) -> bool:
+        """Whether the source is rendered from another file instead of being kept."""
+        return False
+
+    def regenerate(self) -> str:
+        """Generate the source of this orig again from the recipe of its case."""
+        from generator import csmith_version, csmith_program
+
+        case = getattr(self, "case", None)
+        recipe = case.recipe if case is not None else None
+        if recipe is None:
+            raise RuntimeError(f"{self.filepath} is missing and its case has no recipe")
+        if recipe["csmith"] != csmith_version():
+            raise RuntimeError(f"{self.filepath} was generated by {recipe['csmith']}, "
+                               f"not by {csmith_version()}")
+        return csmith_program(recipe["args"])
 
     def is_mutant(self):
         return False
@@ -71,12 +240,62 @@ class FileINFO:
 
     @property
     def cmd(self) -> str:
-        return f"{self.compiler} {self.abspath} -I{CSMITH_HOME}/include -w {' '.join(self.args)} -o {self.exe}".strip()
+        return f"{self.compiler} {self.abspath} -I{get_config().csmith_home}/include -w {' '.join(self.args)} -o {self.exe}".strip()
 
     @property
     def exe(self) -> str:
         return f"{self.basename.rstrip('.c')}_{self.compiler}.out"
 
+    def exe_for(self, comp_args: list[str] = None) -> str:
+        """The executable name for a compilation with `comp_args`.
+
+        Each (file, options) pair gets its own executable so that
+        compilations at different optimization levels can run concurrently.
+        """
+        if not comp_args:
+            return self.exe
+        tag = re.sub(r"[^0-9A-Za-z]+", "_", "".join(comp_args)).strip("_")
+        return f"{self.basename.rstrip('.c')}_{self.compiler}_{tag}.out"
+
+    def compile_cmd(self, comp_args: list[str] = None, obj: bool = False) -> list[str]:
+        # programs held in memory are fed to the compiler through stdin
+        source = ["-x", "c", "-"] if self.in_memory else [self.abspath]
+        if obj:
+            output = ["-c", "-o", os.path.join(self.exe_dir, self.obj_for(comp_args))]
+        else:
+            output = ["-o", os.path.join(self.exe_dir, self.exe_for(comp_args))]
+        return [self.compiler, *source,
+                *include_args(self.compiler, [*self.args, *(comp_args or [])]), "-w",
+                *self.args, *(comp_args or []), *output]
+
+    def obj_for(self, comp_args: list[str] = None) -> str:
+        return f"{self.exe_for(comp_args)[:-len('.out')]}.o"
+
+    def link_cmd(self, comp_args: list[str] = None, objects: list[str] = None) -> list[str]:
+        objects = objects or [os.path.join(self.exe_dir, self.obj_for(comp_args))]
+        return [self.compiler, *objects, *self.args, *(comp_args or []),
+                "-o", os.path.join(self.exe_dir, self.exe_for(comp_args))]
+
+    def split_units(self, opt_dict: dict[str : list[str]] = None) -> dict[str, str] | None:
+        """The translation units of this program (see `split.SplitProgram`),
+        or None if it cannot be split."""
+        program = split_program(self.source)
+        return program.units(opt_dict) if program is not None else None
+
+    def split_build(self) -> dict[str, str] | None:
+        """The units to build this program from with split compilation, or
+        None to compile it whole. An orig has no patched function whose
+        units could be reused, so it is compiled whole."""
+        return None
+
+    @property
+    def in_memory(self) -> bool:
+        return self.code is not None
+
+    @property
+    def exe_dir(self) -> str:
+        return self.scratch_dir or self.cwd
+
     @property
     def basename(self) -> str:
         return os.path.basename(self.filepath)
@@ -93,17 +312,34 @@ class FileINFO:
     def abspath(self, path: str):
         self.filepath = path
 
+    @property
+    def source(self) -> SourceModel:
+        # attributes only fill the slots of the model, so it stays valid
+        # for every text rendered from it
+        if self._source is None:
+            self._source = SourceModel(self.text)
+        return self._source
+
     @property
     def text(self) -> str:
+        if self.code is not None:
+            return self.code
         with open(self.filepath, 'r') as f:
             text = f.read()
             f.close()
         return text
 
     def copy2dir(self, new_dir: str):
-        copyfile(self.filepath, f"{new_dir}/{self.basename}")
         copied_file = copy.deepcopy(self)
         copied_file.abspath = f"{new_dir}/{self.basename}"
+        if self.derived:
+            # rendered from the orig of the new case
+            copied_file.code = None
+            copied_file._derived = True
+        elif self.in_memory:
+            copied_file.materialize()
+        else:
+            copyfile(self.filepath, copied_file.abspath)
         return copied_file
 
     @property
@@ -113,83 +349,276 @@ class FileINFO:
             "isMutant": self.is_mutant(),
             "compiler": self.compiler,
             "args": self.args,
-            "res_dict": self.result_dict
+            "res_dict": self.result_dict,
+            "run_stats": self.run_stats,
+            "compile_errors": self.compile_errors,
+            "builds": self.builds
         }
 
     def write_to_file(self, code: str):
+        if self.in_memory:
+            self.code = code
+            return
         with open(self.filepath, "w") as f:
             f.write(code)
 
+    def materialize(self):
+        """Write a program held in memory to `filepath` and switch it to disk."""
+        if not self.in_memory:
+            return
+        with open(self.filepath, "w") as f:
+            f.write(self.code)
+        self.code = None
+
 
     def process_file(self, timeout: float = 1, comp_args: list[str] = None) -> str:
+        return asyncio.run(self.aprocess_file(timeout, comp_args))
+
+    async def aprocess_file(self, timeout: float = 1, comp_args: list[str] = None,
+                            binaries: "BinaryIndex" = None, split: bool = True) -> str:
+        """Compile and run this program with `comp_args`.
+
+        If object hashing is enabled and `binaries` (the index of the case)
+        is given, the program is compiled to an object first, and the run
+        is skipped if the case already ran a binary of the same object.
+        With split compilation (unless `split` is False), a mutant patching
+        few functions is compiled function by function, only the units
+        missing from `SPLIT_CACHE` are compiled, and the objects are
+        linked. If a unit or the link fails, the program is compiled whole
+        instead, and only a failure of that compile is a compiler bug.
+        """
         # compile
-        args_str = ' '.join(comp_args)
-        if comp_args:
-            cmd = list(filter(lambda x: x, self.cmd.split(" ")))+comp_args
+        args_str = ' '.join(comp_args) if comp_args else ''
+        hashing = OBJECT_HASHING and binaries is not None
+        units = self.split_build() if SPLIT_CACHE is not None and split else None
+        if units is not None:
+            self.builds.update({args_str : "split"})
         else:
-            cmd = list(filter(lambda x: x, self.cmd.split(" ")))
+            self.builds.pop(args_str, None)
+        exe = self.exe_for(comp_args)
+        cache_key = self.result_key(comp_args, timeout, split=units is not None)
+        if cache_key is not None and self.load_result(args_str, cache_key):
+            return self.result_dict[args_str]
         res = UNCOMPILED
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=self.cwd)
-
-        try:
-            process.communicate(timeout=180)
-            if process.returncode != 0:
-                res = COMPILER_CRASHED
-        except subprocess.TimeoutExpired:
+        start = time.time()
+        if units is not None:
+            job, objects = await self.compile_units(units, comp_args)
+        else:
+            job = await ENGINE.compile(self.compile_cmd(comp_args, obj=hashing),
+                                       cwd=self.exe_dir, timeout=COMPILE_CPU_LIMIT * WALL_FACTOR,
+                                       stdin=self.code.encode('utf-8') if self.in_memory else None,
+                                       cpu_time=COMPILE_CPU_LIMIT)
+            objects = None
+        metrics.inc("compiles")
+        metrics.observe("compile_latency_seconds", args_str, time.time() - start)
+        if units is not None and job is not None:
+            return await self.split_failed(timeout, comp_args, binaries)
+        if job is not None and (job.timed_out or b"CPU time limit exceeded" in job.stderr):
             res = COMPILE_TIMEOUT
-        print(1)
-        # run
+        elif job is not None and job.returncode != 0:
+            res = COMPILER_CRASHED
         if res == COMPILE_TIMEOUT or res == COMPILER_CRASHED:
+            return self.compile_failed(args_str, res, job.stderr, cache_key)
+        if not hashing:
+            if objects is not None:
+                link = await self.link(comp_args, objects)
+                if link.timed_out or link.returncode != 0:
+                    # e.g. an object evicted from `SPLIT_CACHE` since it was found
+                    return await self.split_failed(timeout, comp_args, binaries)
+            res, stats = await self.run(exe, timeout, args_str)
             self.result_dict.update({args_str : res})
+            self.run_stats.update({args_str : stats})
+            self.cache_result(cache_key, res, stats)
             return res
 
-        try:
-            process = subprocess.run(f"./{self.exe}", 
-                                    stdout=subprocess.PIPE,
-                                    cwd=self.cwd, timeout=timeout)
-            if process.returncode != 0:
-                res = RUNTIME_CRASHED
-            else:
-                res = process.stdout.decode('utf-8')
-        except subprocess.TimeoutExpired:
-            res = RUNTIME_TIMEOUT
+        # link and run, unless the case already ran the same object
+        if objects is None:
+            digest = object_hash(os.path.join(self.exe_dir, self.obj_for(comp_args)))
+        else:
+            digest = hashlib.sha256("".join(map(object_hash, objects)).encode()).hexdigest()
+        binaries.record(self, args_str, digest)
+        key = (digest, tuple(self.args))
+        known = binaries.results.get(key)
+        if known is not None and await known is not None:
+            res, stats = known.result()
+            stats = {**(stats or {}), "reused": True}
+            metrics.inc("runs_skipped")
+        else:
+            owned = asyncio.get_running_loop().create_future()
+            binaries.results[key] = owned
+            linked = False
+            try:
+                link = await self.link(comp_args, objects)
+                linked = not link.timed_out and link.returncode == 0
+                if not linked and objects is None:
+                    # nothing ran, so a later file with the same object links again
+                    res = COMPILE_TIMEOUT if link.timed_out else COMPILER_CRASHED
+                    return self.compile_failed(args_str, res, link.stderr, cache_key)
+                if linked:
+                    res, stats = await self.run(exe, timeout, args_str)
+                    owned.set_result((res, stats))
+            finally:
+                if not owned.done():
+                    del binaries.results[key]
+                    owned.set_result(None)
+            if not linked:
+                return await self.split_failed(timeout, comp_args, binaries)
+        self.result_dict.update({args_str : res})
+        self.run_stats.update({args_str : stats})
+        self.cache_result(cache_key, res, stats)
+        return res
+
+    async def split_failed(self, timeout: float, comp_args: list[str] = None,
+                           binaries: "BinaryIndex" = None) -> str:
+        """Compile and run this program whole after its split build failed."""
+        metrics.inc("split_fallbacks")
+        return await self.aprocess_file(timeout, comp_args, binaries, split=False)
+
+    async def link(self, comp_args: list[str] = None, objects: list[str] = None):
+        return await ENGINE.compile(self.link_cmd(comp_args, objects), cwd=self.exe_dir,
+                                    timeout=COMPILE_CPU_LIMIT * WALL_FACTOR,
+                                    cpu_time=COMPILE_CPU_LIMIT)
+
+    async def compile_units(self, units: dict[str, str], comp_args: list[str] = None):
+        """Compile the `units` of a split program to objects with `comp_args`.
+
+        Objects are taken from `SPLIT_CACHE` when it has them, and units
+        compiled concurrently in the same event loop are compiled once.
+
+        Returns:
+            The job of a unit that failed to compile (None if every unit
+            compiled), and the paths of the objects.
+        """
+        args = [*include_args(self.compiler, [*self.args, *(comp_args or [])]), "-w",
+                *self.args, *(comp_args or [])]
+        key_args = [f"-I{get_config().csmith_home}/include", "-w",
+                    *self.args, *(comp_args or []), "-c"]
+        stem = self.exe_for(comp_args)[:-len('.out')]
+        loop = asyncio.get_running_loop()
+        compiling = _COMPILING.setdefault(loop, {})
+
+        async def unit(name: str, text: str):
+            key = SPLIT_CACHE.key(text, self.compiler, key_args)
+            obj = SPLIT_CACHE.get(key)
+            if obj is None and key in compiling:
+                obj = await compiling[key]
+            if obj is not None:
+                metrics.inc("units_reused")
+                return None, obj
+            owned = loop.create_future()
+            compiling[key] = owned
+            try:
+                obj = os.path.join(self.exe_dir, f"{stem}_{name}.o")
+                job = await ENGINE.compile([self.compiler, "-x", "c", "-", *args, "-c", "-o", obj],
+                                           cwd=self.exe_dir,
+                                           timeout=COMPILE_CPU_LIMIT * WALL_FACTOR,
+                                           stdin=text.encode('utf-8'),
+                                           cpu_time=COMPILE_CPU_LIMIT)
+                metrics.inc("units_compiled")
+                if job.timed_out or job.returncode != 0:
+                    return job, None
+                obj = SPLIT_CACHE.put(key, obj)
+                owned.set_result(obj)
+                return None, obj
+            finally:
+                # a failed unit is compiled again by the files waiting for it
+                if not owned.done():
+                    owned.set_result(None)
+                compiling.pop(key, None)
+
+        results = await gather_jobs(*(unit(name, text) for name, text in units.items()))
+        failed = next((job for job, _ in results if job is not None), None)
+        return failed, [obj for _, obj in results]
+
+    def compile_failed(self, args_str: str, res: str, stderr: bytes,
+                       cache_key: str | None) -> str:
         self.result_dict.update({args_str : res})
+        error = None
+        if res == COMPILER_CRASHED:
+            # keep the end of the report, where gcc prints the ICE and backtrace
+            error = stderr.decode('utf-8', 'replace')[-MAX_STDERR:]
+            self.compile_errors.update({args_str : error})
+        self.cache_result(cache_key, res, stderr=error)
         return res
 
-    def add_opt(self, max_opts : int, opt_cands: list[str]) -> dict[str : list[str]]:
-        code = self.text
-        # 1. grep function decls and add opt flags for each
-        declaration_scope = re.search(rf"{PREFIX_TEXT}(.+?){SUFFIX_TEXT}", code, re.S)
-        declaration_scope = declaration_scope.group() if declaration_scope else ""
-        functions = re.findall(rf"\n(.+?;)", declaration_scope, re.S)
-        funcs = [re.search(rf"(\S*)\(.*\).*?;", func).group(1) for func in functions]
+    async def run(self, exe: str, timeout: float, args_str: str) -> tuple[str, dict]:
+        run = await ENGINE.execute_sandboxed([os.path.join(self.exe_dir, exe)],
+                                             cwd=self.exe_dir, cpu_time=timeout)
+        metrics.inc("runs")
+        metrics.observe("run_latency_seconds", args_str, run.wall_time)
+        if run.timed_out or run.limit in (OUTPUT_EXCEEDED, MEMORY_EXCEEDED):
+            # running out of a resource is not a bug of the compiler
+            res = RUNTIME_TIMEOUT
+        elif run.returncode != 0:
+            res = RUNTIME_CRASHED
+        else:
+            res = run.stdout.decode('utf-8', 'replace')
+        return res, run.stats
+
+    def result_key(self, comp_args: list[str] = None, timeout: float = 1,
+                   split: bool = False) -> str | None:
+        """The key of the result of this program with `comp_args` in
+        `RESULT_CACHE` (None without a cache)."""
+        if RESULT_CACHE is None:
+            return None
+        # a split program does not inline across functions, so its results differ
+        return RESULT_CACHE.key(self.text, self.compiler,
+                                [f"-I{get_config().csmith_home}/include", "-w",
+                                 *self.args, *(comp_args or []), *(["split"] if split else [])],
+                                timeout)
+
+    def load_result(self, args_str: str, cache_key: str) -> bool:
+        """Take the result of `args_str` from `RESULT_CACHE`, if it has one."""
+        entry = RESULT_CACHE.get(cache_key)
+        if entry is None:
+            return False
+        self.result_dict.update({args_str : entry["res"]})
+        if entry.get("stats"):
+            self.run_stats.update({args_str : entry["stats"]})
+        if entry.get("stderr"):
+            self.compile_errors.update({args_str : entry["stderr"]})
+        metrics.inc("cache_hits")
+        return True
+
+    @staticmethod
+    def cache_result(cache_key: str | None, res: str, stats: dict = None,
+                     stderr: str = None):
+        # compile timeouts still depend on the machine load, so they are never cached
+        if cache_key is None or res == COMPILE_TIMEOUT:
+            return
+        RESULT_CACHE.put(cache_key, {"res": res, "stats": stats, "stderr": stderr})
+
+    def add_opt(self, max_opts : int, opt_cands: list[str],
+                rng: random.Random = random, sampler = None) -> dict[str : list[str]]:
+        # 1. pick opt flags for each declared function, guided by the
+        # `sampler.OptionSampler` if any
         opt_dict = {
             func:
-                random.sample(opt_cands, random.randint(1, max_opts))
-            for func in funcs
+                sampler.sample(opt_cands, rng.randint(1, max_opts), rng) if sampler
+                else rng.sample(opt_cands, rng.randint(1, max_opts))
+            for func in self.source.functions
         }
         # 2. generate mutated code 
-        code = self.sub_opt(opt_dict, code)
+        code = self.source.render(opt_dict)
         return code, opt_dict
 
-    def mutate(self, mutant_file: str, max_opts: int, candidate_opts: list[str]):
-        code, opt_dict = self.add_opt(max_opts, candidate_opts)
+    def mutate(self, mutant_file: str, max_opts: int, candidate_opts: list[str],
+               rng: random.Random = random, sampler = None):
+        code, opt_dict = self.add_opt(max_opts, candidate_opts, rng, sampler)
 
         if code:
+            # mutants are never written: they are derived from the orig
             mutant = MutantFileINFO(mutant_file, self.compiler, self.args, opt_dict)
-            mutant.write_to_file(code)
+            mutant._source = self.source
+            mutant.code = code
+            mutant.scratch_dir = self.scratch_dir
             return mutant
         else:
             return None
 
     @staticmethod
     def sub_opt(opt_dict: dict[str : list[str]], code: str) -> str:
-        for key, value in opt_dict.items():
-            opt_str = OPT_FORMAT.format(",".join(value))
-            code = re.sub(rf"({key}\(.*?\)).*?;",
-                          lambda r: f"{r.group(1)} {opt_str};",
-                          code, count=1)
-        return code
+        return SourceModel(code).render(opt_dict)
 
 
 class MutantFileINFO(FileINFO):
@@ -211,6 +640,10 @@ class MutantFileINFO(FileINFO):
         res: The result of executing this program, such as
             `Compile failed`, `Timeout`, etc.
         fileinfo: A dictionary contains multiple attributes of this program.
+        seed: The seed the options of this mutant were drawn with, if any.
+
+    A mutant of a case is derived: its source is rendered from the orig
+    with `function_dict` when needed, and is neither pickled nor saved.
     """
     def __init__(self, filepath: str, compiler: str = "gcc",
                  args: list[str] = None,
@@ -220,10 +653,32 @@ class MutantFileINFO(FileINFO):
             self.function_dict = function_dict.copy()
         else:
             self.function_dict : dict[str: list[str]] = dict()
+        self.seed : int | None = None
 
     def is_mutant(self):
         return True
 
+    def split_units(self, opt_dict: dict[str : list[str]] = None) -> dict[str, str] | None:
+        return super().split_units(self.function_dict if opt_dict is None else opt_dict)
+
+    def split_build(self) -> dict[str, str] | None:
+        program = split_program(self.source)
+        patched = [func for func, opts in self.function_dict.items() if opts]
+        if program is None or len(patched) > SPLIT_MAX_CHANGED * len(program.bodies):
+            return None
+        return self.split_units()
+
+    @property
+    def derived(self) -> bool:
+        case = getattr(self, "case", None)
+        return case is not None and case.orig is not None
+
+    def regenerate(self) -> str:
+        if not self.derived:
+            raise RuntimeError(f"{self.filepath} is missing and belongs to no case")
+        self._source = self.case.orig.source
+        return self._source.render(self.function_dict)
+
     def add_func_opts(self, function: str, opts: list[str]):
         self.function_dict[function] = opts
 
@@ -236,36 +691,63 @@ class MutantFileINFO(FileINFO):
     def fileinfo(self) -> dict:
         fileinfo_dict = super().fileinfo
         fileinfo_dict["function_dict"] = self.function_dict
+        fileinfo_dict["seed"] = self.seed
         return fileinfo_dict
 
-    def reduce_patch(self, timeout: float = 1):
-        funcs = deepcopy(self.function_dict)
+    def reduce_patch(self, timeout: float = 1, orig_result: dict[str : str] = None,
+                     budget = None) -> int:
+        """Reduce `function_dict` to a minimal set of options keeping the bug.
+
+        All (function, option) pairs are minimized together with ddmin.
+        A candidate patch is interesting if it reproduces the recorded
+        results on the opt levels where this mutant disagrees with
+        `orig_result` (on every level if `orig_result` is not given).
+        A mutant agreeing with `orig_result` is left as it is.
+        Once `budget.expired()` (if a budget is given), candidates are no
+        longer tested and the smallest patch found so far is kept.
+        Candidates are rendered from `source` and compiled from memory;
+        a mutant on disk is only written back with the reduced patch.
+
+        Returns:
+            The number of compilations spent.
+        """
         res = self.result_dict.copy()
+        levels = [opt for opt in SIMPLE_OPTS if opt in res]
+        if orig_result:
+            levels = [opt for opt in levels if orig_result.get(opt) != res[opt]]
+            if not levels:
+                # the empty patch would reproduce nothing, so all options would go
+                return 0
+        funcs = list(self.function_dict.keys())
+        items = [(func, opt) for func, opts in self.function_dict.items() for opt in opts]
+        compiles = 0
+        source = self.source
+        on_disk = not self.in_memory
 
-        for func, opts in funcs.items():
-            # 首先尝试删除所有选项
-            self.function_dict[func].clear()
-            text = self.sub_opt(self.function_dict, self.text)
-            self.write_to_file(text)
-            for glob_opt in SIMPLE_OPTS:
-                self.process_file(timeout=timeout, comp_args=[glob_opt])
+        def apply(patch: list[tuple[str, str]]):
+            function_dict = {func: [] for func in funcs}
+            for func, opt in patch:
+                function_dict[func].append(opt)
+            self.function_dict = function_dict
+            self.code = source.render(function_dict)
 
-            if all(res[glob_opt] == self.result_dict[glob_opt] for glob_opt in res.keys()):
-                print(f"Reduced All options from {func} in {self.basename}")
-            else:
-                self.function_dict[func] = opts.copy()
-                for opt in opts:
-                    self.function_dict[func].remove(opt)
-                    text = self.sub_opt(self.function_dict, self.text)
-                    self.write_to_file(text)
-                    for glob_opt in SIMPLE_OPTS:
-                        self.process_file(timeout=timeout, comp_args=[glob_opt])
-                    if not all(res[glob_opt] == self.result_dict[glob_opt] for glob_opt in res.keys()):
-                        self.function_dict[func].append(opt)
-                    else:
-                        print(f"Reduced {opt} from {func} in {self.basename}")
-        text = self.sub_opt(self.function_dict, self.text)
-        self.write_to_file(text)
+        def test(patch: list[tuple[str, str]]) -> bool:
+            nonlocal compiles
+            if budget is not None and budget.expired():
+                return False
+            apply(patch)
+            CaseManager.process_files([self], timeout, opts=levels)
+            compiles += len(levels)
+            return all(res[opt] == self.result_dict[opt] for opt in levels)
+
+        reduced = ddmin(items, test)
+        apply(reduced)
+        if on_disk:
+            self.materialize()
+        self.set_result_dict(res)
+        print(f"Reduced {len(items)} options to {len(reduced)} in {self.basename} "
+              f"with {compiles} compilations")
+        return compiles
 
 
 class CaseManager:
@@ -275,17 +757,35 @@ class CaseManager:
         case_dir: The directory of this case.
         orig: The original program.
         mutants: The list of multiple mutants program.
+        signature: The key of the bug signature of this case, if it carries a bug.
+        seed: The seed the case is generated from (see `campaign.Campaign`),
+            if it can be regenerated.
+        recipe: The csmith version and arguments the orig is generated
+            with, from which a missing orig is generated again.
+        timeout: The run timeout the oracle judged the case with, which its
+            reduction has to keep to see the same behaviour.
+
+    A case is thus fully described by its log: the orig comes from its
+    recipe (or from `orig.c`) and every mutant from the orig and its
+    `function_dict`.
     """
     def __init__(self, orig : FileINFO = None):
         self.orig : FileINFO = orig
         self.mutants : list[MutantFileINFO] = []
+        self.created = time.time()
+        self.signature : str | None = None
+        self.seed : int | None = None
+        self.recipe : dict | None = None
+        self.timeout : float | None = None
 
         if orig:
             self.case_dir: str = orig.cwd
+            orig.case = self
 
     def reset_orig(self, orig: FileINFO):
         self.orig = orig
         self.case_dir = orig.cwd
+        orig.case = self
         
     def add_mutant(self, mutant: MutantFileINFO):
         self.mutants.append(mutant)
@@ -298,24 +798,177 @@ class CaseManager:
     #         results.add(mutant.res)
     #     return len(results) != 1
 
-    def process(self, timeout: float = 1):
-        for opt in SIMPLE_OPTS:
-            self.orig.process_file(timeout=timeout, comp_args=[opt])
-            for mutant in self.mutants:
-                mutant.process_file(timeout=timeout, comp_args=[opt])
+    @property
+    def files(self) -> list[FileINFO]:
+        return [self.orig, *self.mutants]
+
+    def process(self, timeout: float = 1, max_workers: int = None):
+        """Compile and run every file of this case at every level of `SIMPLE_OPTS`.
+
+        Each (file, opt level) pair is an independent job with its own
+        executable, so the jobs run concurrently on the execution engine,
+        at most `max_workers` at once for this case.
+        Results are filled into each file's `result_dict` as jobs finish.
+        """
+        self.process_files(self.files, timeout, max_workers)
+
+    async def aprocess(self, timeout: float = 1, max_workers: int = None,
+                       binaries: "BinaryIndex" = None):
+        await self.aprocess_files(self.files, timeout, max_workers, binaries=binaries)
+
+    @staticmethod
+    def process_files(files: list[FileINFO], timeout: float = 1,
+                      max_workers: int = None, opts: tuple[str] = SIMPLE_OPTS):
+        asyncio.run(CaseManager.aprocess_files(files, timeout, max_workers, opts))
+
+    @staticmethod
+    async def aprocess_files(files: list[FileINFO], timeout: float = 1,
+                             max_workers: int = None, opts: tuple[str] = SIMPLE_OPTS,
+                             binaries: "BinaryIndex" = None,
+                             limit: asyncio.Semaphore = None):
+        """Compile and run `files` at every level of `opts` concurrently.
+
+        Jobs are bounded by the process-wide `ENGINE` limits and, if given,
+        by `max_workers` jobs in flight for this call, or by `limit` when
+        concurrent calls share their bound. Files of one case
+        share `binaries` so that identical objects are only run once.
+        With multi-variant execution, the files without a result in
+        `RESULT_CACHE` are first run from one binary per level; only
+        those it could not tell about are then compiled and run one by one.
+        """
+        if limit is None and max_workers:
+            limit = asyncio.Semaphore(max_workers)
+
+        async def bounded(coro):
+            if limit is None:
+                return await coro
+            async with limit:
+                return await coro
+
+        variants = MULTI_VARIANT and len(files) > 1 and \
+            len({(file.compiler, tuple(file.args)) for file in files}) == 1
+        combined = {} # the combined programs, by the files they run
+
+        async def level(opt: str):
+            left = files
+            if variants and RESULT_CACHE is not None:
+                left = [file for file in files
+                        if not file.load_result(opt, file.result_key([opt], timeout))]
+            if variants and len(left) > 1:
+                key = tuple(map(id, left))
+                if key not in combined:
+                    combined[key] = combine([file.text for file in left], timeout)
+                left = await bounded(CaseManager.aprocess_variants(left, combined[key],
+                                                                   timeout, [opt]))
+            await gather_jobs(*(bounded(file.aprocess_file(timeout, [opt], binaries))
+                                for file in left))
+
+        await gather_jobs(*(level(opt) for opt in opts))
+
+    @staticmethod
+    async def aprocess_variants(files: list[FileINFO], source: str, timeout: float = 1,
+                                comp_args: list[str] = None) -> list[FileINFO]:
+        """Compile `source`, the combination of `files`, with `comp_args`, and run it.
+
+        Returns:
+            The files without a result: all of them if the combined program
+            failed to compile (the culprit is found by compiling them one
+            by one), else those the run did not get to.
+        """
+        first = files[0]
+        args_str = ' '.join(comp_args) if comp_args else ''
+        exe = os.path.join(first.exe_dir, f"variants_{first.exe_for(comp_args)}")
+        start = time.time()
+        job = await ENGINE.compile([first.compiler, "-x", "c", "-",
+                                    *include_args(first.compiler, [*first.args, *(comp_args or [])]),
+                                    "-w", *first.args, *(comp_args or []), "-o", exe],
+                                   cwd=first.exe_dir,
+                                   timeout=COMPILE_CPU_LIMIT * WALL_FACTOR * len(files),
+                                   stdin=source.encode('utf-8'),
+                                   cpu_time=COMPILE_CPU_LIMIT * len(files))
+        metrics.inc("compiles")
+        metrics.observe("compile_latency_seconds", args_str, time.time() - start)
+        if job.timed_out or job.returncode != 0:
+            metrics.inc("variant_fallbacks")
+            return files
+        run = await ENGINE.execute_sandboxed([exe], cwd=first.exe_dir,
+                                             cpu_time=timeout * len(files))
+        metrics.inc("runs")
+        metrics.observe("run_latency_seconds", args_str, run.wall_time)
+        outputs = split_output(run.stdout)
+        left = []
+        for i, file in enumerate(files):
+            if i not in outputs:
+                left.append(file)
+                continue
+            stdout, status, cpu_time, max_rss = outputs[i]
+            # out of time, or out of output or memory (killed by the OOM killer)
+            timed_out = status in (-signal.SIGPROF, -signal.SIGXCPU, -signal.SIGXFSZ,
+                                   -signal.SIGKILL)
+            if timed_out:
+                res = RUNTIME_TIMEOUT
+            elif status != 0:
+                res = RUNTIME_CRASHED
+            else:
+                res = stdout.decode('utf-8', 'replace')
+            stats = {
+                "cpu_time": round(cpu_time, 4),
+                "max_rss": max_rss,
+                "wall_time": None,
+                "returncode": status,
+                "signal": signal.Signals(-status).name if status < 0 else None,
+                "limit": CPU_TIME_EXCEEDED if timed_out else None,
+                "variant": i
+            }
+            file.result_dict.update({args_str : res})
+            file.run_stats.update({args_str : stats})
+            file.builds.update({args_str : "variants"})
+            # the variants run whole programs, so their results stand for those of the files
+            file.cache_result(file.result_key(comp_args, timeout), res, stats)
+        if left:
+            metrics.inc("variant_fallbacks")
+        return left
+
+    def materialize(self, derived: bool = False):
+        """Write a case held in memory to `case_dir`.
 
-    def save_log(self):
-        json.dump(self.log, open(f"{self.case_dir}/log.json", "w"))
+        Args:
+            derived: Also write the mutants, which are otherwise rendered
+                from the orig when needed.
+        """
+        os.makedirs(self.case_dir, exist_ok=True)
+        for file in self.files:
+            if derived or not file.derived:
+                file.materialize()
+
+    def cleanup(self):
+        """Remove the scratch directory holding the executables of this case."""
+        scratch_dirs = {file.scratch_dir for file in self.files if file.scratch_dir}
+        for scratch_dir in scratch_dirs:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        for file in self.files:
+            file.scratch_dir = None
+
+    def save_log(self, store: bool = True):
+        """Write `log.json`, and put the case in `CASE_STORE` unless `store`
+        is False (e.g. for the working copies of the reducer)."""
+        log = self.log
+        json.dump(log, open(f"{self.case_dir}/log.json", "w"))
+        if store and CASE_STORE is not None:
+            CASE_STORE.put(log, {file.basename: file.text for file in self.files
+                                 if not file.derived})
 
     def copyfiles(self, new_dir: str):
         copied_orig = self.orig.copy2dir(new_dir)
         new_case = CaseManager(copied_orig)
         for mutant in self.mutants:
             new_case.add_mutant(mutant.copy2dir(new_dir))
+        new_case.timeout = self.timeout
 
         return new_case
 
-    def mutate_GCC(self, nums: int , complex_opts: bool = False, max_opts: int = 35):
+    def mutate_GCC(self, nums: int , complex_opts: bool = False, max_opts: int = 35,
+                   sampler = None):
         # TODO: mutate based on self.is_infinite_case
         # ? Suggestion: pass a opts tuple to orig.mutate for sampling
         # generate candidate opts and max_opts
@@ -329,7 +982,11 @@ class CaseManager:
         
         for i in range(nums):
             mutant_file = f"{self.case_dir}/mutant_gcc_{i}.c"
-            mutant = self.orig.mutate(mutant_file, max_opts, candidates_GCC)
+            # a seeded case always gets the same mutants, each from its own seed
+            seed = case_seed(self.seed, i) if self.seed is not None else None
+            rng = random.Random(seed) if seed is not None else random
+            mutant = self.orig.mutate(mutant_file, max_opts, candidates_GCC, rng, sampler)
+            mutant.seed = seed
             self.add_mutant(mutant)
 
     @property
@@ -337,15 +994,70 @@ class CaseManager:
         return {
             "case_dir": self.case_dir,
             "orig": self.orig.fileinfo,
-            "mutants": [mutant.fileinfo for mutant in self.mutants]
+            "mutants": [mutant.fileinfo for mutant in self.mutants],
+            "signature": self.signature,
+            "seed": self.seed,
+            "recipe": self.recipe,
+            "timeout": self.timeout
         }
 
 
+class BinaryIndex:
+    """A `BinaryIndex` remembers the binaries run for the files of one case.
+
+    Results are keyed by the hash of the object (see `elfhash.object_hash`)
+    and the compiler arguments, holding a future while the binary is
+    linked and run so that concurrent jobs wait for it instead of running
+    it again. The object hash of each mutant is compared with the one of
+    the orig at the same level, counting for every option of the mutant
+    whether it changed the generated code.
+
+    Attributes:
+        results: The (result, run stats) of every binary run, by key.
+        orig_hashes: The object hash of the orig at each level.
+        changed: Whether each mutant (by name) compiled to other code than
+            the orig at some level.
+    """
+    def __init__(self):
+        self.results: dict[tuple, asyncio.Future] = {}
+        self.orig_hashes: dict[str, str] = {}
+        self.changed: dict[str, bool] = {}
+        self._waiting: dict[str, list[tuple[MutantFileINFO, str]]] = {}
+
+    def record(self, file: FileINFO, level: str, digest: str):
+        if not file.is_mutant():
+            self.orig_hashes[level] = digest
+            for mutant, mutant_digest in self._waiting.pop(level, []):
+                self.count(mutant, mutant_digest != digest)
+        elif level in self.orig_hashes:
+            self.count(file, digest != self.orig_hashes[level])
+        else:
+            self._waiting.setdefault(level, []).append((file, digest))
+
+    def count(self, mutant: MutantFileINFO, changed: bool):
+        self.changed[mutant.basename] = self.changed.get(mutant.basename, False) or changed
+        flags = {opt for opts in mutant.function_dict.values() for opt in opts}
+        for flag in flags:
+            metrics.count("codegen_changed" if changed else "codegen_unchanged", flag)
+
+
 class CaseBuffer:
     """A `CaseBuffer` manages a buffer of `CaseManager`.
     """
     def __init__(self, size: int):
+        self.size = size
         self.queue = Queue(size)
+
+    @property
+    def depth(self) -> int:
+        """The approximate number of cases waiting in this buffer."""
+        return self.queue.qsize()
+
+    def is_full(self) -> bool:
+        return self.depth >= self.size
+
+    def is_empty(self) -> bool:
+        return self.depth == 0
         
     def push(self, case: CaseManager):
         self.queue.put(case)
@@ -355,9 +1067,76 @@ class CaseBuffer:
         return case    
 
 
+class ReductionQueue:
+    """A `ReductionQueue` orders the saved bug cases waiting for reduction.
+
+    Items are case directories (holding a `log.json`), served lowest
+    priority first and first-come first-served among equal priorities.
+    The queue lives in a manager process, so it must be created before the
+    workers are forked. Pushing never blocks: a case is dropped if the
+    queue is full, so reduction can never stall the oracle.
+    """
+    def __init__(self, size: int):
+        # only the main process creates a queue, so the manager machinery
+        # is not imported along with this module
+        from multiprocessing.managers import BaseManager
+
+        class _QueueManager(BaseManager):
+            pass
+
+        _QueueManager.register("PriorityQueue", PriorityQueue)
+        self.size = size
+        self._manager = _QueueManager()
+        self._manager.start()
+        self.queue = self._manager.PriorityQueue(size)
+        self._seq = Value('i', 0)
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def is_full(self) -> bool:
+        return self.depth >= self.size
+
+    def is_empty(self) -> bool:
+        return self.depth == 0
+
+    def push(self, case_dir: str, priority: tuple = ()) -> bool:
+        """
+        Returns:
+            bool: False if the queue is full and the case was dropped
+        """
+        with self._seq.get_lock():
+            self._seq.value += 1
+            seq = self._seq.value
+        try:
+            self.queue.put((priority, seq, case_dir), False)
+        except Full:
+            return False
+        return True
+
+    def get(self) -> str:
+        return self.queue.get(True)[2]
+
+    def close(self):
+        self._manager.shutdown()
+
+
 def create_case_from_log(log: dict | str) -> CaseManager:
+    """Rebuild a case from its log, or from the path of its `log.json`.
+
+    With a case store, a case it holds is loaded from the store, and the
+    sources missing from the case directory are held in memory. Other
+    missing sources are regenerated when needed (see `FileINFO.derived`
+    and `CaseManager.recipe`).
+    """
+    stored = False
     if isinstance(log, str):
-        log = json.load(open(log, "r"))
+        stored_log = CASE_STORE.get(os.path.dirname(log)) if CASE_STORE is not None else None
+        if stored_log is not None:
+            log, stored = stored_log, True
+        else:
+            log = json.load(open(log, "r"))
 
     orig = create_fileinfo_from_dict(log["case_dir"], log["orig"])
 
@@ -366,6 +1145,18 @@ def create_case_from_log(log: dict | str) -> CaseManager:
     for mutant_info in log["mutants"]:
         mutant = create_fileinfo_from_dict(log["case_dir"], mutant_info)
         case.add_mutant(mutant)
+    case.signature = log.get("signature")
+    case.seed = log.get("seed")
+    case.recipe = log.get("recipe")
+    case.timeout = log.get("timeout")
+    for file in case.files:
+        if os.path.exists(file.filepath):
+            continue
+        code = CASE_STORE.source(case.case_dir, file.basename) if stored else None
+        if code is not None:
+            file.code = code
+        elif file.derived or case.recipe is not None:
+            file._derived = True
 
     return case
 
@@ -377,9 +1168,22 @@ def create_fileinfo_from_dict(case_dir: str, fileinfo_dict: dict)\
                               fileinfo_dict["compiler"], fileinfo_dict["args"],
                               fileinfo_dict["function_dict"])
         file.set_result_dict(fileinfo_dict["res_dict"])
+        file.seed = fileinfo_dict.get("seed")
     else:
         file = FileINFO(f"{case_dir}/{fileinfo_dict['basename']}",
                         fileinfo_dict["compiler"], fileinfo_dict["args"])
         file.set_result_dict(fileinfo_dict["res_dict"])
+    file.run_stats.update(fileinfo_dict.get("run_stats", {}))
+    file.compile_errors.update(fileinfo_dict.get("compile_errors", {}))
+    file.builds.update(fileinfo_dict.get("builds", {}))
 
     return file
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Write the sources of a saved case, "
+                                                 "regenerated from its log")
+    parser.add_argument("case_dir", type=str)
+    args = parser.parse_args()
+    create_case_from_log(os.path.join(args.case_dir, "log.json")).materialize(derived=True)
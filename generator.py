@@ -1,40 +1,93 @@
 import os
+import time
 import subprocess
-from multiprocessing import Process, Value
+from functools import cache
+from multiprocessing import Process
 import shutil
+from tempfile import mkdtemp
 
 from filemanager import CaseBuffer, CaseManager, FileINFO
-from configs import CSMITH_HOME
+from campaign import Campaign
+from configs import get_config
+from stage import Stage
+
+
+@cache
+def csmith_version() -> str:
+    """The version string of the csmith in `csmith_home` (read once per process)."""
+    return subprocess.run([f"{get_config().csmith_home}/bin/csmith", "--version"],
+                          stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+
+
+def csmith_program(args: list[str]) -> str:
+    return subprocess.run([f"{get_config().csmith_home}/bin/csmith", *args],
+                          stdout=subprocess.PIPE).stdout.decode('utf-8')
+
+
+class ProgramGenerator(Stage):
+    name = "generator"
+    counter = "cases_generated"
 
-class ProgramGenerator:
     def __init__(self, test_dir: str, generate_num=100, csmith_args: list[str] = None,
-                 output_buffer: CaseBuffer = None):
+                 output_buffer: CaseBuffer = None, scratch_dir: str = None,
+                 num_workers: int = 10, campaign: Campaign = None):
+        """
+        Args:
+            scratch_dir: If given, cases are held in memory and their
+                executables are built under this (memory-backed) directory;
+                nothing is written to `test_dir` unless a bug is found.
+            campaign: The campaign reserving case numbers and seeds (a new
+                one in `test_dir` by default).
+        """
+        super().__init__(num_workers) # processes for csmith program generating
         self.test_dir = test_dir
+        self.scratch_dir = scratch_dir
+        if self.scratch_dir and not os.path.exists(self.scratch_dir):
+            os.makedirs(self.scratch_dir)
         if not os.path.exists(self.test_dir):
             os.makedirs(self.test_dir)
         
         self.generate_num = generate_num
-        self.epoch = Value('i', 0)
+        if campaign is None:
+            campaign = Campaign(self.test_dir, generate_num)
+        self.campaign = campaign
         self.output_buffer = output_buffer
         if csmith_args is None:
             self.csmith_args = []
         else:
             self.csmith_args = csmith_args
 
-        self.gen_processes = [Process(target=self.generate_case) for _ in range(10)] # processes for csmith program generating
+    def work(self, stop):
+        self.generate_case(stop)
 
-    def generate_case(self):
-        while True:
-            # generate a csmith program
-            stdout = subprocess.run([f"{CSMITH_HOME}/bin/csmith", *self.csmith_args], 
-                                    stdout=subprocess.PIPE).stdout
+    def generate_case(self, stop=None):
+        while stop is None or not stop.is_set():
+            start = time.time()
+            # reserve a case number, stop after `generate_num` cases (0 means no limit)
+            number = self.campaign.next_case()
+            if number is None:
+                return
+            case_name = f"case_{number}"
+            test_dir = os.path.join(self.test_dir, case_name)
+            seed = self.campaign.case_seed(number)
 
-            orig_program = stdout.decode('utf-8')
+            # generate a csmith program, reproducible from the seed of the case
+            seed_args = [] if {"-s", "--seed"} & set(self.csmith_args) else ["--seed", str(seed)]
+            recipe = {"csmith": csmith_version(), "args": [*self.csmith_args, *seed_args]}
+            orig_program = csmith_program(recipe["args"])
 
             # write program to file
-            with self.epoch.get_lock():
-                self.epoch.value += 1
-                test_dir = os.path.join(self.test_dir, f"case_{self.epoch.value}")
+
+            if self.scratch_dir:
+                orig = FileINFO(os.path.join(test_dir, "orig.c"))
+                orig.code = orig_program
+                orig.scratch_dir = mkdtemp(prefix=f"{case_name}_", dir=self.scratch_dir)
+                case = CaseManager(orig)
+                case.seed = seed
+                case.recipe = recipe
+                self.record(start)
+                self.output_buffer.push(case)
+                continue
 
             if not os.path.exists(test_dir):
                 os.makedirs(test_dir)
@@ -45,13 +98,8 @@ class ProgramGenerator:
 
             orig = FileINFO(os.path.join(test_dir, "orig.c"))
             case = CaseManager(orig)
+            case.seed = seed
+            case.recipe = recipe
+            self.record(start)
             self.output_buffer.push(case)
 
-    def run(self):
-        for process in self.gen_processes:
-            process.start()
-
-    def join(self):
-        for process in self.gen_processes:
-            process.join()
-
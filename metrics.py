@@ -0,0 +1,206 @@
+import os
+import json
+import time
+from threading import Thread, Event
+from multiprocessing import Array, Lock
+
+from configs import SIMPLE_OPTS, COMPLEX_OPTS_GCC, AGGRESIVE_OPTS
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 300, float("inf"))
+
+COUNTERS = (
+    "cases_generated", "cases_mutated", "cases_tested", "cases_reduced",
+    "bugs_found", "duplicate_bugs", "compiles", "runs", "cache_hits",
+    "mails_sent", "mail_failures", "reductions_dropped", "reductions_expired",
+    "runs_skipped", "units_compiled", "units_reused", "variant_fallbacks",
+    "split_fallbacks", "oracle_errors"
+)
+
+FLAGS = tuple(dict.fromkeys((*SIMPLE_OPTS, *COMPLEX_OPTS_GCC, *AGGRESIVE_OPTS)))
+
+# labelled counter families: name -> (label name, label values)
+LABELLED_COUNTERS = {
+    # whether a mutant carrying the flag compiled to other code than its orig
+    "codegen_changed": ("flag", FLAGS),
+    "codegen_unchanged": ("flag", FLAGS),
+}
+
+STAGES = ("generator", "mutator", "oracle", "reducer", "notifier")
+
+# histogram families: name -> (label name, label values)
+HISTOGRAMS = {
+    "stage_latency_seconds": ("stage", STAGES),
+    "compile_latency_seconds": ("opt", (*SIMPLE_OPTS, "other")),
+    "run_latency_seconds": ("opt", (*SIMPLE_OPTS, "other")),
+    "case_latency_seconds": ("stage", ("oracle",)),
+}
+
+
+class Metrics:
+    """`Metrics` holds counters and latency histograms shared by all processes.
+
+    Every value lives in shared memory, so a `Metrics` must be created
+    before the worker processes are forked; they update it in place.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = Array('q', len(COUNTERS), lock=False)
+        self.slots: dict[tuple[str, str], int] = {}
+        for family, (_, values) in HISTOGRAMS.items():
+            for value in values:
+                self.slots[(family, value)] = len(self.slots)
+        # per histogram: one count per bucket, then the sum of observations
+        self.width = len(LATENCY_BUCKETS) + 1
+        self.histograms = Array('d', len(self.slots) * self.width, lock=False)
+        self.labelled_slots: dict[tuple[str, str], int] = {}
+        for family, (_, values) in LABELLED_COUNTERS.items():
+            for value in values:
+                self.labelled_slots[(family, value)] = len(self.labelled_slots)
+        self.labelled = Array('q', len(self.labelled_slots), lock=False)
+
+    def inc(self, counter: str, n: int = 1):
+        with self.lock:
+            self.counters[COUNTERS.index(counter)] += n
+
+    def count(self, family: str, value: str, n: int = 1):
+        slot = self.labelled_slots.get((family, value))
+        if slot is None:
+            return
+        with self.lock:
+            self.labelled[slot] += n
+
+    def observe(self, family: str, value: str, seconds: float):
+        slot = self.slots.get((family, value), self.slots.get((family, "other")))
+        if slot is None:
+            return
+        base = slot * self.width
+        bucket = next(i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)
+        with self.lock:
+            self.histograms[base + bucket] += 1
+            self.histograms[base + len(LATENCY_BUCKETS)] += seconds
+
+    def snapshot(self, gauges: dict[str, dict[str, float]] = None) -> dict:
+        with self.lock:
+            counters = list(self.counters)
+            histograms = list(self.histograms)
+            labelled = list(self.labelled)
+
+        snapshot = {
+            "time": time.time(),
+            "counters": dict(zip(COUNTERS, counters)),
+            "labelled": {},
+            "histograms": {},
+            "gauges": gauges or {}
+        }
+        for (family, value), slot in self.labelled_slots.items():
+            if labelled[slot]:
+                snapshot["labelled"].setdefault(family, {})[value] = labelled[slot]
+        for (family, value), slot in self.slots.items():
+            row = histograms[slot * self.width:(slot + 1) * self.width]
+            counts = [int(c) for c in row[:-1]]
+            if not any(counts):
+                continue
+            snapshot["histograms"].setdefault(family, {})[value] = {
+                "buckets": counts,
+                "count": sum(counts),
+                "sum": row[-1]
+            }
+        snapshot["buckets"] = [str(bound) for bound in LATENCY_BUCKETS]
+        return snapshot
+
+    @staticmethod
+    def prometheus(snapshot: dict, prefix: str = "cbouncy") -> str:
+        """Render a snapshot in the Prometheus text exposition format."""
+        lines = []
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        for family, values in snapshot["labelled"].items():
+            label = LABELLED_COUNTERS[family][0]
+            lines.append(f"# TYPE {prefix}_{family}_total counter")
+            for value, count in values.items():
+                lines.append(f'{prefix}_{family}_total{{{label}="{value}"}} {count}')
+
+        for family, values in snapshot["histograms"].items():
+            label = HISTOGRAMS[family][0]
+            lines.append(f"# TYPE {prefix}_{family} histogram")
+            for value, hist in values.items():
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, hist["buckets"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f'{prefix}_{family}_bucket{{{label}="{value}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_{family}_sum{{{label}="{value}"}} {hist["sum"]}')
+                lines.append(f'{prefix}_{family}_count{{{label}="{value}"}} {hist["count"]}')
+
+        for gauge, values in snapshot["gauges"].items():
+            lines.append(f"# TYPE {prefix}_{gauge} gauge")
+            for label, value in values.items():
+                lines.append(f'{prefix}_{gauge}{{name="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+# the metrics updated by this process (None disables instrumentation)
+METRICS : Metrics | None = None
+
+
+def set_metrics(metrics: Metrics | None):
+    global METRICS
+    METRICS = metrics
+
+
+def inc(counter: str, n: int = 1):
+    if METRICS is not None:
+        METRICS.inc(counter, n)
+
+
+def count(family: str, value: str, n: int = 1):
+    if METRICS is not None:
+        METRICS.count(family, value, n)
+
+
+def observe(family: str, value: str, seconds: float):
+    if METRICS is not None:
+        METRICS.observe(family, value, seconds)
+
+
+def write_atomic(path: str, content: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+class MetricsWriter(Thread):
+    """A `MetricsWriter` periodically dumps a snapshot of `metrics` into `out_dir`.
+
+    It writes `metrics.json` and `metrics.prom` (a Prometheus textfile).
+    Gauges are sampled at every snapshot by calling `gauges()`.
+    """
+    def __init__(self, metrics: Metrics, out_dir: str, interval: float = 30,
+                 gauges=None):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.out_dir = out_dir
+        self.interval = interval
+        self.gauges = gauges
+        self._stop_event = Event()
+
+    def write(self) -> dict:
+        snapshot = self.metrics.snapshot(self.gauges() if self.gauges else None)
+        write_atomic(os.path.join(self.out_dir, "metrics.json"),
+                     json.dumps(snapshot, indent=2))
+        write_atomic(os.path.join(self.out_dir, "metrics.prom"),
+                     Metrics.prometheus(snapshot))
+        return snapshot
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self._stop_event.set()
+        self.write()
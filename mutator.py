@@ -1,14 +1,22 @@
 import random
 import re
+import time
 from multiprocessing import Process
 
 from filemanager import *
+from stage import Stage
 
 
-class CodeMutator:
+class CodeMutator(Stage):
+    name = "mutator"
+    counter = "cases_mutated"
+
     def __init__(self, mutate_num=5, complex_opts: bool = False, max_opts: int = 35,
                  gen_gcc: bool = True, gen_clang: bool = False,
-                 input_buffer : CaseBuffer = None, output_buffer : CaseBuffer = None):
+                 input_buffer : CaseBuffer = None, output_buffer : CaseBuffer = None,
+                 num_workers: int = 5, sampler = None):
+        super().__init__(num_workers)
+        self.sampler = sampler # an `OptionSampler` guiding the options (None samples uniformly)
         self.mutate_num = mutate_num
         self.complex_opts = complex_opts
         self.max_opts = max_opts
@@ -16,30 +24,27 @@ class CodeMutator:
         self.gen_clang = gen_clang
         self.input_buffer = input_buffer
         self.output_buffer = output_buffer
-        self.mutate_processes = [Process(target=self.mutate) for _ in range(5)]
 
     @staticmethod
     def write_to_file(mutant_file_path: str, code: str):
         with open(mutant_file_path, "w") as f:
             f.write(code)
 
-    def run(self):
-        for process in self.mutate_processes:
-            process.start()
-
-    def join(self):
-        for process in self.mutate_processes:
-            process.join()
+    def work(self, stop):
+        self.mutate(stop)
 
-    def mutate(self):
+    def mutate(self, stop=None):
         # TODO: gen variants for gcc and clang
-        while True:
+        while stop is None or not stop.is_set():
             case = self.input_buffer.get()
+            start = time.time()
             
             # main mutate
             if self.gen_gcc:
-                case.mutate_GCC(self.mutate_num, self.complex_opts, self.max_opts)
+                case.mutate_GCC(self.mutate_num, self.complex_opts, self.max_opts,
+                                self.sampler)
             if self.gen_clang:
                 pass
             
+            self.record(start)
             self.output_buffer.push(case)
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import time
+import smtplib
+from queue import Empty
+from multiprocessing import Queue
+
+from stage import Stage
+import metrics
+from utils import smtp_connect, build_message
+
+
+class Notifier(Stage):
+    """A `Notifier` mails digests of the bugs found by the oracle.
+
+    Oracle workers `push` a bug event and move on; the single notifier
+    worker collects events and sends one digest every `interval` seconds
+    (or as soon as `max_batch` events are pending). Zips are attached until
+    the digest reaches `max_attachment` bytes, the others are only listed.
+    The SMTP connection is kept open between digests, and a failed digest
+    is retried `retries` times with exponential backoff before it is
+    dropped. When stopped, the worker sends what is still pending.
+
+    Attributes:
+        config: The mail config (see `utils.smtp_connect`).
+        queue: The bug events waiting to be mailed.
+    """
+    name = "notifier"
+    counter = "mails_sent"
+
+    def __init__(self, config: dict, interval: float = 60, max_batch: int = 50,
+                 max_attachment: int = 10 << 20, retries: int = 5,
+                 backoff: float = 2, timeout: float = 30):
+        super().__init__(1)
+        self.config = config
+        self.interval = interval
+        self.max_batch = max(1, max_batch)
+        self.max_attachment = max_attachment
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.queue = Queue()
+        self._server : smtplib.SMTP | None = None
+
+    def push(self, event: dict):
+        """Queue a bug event, a dict with at least a `case_dir` and a `zip` path."""
+        self.queue.put(event)
+
+    def work(self, stop):
+        self.notify(stop)
+
+    def notify(self, stop=None):
+        pending = []
+        deadline = None
+        while True:
+            stopping = stop is not None and stop.is_set()
+            try:
+                event = self.queue.get(timeout=0 if stopping else 1)
+                pending.append(event)
+                deadline = deadline or time.time() + self.interval
+            except Empty:
+                event = None
+            if pending and (len(pending) >= self.max_batch or time.time() >= deadline
+                            or (stopping and event is None)):
+                batch, pending = pending[:self.max_batch], pending[self.max_batch:]
+                self.send_digest(batch)
+                deadline = time.time() + self.interval if pending else None
+            if stopping and event is None and not pending:
+                break
+        self.close()
+
+    def digest(self, events: list[dict]):
+        attachments = []
+        size = 0
+        lines = [f"{len(events)} new bug(s) found:", ""]
+        for event in events:
+            zip_path = event.get("zip")
+            zip_size = os.path.getsize(zip_path) if zip_path and os.path.exists(zip_path) else None
+            if zip_size is not None and size + zip_size <= self.max_attachment:
+                attachments.append(zip_path)
+                size += zip_size
+                note = "attached"
+            elif zip_size is not None:
+                note = f"not attached ({zip_size} bytes), see {zip_path}"
+            else:
+                note = "no archive"
+            details = " ".join(f"{k}={v}" for k, v in event.items()
+                               if k not in ("case_dir", "zip"))
+            lines.append(f"- {event['case_dir']} {details} [{note}]")
+        subject = f"{len(events)} bug(s) found" if len(events) > 1 \
+            else f"A bug is found in {events[0]['case_dir']}!"
+        return build_message(self.config, subject, "\n".join(lines), attachments)
+
+    def connection(self) -> smtplib.SMTP:
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self._server = smtp_connect(self.config, self.timeout)
+        return self._server
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+    def send_digest(self, events: list[dict]) -> bool:
+        start = time.time()
+        message = self.digest(events)
+        for attempt in range(self.retries + 1):
+            try:
+                self.connection().send_message(message, self.config["sender"],
+                                               self.config["receiver"])
+                self.record(start)
+                return True
+            except (smtplib.SMTPException, OSError) as e:
+                print(f"Failed to mail {len(events)} bug(s) (attempt {attempt + 1}): {e}")
+                self.close()
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        metrics.inc("mail_failures")
+        return False
@@ -1,26 +1,52 @@
+import sys
+import glob
 import shutil
+import time
+import asyncio
 from multiprocessing import Process
 from filemanager import *
-from utils import send_mail, zip_dir
-from configs import (MAIL_CONFIG,
-                     UNCOMPILED, COMPILER_CRASHED, COMPILE_TIMEOUT,
-                     RUNTIME_CRASHED, RUNTIME_TIMEOUT)
+import filemanager
+from stage import Stage
+from signature import SignatureIndex, bug_signature
+import metrics
+from notifier import Notifier
+from campaign import Campaign
+from sampler import OptionSampler
+from utils import zip_dir
+from configs import (UNCOMPILED, COMPILER_CRASHED, COMPILE_TIMEOUT,
+                     RUNTIME_CRASHED, RUNTIME_TIMEOUT, SIMPLE_OPTS)
 
 
-class Oracle:
-    def __init__(self, timeout: float = 20, input_buffer: CaseBuffer = None):
+class Oracle(Stage):
+    name = "oracle"
+    counter = "cases_tested"
+
+    def __init__(self, timeout: float = 20, input_buffer: CaseBuffer = None,
+                 jobs: int = None, lazy: bool = True, num_workers: int = 20,
+                 cases_per_worker: int = 1, notifier: Notifier = None,
+                 signatures: SignatureIndex = None,
+                 reductions: ReductionQueue = None, campaign: Campaign = None,
+                 sampler: OptionSampler = None):
+        super().__init__(num_workers)
+        self.sampler = sampler # learns which options make mutants diverge
+        self.campaign = campaign # cases are in flight until tested
+        self.reductions = reductions # saved bugs waiting for the reducer
+        self.notifier = notifier # mails the saved bugs (None disables mail)
+        self.signatures = signatures # known bugs are counted but not saved again
         self.timeout = timeout
         self.input_buffer = input_buffer
+        self.jobs = jobs # compile/run jobs in flight per case
+        self.lazy = lazy # stop evaluating a case as soon as a bug is proven
+        self.cases_per_worker = max(1, cases_per_worker) # cases in flight per process
 
-        self.oracle_processes = [Process(target=self.test_case) for _ in range(20)] 
-        
-    def run(self):
-        for process in self.oracle_processes:
-            process.start()
+    def work(self, stop):
+        self.test_case(stop)
 
-    def join(self):
-        for process in self.oracle_processes:
-            process.join()
+    @property
+    def service_time(self) -> float | None:
+        # a worker overlaps `cases_per_worker` cases
+        service_time = super().service_time
+        return service_time / self.cases_per_worker if service_time is not None else None
 
     @staticmethod
     def check_file(file : FileINFO) -> bool:
@@ -44,43 +70,163 @@ class Oracle:
             return True
         return False
 
+    @staticmethod
+    def check_mutant(orig: FileINFO, mutant: MutantFileINFO) -> bool:
+        """Compare a mutant with the orig on every level the mutant was evaluated at.
+
+        Returns:
+            bool: True means a bug found
+        """
+        for opt, mutant_res in mutant.result_dict.items():
+            if orig.result_dict.get(opt) != mutant_res:
+                # a bug found
+                return True
+        return False
+
     @staticmethod
     def check_case(case: CaseManager)-> bool:
-        orig = case.orig
-        mutants = case.mutants
-        for opt in SIMPLE_OPTS:
-            orig_res = orig.result_dict[opt]
-            for mutant in mutants:
-                mutant_res = mutant.result_dict[opt]
-                if orig_res != mutant_res:
-                    # a bug found
+        return any(Oracle.check_mutant(case.orig, mutant) for mutant in case.mutants)
+
+    @staticmethod
+    def mutant_order(case: CaseManager) -> list[MutantFileINFO]:
+        # mutants carrying more options are more likely to diverge, try them first
+        return sorted(case.mutants, reverse=True,
+                      key=lambda m: sum(len(opts) for opts in m.function_dict.values()))
+
+    def evaluate_case(self, case: CaseManager) -> bool:
+        """Evaluate a case, stopping as soon as a bug is proven.
+
+        The orig is evaluated first; if it already crashes the compiler
+        or yields inconsistent checksums, no mutant is evaluated. Mutants
+        are then evaluated concurrently (sharing the `jobs` of the case,
+        the most promising ones first), and the remaining jobs are
+        cancelled as soon as a level of a mutant disagrees with the orig.
+        Mutants keep the levels they finished in the saved log. With
+        multi-variant execution, all files run from one binary per level,
+        so the whole case is evaluated at once.
+
+        Returns:
+            bool: True means a bug found
+        """
+        return asyncio.run(self.aevaluate_case(case))
+
+    async def aevaluate_case(self, case: CaseManager, binaries: BinaryIndex = None) -> bool:
+        binaries = binaries if binaries is not None else BinaryIndex()
+        if not self.lazy or filemanager.MULTI_VARIANT:
+            await case.aprocess(timeout=self.timeout, max_workers=self.jobs, binaries=binaries)
+            return self.check_file(case.orig) or self.check_case(case)
+
+        await case.aprocess_files([case.orig], timeout=self.timeout, max_workers=self.jobs,
+                                  binaries=binaries)
+        if self.check_file(case.orig):
+            return True
+        # one task per mutant and level, created in order so that the jobs of
+        # the first mutants are queued first; each level is checked as it ends
+        limit = asyncio.Semaphore(self.jobs) if self.jobs else None
+        tasks = [asyncio.create_task(case.aprocess_files([mutant], timeout=self.timeout,
+                                                         opts=(opt,), binaries=binaries,
+                                                         limit=limit))
+                 for mutant in self.mutant_order(case) for opt in SIMPLE_OPTS]
+        try:
+            for done in asyncio.as_completed(tasks):
+                await done
+                if self.check_case(case):
                     return True
-        return False
+            return False
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-    def test_case(self):
-        while True:
-            case = self.input_buffer.get()    
-            case.process(timeout=60)
-            
-            # orig file check
-            if self.check_file(case.orig):
-                self.save_bug(case)
-                continue
-            
-            # case check
-            if self.check_case(case):
-                self.save_bug(case)
+    def test_case(self, stop=None):
+        """Main loop of an oracle worker: evaluate `cases_per_worker` cases at a time."""
+        async def loop():
+            await asyncio.gather(*(self.atest_case(stop)
+                                   for _ in range(self.cases_per_worker)))
+        asyncio.run(loop())
+
+    async def atest_case(self, stop=None):
+        loop = asyncio.get_running_loop()
+        while stop is None or not stop.is_set():
+            case = await loop.run_in_executor(None, self.input_buffer.get)
+            start = time.time()
+            try:
+                binaries = BinaryIndex()
+                bug = await self.aevaluate_case(case, binaries)
+                if self.sampler is not None:
+                    self.learn(case, binaries)
+                if bug:
+                    await loop.run_in_executor(None, self.handle_bug, case)
+                else:
+                    # no bug found
+                    case.cleanup()
+                    if os.path.exists(case.case_dir):
+                        shutil.rmtree(case.case_dir)
+            except Exception as e:
+                # the case is kept on disk for inspection, and still counted
+                # as tested so that the pipeline drains
+                print(f"Oracle failed on {case.case_dir}: {e}", file=sys.stderr)
+                metrics.inc("oracle_errors")
+            if self.campaign is not None:
+                self.campaign.finish(os.path.basename(case.case_dir))
+            self.record(start)
+            # end-to-end latency, from generation to verdict
+            metrics.observe("case_latency_seconds", self.name, time.time() - case.created)
+
+    def learn(self, case: CaseManager, binaries: BinaryIndex):
+        """Reward the options of every evaluated mutant of `case`."""
+        for mutant in case.mutants:
+            if not mutant.result_dict:
                 continue
+            if self.check_mutant(case.orig, mutant):
+                reward = 1.0
+            elif binaries.changed.get(mutant.basename):
+                reward = self.sampler.codegen_reward
+            else:
+                reward = 0.0
+            self.sampler.update(mutant.function_dict, reward)
 
-            # no bug found
-            shutil.rmtree(case.case_dir)
+    def handle_bug(self, case: CaseManager):
+        metrics.inc("bugs_found")
+        key, components = bug_signature(case)
+        case.signature = key
+        case.timeout = self.timeout
+        hits = 1
+        if self.signatures is not None:
+            hits = self.signatures.record(key, components, case.case_dir)
+        if hits > 1:
+            metrics.inc("duplicate_bugs")
+        if hits > 1 and components["kind"] == "ice":
+            # a known ICE: its normalized message and frame identify the bug,
+            # so drop the case instead of zipping and mailing it again. Other
+            # signatures only tell the failing levels apart, so their cases
+            # are kept (and reduced after new bugs)
+            case.cleanup()
+            if os.path.exists(case.case_dir):
+                shutil.rmtree(case.case_dir)
+            return
+        case.materialize()
+        case.cleanup()
+        zip_path = self.save_bug(case)
+        # new signatures first, then smaller programs first
+        if self.reductions is not None and \
+                not self.reductions.push(case.case_dir, (hits, len(case.orig.text))):
+            metrics.inc("reductions_dropped")
+        if self.notifier is not None:
+            self.notifier.push({"case_dir": case.case_dir, "zip": zip_path,
+                                "signature": key, "kind": components["kind"],
+                                "levels": ",".join(components["levels"])})
 
     @staticmethod
-    def save_bug(case: CaseManager):
+    def save_bug(case: CaseManager) -> str:
+        """Save the log of a case and zip it.
+
+        Returns:
+            The path of the zip.
+        """
         # remove .out files
-        subprocess.run(['rm', '*.out'], cwd=case.case_dir)
+        for exe in glob.glob(os.path.join(case.case_dir, "*.out")):
+            os.remove(exe)
         case.save_log()
         zip_dir(case.case_dir, case.case_dir)
-        send_mail(MAIL_CONFIG, f"A bug is found in {case.case_dir}!",
-                  f"A bug is found in {case.case_dir}!\nPlease check the output files.",
-                  attachment=case.case_dir + ".zip")
\ No newline at end of file
+        return case.case_dir + ".zip"
\ No newline at end of file
@@ -0,0 +1,83 @@
+import os
+import fcntl
+import shutil
+import hashlib
+import subprocess
+from tempfile import mkstemp
+
+from cache import compiler_identity
+
+HEADER = "csmith.h"
+
+
+class PCHCache:
+    """A `PCHCache` builds and keeps precompiled `csmith.h` headers.
+
+    gcc only uses a precompiled header built with compatible options, so
+    one is built per (compiler identity, options), each in its own
+    directory holding `csmith.h.gch` next to a copy of `csmith.h`. Putting
+    that directory first on the include path makes gcc load the
+    precompiled header instead of parsing `csmith.h` and its platform
+    headers for every compilation (and fall back to the copy if it cannot
+    use it). Upgrading the compiler changes its identity, hence the
+    directory. Headers are built once per cache directory, by the first
+    process that needs them; a compiler that cannot build one (e.g. clang,
+    which needs `-include-pch`) is simply not given any.
+
+    Attributes:
+        pch_dir: The directory holding the precompiled headers.
+        include_dir: The directory of the original `csmith.h`.
+    """
+    def __init__(self, pch_dir: str, include_dir: str):
+        self.pch_dir = os.path.abspath(pch_dir)
+        self.include_dir = include_dir
+        self._dirs: dict[tuple, str | None] = {}
+        os.makedirs(self.pch_dir, exist_ok=True)
+
+    def key(self, compiler: str, args: list[str]) -> str:
+        h = hashlib.sha256()
+        h.update(compiler_identity(compiler).encode('utf-8'))
+        h.update(b"\0")
+        h.update(" ".join(args).encode('utf-8'))
+        h.update(b"\0")
+        with open(os.path.join(self.include_dir, HEADER), "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()[:24]
+
+    def header_dir(self, compiler: str, args: list[str]) -> str | None:
+        """The directory of the precompiled header for `compiler` and `args`,
+        built on first use (None if it cannot be built)."""
+        if "gcc" not in os.path.basename(compiler):
+            return None
+        cache_key = (compiler, tuple(args))
+        if cache_key not in self._dirs:
+            self._dirs[cache_key] = self.build(compiler, args)
+        return self._dirs[cache_key]
+
+    def build(self, compiler: str, args: list[str]) -> str | None:
+        header_dir = os.path.join(self.pch_dir, self.key(compiler, args))
+        gch = os.path.join(header_dir, f"{HEADER}.gch")
+        failed = os.path.join(header_dir, "failed")
+        os.makedirs(header_dir, exist_ok=True)
+        # the first process builds the header, the others wait for it
+        with open(os.path.join(header_dir, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(failed):
+                return None
+            if os.path.exists(gch):
+                return header_dir
+            fd, tmp = mkstemp(dir=header_dir, suffix=".gch.tmp")
+            os.close(fd)
+            process = subprocess.run([compiler, "-x", "c-header",
+                                      os.path.join(self.include_dir, HEADER),
+                                      f"-I{self.include_dir}", *args, "-o", tmp],
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if process.returncode != 0:
+                os.remove(tmp)
+                with open(failed, "wb") as f:
+                    f.write(process.stderr)
+                return None
+            shutil.copyfile(os.path.join(self.include_dir, HEADER),
+                            os.path.join(header_dir, HEADER))
+            os.replace(tmp, gch)
+        return header_dir
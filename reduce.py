@@ -1,46 +1,157 @@
-import sys
-import os
+"""The interestingness test run by creduce for every candidate program.
+
+creduce tests thousands of candidates, so the test is split in two: a
+`ValidatorServer` holds the parsed case in memory and answers on a Unix
+socket, and the test script only runs this file as a tiny client:
 
-current_file_path = os.path.abspath(__file__)
+    python3 -S reduce.py <socket> <candidate>
+
+which exits with the verdict of the server (0 means interesting). Only
+the standard library needed by the client is imported at module level.
+A server can also be started by hand:
+
+    python3 reduce.py --serve <reduce_dir> <socket> [timeout]
+"""
+import os
+import sys
+import socket
 
-current_dir = os.path.dirname(current_file_path)
-print(current_dir)
-os.environ["PATH"] = f"{os.environ['PATH']}:{current_dir}"
 
-from filemanager import create_case_from_log
+def ask(socket_path: str, candidate: str) -> int:
+    """Ask the server at `socket_path` whether `candidate` is interesting."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(f"{candidate}\n".encode())
+        reply = client.makefile("r").readline().strip()
+    return int(reply) if reply else 1
 
 
 class Validator:
-    def __init__(self, reduce_dir: str):
+    """A `Validator` tells whether a candidate orig still triggers the bug of a case.
+
+    Every mutant that was evaluated is rebuilt from the candidate with its
+    recorded `function_dict`, and all files are compiled and run (in
+    memory) at their recorded levels. The candidate is interesting if the
+    signature of the rebuilt case (kind, ICE, failing levels and verdicts)
+    equals the one of the recorded results.
+    """
+    def __init__(self, reduce_dir: str, timeout: float = 1):
+        from tempfile import mkdtemp
+        from filemanager import create_case_from_log
+        from signature import bug_signature
+
         self.case = create_case_from_log(f"{reduce_dir}/log.json")
         self.reduce_dir = reduce_dir
+        self.timeout = timeout
+        self.key, _ = bug_signature(self.case)
+        self.scratch_root = mkdtemp(prefix="validator_")
 
-    def apply_transformation(self):
-        """apply transformation on orig.c to all mutant
+    def candidate(self, code: str):
+        from tempfile import mkdtemp
+        from filemanager import FileINFO, MutantFileINFO, CaseManager
+        from source import SourceModel
 
-        procedure:
-            1. process orig.c
-                - if new result doesn't match original result, return False
+        orig = self.case.orig
+        new_orig = FileINFO(orig.filepath, orig.compiler, orig.args)
+        new_orig.code = code
+        new_orig.scratch_dir = mkdtemp(dir=self.scratch_root)
+        case = CaseManager(new_orig)
+        source = SourceModel(code)
+        for mutant in self.case.mutants:
+            if not mutant.result_dict:
+                # never evaluated, so it has no recorded results to preserve
+                continue
+            new_mutant = MutantFileINFO(mutant.filepath, mutant.compiler, mutant.args,
+                                        mutant.function_dict)
+            new_mutant.code = source.render(mutant.function_dict)
+            new_mutant._source = source
+            new_mutant.scratch_dir = new_orig.scratch_dir
+            case.add_mutant(new_mutant)
+        return case
+
+    def apply_transformation(self, code: str) -> bool:
+        """
         Returns:
-            True:
+            bool: True if `code` as the orig still shows the recorded bug
         """
-        res = self.case.orig.res
-        self.case.orig.process_file(timeout=1)
-        if self.case.orig.res != res:
-            return False
-        for mutant in self.case.mutants:
-            new_mutant = mutant.mutate(mutant_file=mutant.filepath.replace(".c", "_r.c"),
-                                       opt_dict=mutant.function_dict, code=self.case.orig.text)
-            if new_mutant is None:
-                return False
-            new_mutant.process_file(timeout=1)
-            if new_mutant.res != mutant.res:
-                return False
-        return True
+        import asyncio
+        from filemanager import CaseManager, BinaryIndex
+        from signature import bug_signature
+
+        case = self.candidate(code)
+        recorded = dict(zip(case.files, [self.case.orig, *[m for m in self.case.mutants
+                                                           if m.result_dict]]))
+        binaries = BinaryIndex()
+
+        async def process():
+            await asyncio.gather(*(CaseManager.aprocess_files(
+                [file], self.timeout, opts=[opt for opt in old.result_dict], binaries=binaries)
+                for file, old in recorded.items()))
+        try:
+            asyncio.run(process())
+        finally:
+            case.cleanup()
+        return bug_signature(case)[0] == self.key
+
+    def close(self):
+        import shutil
+        shutil.rmtree(self.scratch_root, ignore_errors=True)
+
+
+class ValidatorServer:
+    """A `ValidatorServer` answers interestingness queries on a Unix socket.
+
+    Each connection sends the path of a candidate and gets back `0`
+    (interesting) or `1`. Connections are handled in threads, so a
+    parallel creduce is served concurrently.
+    """
+    def __init__(self, validator: Validator, socket_path: str):
+        import socketserver
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(handler):
+                candidate = handler.rfile.readline().decode().strip()
+                try:
+                    with open(candidate, "r") as f:
+                        code = f.read()
+                    verdict = 0 if validator.apply_transformation(code) else 1
+                except Exception as e:
+                    print(f"Validator failed on {candidate}: {e}", file=sys.stderr)
+                    verdict = 1
+                handler.wfile.write(f"{verdict}\n".encode())
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.validator = validator
+        self.socket_path = socket_path
+        self.server = Server(socket_path, Handler)
+        self._thread = None
+
+    def start(self):
+        from threading import Thread
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.validator.close()
 
 
 if __name__ == "__main__":
-    reduce_dir = sys.argv[1]
-    validator = Validator(reduce_dir)
-    flag = validator.apply_transformation()
-    exit(0 if flag else 1)
+    if sys.argv[1] == "--serve":
+        reduce_dir, socket_path = sys.argv[2], sys.argv[3]
+        timeout = float(sys.argv[4]) if len(sys.argv) > 4 else 1
+        server = ValidatorServer(Validator(reduce_dir, timeout), socket_path)
+        print(f"Validating candidates of {reduce_dir} on {socket_path}")
+        try:
+            server.server.serve_forever()
+        finally:
+            server.stop()
+    else:
+        sys.exit(ask(sys.argv[1], os.path.abspath(sys.argv[2])))
@@ -1,69 +1,237 @@
 import os
-import random
-import re
+import json
+import sys
+import time
+import shutil
+import signal
+import resource
 import subprocess
-from shutil import copyfile
-from tempfile import mkdtemp
-from multiprocessing import Process
+from tempfile import mkdtemp, gettempdir
+from multiprocessing import BoundedSemaphore
 
-from filemanager import CaseManager, CaseBuffer
+from filemanager import CaseManager, ReductionQueue, create_case_from_log
 from configs import SCRIPT
+from sandbox import _cpu_time
+from reduce import Validator, ValidatorServer
+from oracle import Oracle
+from stage import Stage
+import metrics
 
-class Reducer:
-    def __init__(self, input_buffer: CaseBuffer, timeout: float = 5):
+STATE_FILE = "reduce_state.json"
+
+
+class ReductionBudget:
+    """The wall and CPU seconds a reduction may still spend.
+
+    CPU time is that of the reducing process and of every child it waited
+    for (compilers, test programs, creduce), as reported by `getrusage`.
+    A resumed reduction starts with the time already spent on it.
+    """
+    def __init__(self, wall: float = None, cpu: float = None,
+                 wall_spent: float = 0, cpu_spent: float = 0):
+        self.wall = wall
+        self.cpu = cpu
+        self._wall_start = time.time() - wall_spent
+        self._cpu_start = self._cpu_now() - cpu_spent
+
+    @staticmethod
+    def _cpu_now() -> float:
+        usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+        return sum(u.ru_utime + u.ru_stime for u in usage)
+
+    @property
+    def wall_spent(self) -> float:
+        return time.time() - self._wall_start
+
+    @property
+    def cpu_spent(self) -> float:
+        return self._cpu_now() - self._cpu_start
+
+    def remaining(self, extra_cpu: float = 0) -> float:
+        """The smallest of the wall and CPU seconds left."""
+        left = [float("inf")]
+        if self.wall:
+            left.append(self.wall - self.wall_spent)
+        if self.cpu:
+            left.append(self.cpu - self.cpu_spent - extra_cpu)
+        return min(left)
+
+    def expired(self, extra_cpu: float = 0) -> bool:
+        return self.remaining(extra_cpu) <= 0
+
+
+class Reducer(Stage):
+    """A `Reducer` reduces the saved bug cases fed by the oracle.
+
+    Cases come from a `ReductionQueue` as case directories. Each case is
+    reduced in two steps: the options of every mutant (`reduce_patch`),
+    then the program itself with creduce. A reduction stops once its
+    per-case wall/CPU `budget` is spent, and at most `max_reductions` run
+    at once over all workers. Progress is checkpointed to
+    `reduce_state.json` in the case directory, so an interrupted reduction
+    resumes where it stopped (see `pending`).
+    """
+    name = "reducer"
+    counter = "cases_reduced"
+
+    def __init__(self, input_buffer: ReductionQueue, timeout: float = 5,
+                 num_workers: int = 5, wall_budget: float = 600,
+                 cpu_budget: float = 1200, max_reductions: int = 1):
+        super().__init__(num_workers)
         self.input_buffer = input_buffer
         self.timeout = timeout
+        self.wall_budget = wall_budget
+        self.cpu_budget = cpu_budget
+        self.slots = BoundedSemaphore(max(1, max_reductions))
 
-        self.reduce_processes = [Process(target=self.reduce) for _ in range(5)]
+    def work(self, stop):
+        self.reduce(stop)
 
-    def reduce(self):
-        while True:
+    def reduce(self, stop=None):
+        while stop is None or not stop.is_set():
             # main loop of reducer thread
-            case = self.input_buffer.get()
-            # 1. reduce patch for each case
-            self.reduce_patch(case)
-            # ! case reduction take place in sub tmpdir
-            reduce_dir = mkdtemp(dir=case.case_dir)
+            case_dir = self.input_buffer.get()
+            with self.slots:
+                start = time.time()
+                try:
+                    self.reduce_case_dir(case_dir)
+                except Exception as e:
+                    # keep the worker alive; the case stays pending for a restart
+                    print(f"Reduction of {case_dir} failed: {e}", file=sys.stderr)
+                finally:
+                    self.record(start)
+
+    @staticmethod
+    def load_state(case_dir: str) -> dict:
+        try:
+            with open(os.path.join(case_dir, STATE_FILE), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def save_state(case_dir: str, state: dict, budget: ReductionBudget):
+        state["wall"] = round(budget.wall_spent, 3)
+        state["cpu"] = round(budget.cpu_spent, 3)
+        tmp = os.path.join(case_dir, f"{STATE_FILE}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(case_dir, STATE_FILE))
+
+    @staticmethod
+    def pending(test_dir: str) -> list[str]:
+        """The saved cases of `test_dir` whose reduction is not finished."""
+        if not os.path.isdir(test_dir):
+            return []
+        case_dirs = []
+        for name in sorted(os.listdir(test_dir)):
+            case_dir = os.path.join(test_dir, name)
+            if os.path.exists(os.path.join(case_dir, "log.json")) and \
+                    Reducer.load_state(case_dir).get("stage") not in ("done", "partial"):
+                case_dirs.append(case_dir)
+        return case_dirs
 
-            new_case = case.copyfiles(reduce_dir)
-            new_case.save_log()
+    def reduce_case_dir(self, case_dir: str):
+        state = self.load_state(case_dir)
+        if state.get("stage") in ("done", "partial"):
+            return
+        state.setdefault("stage", "patch")
+        state.setdefault("patched", [])
+        budget = ReductionBudget(self.wall_budget, self.cpu_budget,
+                                 state.get("wall", 0), state.get("cpu", 0))
+        case = create_case_from_log(os.path.join(case_dir, "log.json"))
+        # the timeout the oracle found the bug with, if it is logged
+        timeout = case.timeout or self.timeout
 
-            self.reduce_case(new_case)
+        # 1. reduce patch for each case
+        if state["stage"] == "patch":
+            for mutant in case.mutants:
+                if mutant.basename in state["patched"] or \
+                        not Oracle.check_mutant(case.orig, mutant):
+                    # done before an interruption, or agreeing with the orig
+                    # (including never evaluated by the oracle)
+                    continue
+                if budget.expired():
+                    break
+                mutant.reduce_patch(timeout=timeout, orig_result=case.orig.result_dict,
+                                    budget=budget)
+                state["patched"].append(mutant.basename)
+                case.save_log()
+                self.save_state(case_dir, state, budget)
+            state["stage"] = "creduce"
 
-    def reduce_patch(self, case: CaseManager):
-        # reduce a single patch
-        for mutant in case.mutants:
-            mutant.reduce_patch(timeout=self.timeout)
+        # 2. reduce the program, in a sub tmpdir
+        if budget.expired():
+            state["stage"] = "partial"
+        else:
+            reduce_dir = state.get("reduce_dir")
+            if not reduce_dir or not os.path.isdir(reduce_dir):
+                reduce_dir = mkdtemp(dir=case.case_dir)
+                new_case = case.copyfiles(reduce_dir)
+                # a working copy, not a case of the campaign
+                new_case.save_log(store=False)
+                state["reduce_dir"] = reduce_dir
+            self.save_state(case_dir, state, budget)
+            new_case = create_case_from_log(os.path.join(reduce_dir, "log.json"))
+            finished = self.reduce_case(new_case, budget, timeout)
+            state["stage"] = "done" if finished else "partial"
+        self.save_state(case_dir, state, budget)
+        if state["stage"] == "partial":
+            metrics.inc("reductions_expired")
+            print(f"Reduction budget of {case_dir} spent, keeping the partial result")
 
     @staticmethod
-    def reduce_case(case: CaseManager):
+    def reduce_case(case: CaseManager, budget: ReductionBudget = None,
+                    timeout: float = 1) -> bool:
+        """Run creduce on the orig of `case` within `budget`.
+
+        creduce keeps the smallest program found so far in place, so running
+        it again on the same directory continues an interrupted reduction.
+        Candidates are judged by a `ValidatorServer` running in this process
+        for the duration of the reduction.
+
+        Returns:
+            bool: False if creduce was stopped because the budget was spent
+        """
         # ! turn off (pass-clex rename-toks), (pass-clang rename-fun) in creduce
         # TODO: deal with decl reduction in the file
         # backup files
-        script = SCRIPT.format(os.getcwd(), os.getcwd(), case.case_dir)
+        if shutil.which("creduce") is None:
+            print("creduce not found, skipping program reduction")
+            return True
+        # unix socket paths are short, so the socket does not live in the case dir
+        socket_dir = mkdtemp(prefix="cbouncy_", dir=gettempdir())
+        socket_path = os.path.join(socket_dir, "validator.sock")
+        server = ValidatorServer(Validator(case.case_dir, timeout), socket_path)
+        script = SCRIPT.format(os.path.join(os.path.dirname(os.path.abspath(__file__)), "reduce.py"),
+                               socket_path, case.orig.basename)
         with open(f"{case.case_dir}/reduce.sh", "w") as f:
             f.write(script)
             f.close()
-        subprocess.run(["creduce", "reduce.sh", case.orig.abspath], cwd=case.case_dir)
-
-        # generate a reduce bash
-
-    def run(self):
-        for process in self.reduce_processes:
-            process.start()
-
-    def join(self):
-        for process in self.reduce_processes:
-            process.join()
+        os.chmod(f"{case.case_dir}/reduce.sh", 0o755)
 
+        server.start()
+        try:
+            process = subprocess.Popen(["creduce", "reduce.sh", case.orig.abspath],
+                                       cwd=case.case_dir, start_new_session=True)
+            while True:
+                try:
+                    process.wait(timeout=1)
+                    return True
+                except subprocess.TimeoutExpired:
+                    pass
+                # creduce waits for its own children, so their time adds up in its stat
+                if budget is not None and budget.expired(_cpu_time(process.pid, children=True)):
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.wait()
+                    return False
+        finally:
+            server.stop()
+            shutil.rmtree(socket_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
-    from filemanager import create_case_from_log
-    case = create_case_from_log("/root/CBouncy/case_535/tmprrr_9etw/log.json")
-    # for mutant in case.mutants:
-    #     mutant.reduce_patch(timeout=5)
-    # new_dir = mkdtemp(dir=case.case_dir)
-    # new_case = case.copyfiles(new_dir)
-    # new_case.save_log()
-    Reducer.reduce_case(case)
+    # reduce saved cases by hand: python3 reducer.py <case_dir>...
+    reducer = Reducer(None, max_reductions=1)
+    for case_dir in sys.argv[1:]:
+        reducer.reduce_case_dir(os.path.abspath(case_dir))
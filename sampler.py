@@ -0,0 +1,132 @@
+import json
+import random
+from collections import defaultdict
+from itertools import combinations
+from multiprocessing import Array, Lock
+
+from metrics import FLAGS
+
+
+class OptionSampler:
+    """An `OptionSampler` picks mutation options, favouring productive ones.
+
+    Every option, and every pair of options given to the same function,
+    is a bandit arm. Its score is the posterior mean of its reward, which
+    starts at `alpha / (alpha + beta)` and follows the rewards reported
+    by the oracle: 1 for a mutant that disagrees with its orig and
+    `codegen_reward` for a mutant that only compiled to other code than
+    the orig. Options are drawn one at a time, each with a weight
+    averaging its own score with the scores of its pairs with the options
+    already drawn. With probability `explore`, the options are drawn
+    uniformly instead.
+
+    Statistics live in shared memory, so a sampler created before the
+    workers are forked is updated by every oracle and read by every
+    mutator. Cases mutated with adaptive weights are no longer
+    regenerated exactly from their seed.
+
+    Attributes:
+        opts: The options the sampler keeps statistics for.
+        explore: The probability of a uniform draw.
+    """
+    def __init__(self, opts: tuple[str] = FLAGS, explore: float = 0.1,
+                 alpha: float = 1, beta: float = 10, codegen_reward: float = 0.1):
+        self.opts = tuple(opts)
+        self.index = {opt: i for i, opt in enumerate(self.opts)}
+        self.explore = explore
+        self.alpha = alpha
+        self.beta = beta
+        self.codegen_reward = codegen_reward
+        n = len(self.opts)
+        self.trials = Array('d', n, lock=False)
+        self.rewards = Array('d', n, lock=False)
+        self.pair_trials = Array('d', n * (n - 1) // 2, lock=False)
+        self.pair_rewards = Array('d', n * (n - 1) // 2, lock=False)
+        self.lock = Lock()
+
+    def pair(self, i: int, j: int) -> int:
+        if i > j:
+            i, j = j, i
+        return i * (2 * len(self.opts) - i - 1) // 2 + (j - i - 1)
+
+    def score(self, i: int) -> float:
+        return (self.rewards[i] + self.alpha) / (self.trials[i] + self.alpha + self.beta)
+
+    def pair_score(self, i: int, j: int) -> float:
+        p = self.pair(i, j)
+        return (self.pair_rewards[p] + self.alpha) / (self.pair_trials[p] + self.alpha + self.beta)
+
+    def sample(self, cands: list[str], k: int, rng: random.Random = random) -> list[str]:
+        """Draw `k` distinct options of `cands`."""
+        if rng.random() < self.explore or any(opt not in self.index for opt in cands):
+            return rng.sample(cands, k)
+        idx = [self.index[opt] for opt in cands]
+        weights = [self.score(i) for i in idx]
+        pair_sums = [0.0] * len(idx)
+        chosen = []
+        for _ in range(k):
+            w = [0.0 if p in chosen else (weights[p] + pair_sums[p]) / (1 + len(chosen))
+                 for p in range(len(idx))]
+            p = rng.choices(range(len(idx)), w)[0]
+            chosen.append(p)
+            for q in range(len(idx)):
+                if q not in chosen:
+                    pair_sums[q] += self.pair_score(idx[p], idx[q])
+        return [cands[p] for p in chosen]
+
+    def update(self, function_dict: dict[str : list[str]], reward: float):
+        """Credit the options of an evaluated mutant with `reward`.
+
+        The mutant counts as one trial, shared evenly by its patched
+        functions: an option (or pair) is credited with the fraction of
+        them it was given to. Crediting every option of the mutant in
+        full would reward the options of every function alike, since a
+        mutant patching many functions draws most of them.
+        """
+        patched = [opts for opts in function_dict.values() if opts]
+        if not patched:
+            return
+        weight = 1 / len(patched)
+        flags = defaultdict(float)
+        pairs = defaultdict(float)
+        for opts in patched:
+            idx = sorted(self.index[opt] for opt in set(opts) if opt in self.index)
+            for i in idx:
+                flags[i] += weight
+            for i, j in combinations(idx, 2):
+                pairs[self.pair(i, j)] += weight
+        with self.lock:
+            for i, share in flags.items():
+                self.trials[i] += share
+                self.rewards[i] += reward * share
+            for p, share in pairs.items():
+                self.pair_trials[p] += share
+                self.pair_rewards[p] += reward * share
+
+    def save(self, path: str):
+        """Dump the statistics seen so far to `path` (by option name)."""
+        with self.lock:
+            state = {
+                "opts": {opt: [self.trials[i], self.rewards[i]]
+                         for opt, i in self.index.items() if self.trials[i]},
+                "pairs": [[self.opts[i], self.opts[j], self.pair_trials[self.pair(i, j)],
+                           self.pair_rewards[self.pair(i, j)]]
+                          for i, j in combinations(range(len(self.opts)), 2)
+                          if self.pair_trials[self.pair(i, j)]]
+            }
+        with open(path, "w") as f:
+            json.dump(state, f)
+
+    def load(self, path: str):
+        with open(path, "r") as f:
+            state = json.load(f)
+        with self.lock:
+            for opt, (trials, rewards) in state["opts"].items():
+                if opt in self.index:
+                    self.trials[self.index[opt]] = trials
+                    self.rewards[self.index[opt]] = rewards
+            for a, b, trials, rewards in state["pairs"]:
+                if a in self.index and b in self.index:
+                    p = self.pair(self.index[a], self.index[b])
+                    self.pair_trials[p] = trials
+                    self.pair_rewards[p] = rewards
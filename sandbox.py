@@ -0,0 +1,193 @@
+import os
+import time
+import signal
+import resource
+import subprocess
+from tempfile import TemporaryFile
+
+# CPU seconds a compilation may use
+COMPILE_CPU_LIMIT = 180
+# default limits of a test program; the CPU time limit is given per run
+MEMORY_LIMIT = 1 << 30
+OUTPUT_LIMIT = 1 << 20
+# a program that sleeps never uses up its CPU time, so it is killed once
+# it has run for WALL_FACTOR times its CPU time limit (at least WALL_MIN seconds)
+WALL_FACTOR = 10
+WALL_MIN = 10
+
+CPU_TIME_EXCEEDED = "cpu time limit exceeded"
+OUTPUT_EXCEEDED = "output limit exceeded"
+WALL_TIME_EXCEEDED = "wall time limit exceeded"
+MEMORY_EXCEEDED = "memory limit exceeded"
+# a program killed by a signal once its address space came this close to
+# the memory limit is taken to have run out of memory (e.g. a stack overflow)
+MEMORY_MARGIN = 0.9
+
+
+def configure_sandbox(memory_limit: int = None, output_limit: int = None):
+    global MEMORY_LIMIT, OUTPUT_LIMIT
+    if memory_limit:
+        MEMORY_LIMIT = memory_limit
+    if output_limit:
+        OUTPUT_LIMIT = output_limit
+
+
+def _limits(cpu_time: float = None, memory: int = None,
+            output: int = None) -> list[tuple[int, tuple[int, int]]]:
+    # RLIMIT_CPU only has a resolution of one second, so it is rounded up
+    # and acts as a backstop for the finer-grained watchdog of `run_sandboxed`
+    limits = [(resource.RLIMIT_CORE, (0, 0))]
+    if cpu_time is not None:
+        seconds = int(cpu_time) + 1
+        limits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+    if memory is not None:
+        limits.append((resource.RLIMIT_AS, (memory, memory)))
+    if output is not None:
+        limits.append((resource.RLIMIT_FSIZE, (output, output)))
+    return limits
+
+
+def apply_limits(pid: int, cpu_time: float = None, memory: int = None, output: int = None):
+    """Apply resource limits to a child process right after its spawn.
+
+    A `preexec_fn` is not safe in a process running threads, and makes
+    `subprocess` fork instead of vfork, so the limits are set with `prlimit`.
+    Children the process spawns afterwards inherit them.
+    """
+    for rlimit, value in _limits(cpu_time, memory, output):
+        try:
+            resource.prlimit(pid, rlimit, value)
+        except ProcessLookupError:
+            break
+
+
+def _cpu_time(pid: int, children: bool = False) -> float:
+    """The CPU time (user + system) used so far by a running process,
+    plus the time of its children it already waited for if `children`."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+    except (OSError, IndexError):
+        return 0.0
+    ticks = int(fields[11]) + int(fields[12])
+    if children:
+        ticks += int(fields[13]) + int(fields[14])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def _peak_memory(pid: int) -> tuple[int | None, int | None]:
+    """The peak resident set size and peak virtual memory size in KiB of a
+    running process."""
+    peaks = {}
+    try:
+        with open(f"/proc/{pid}/status", "rb") as f:
+            for line in f:
+                if line.startswith((b"VmHWM:", b"VmPeak:")):
+                    peaks[line[:line.index(b":")]] = int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return peaks.get(b"VmHWM"), peaks.get(b"VmPeak")
+
+
+class RunResult:
+    """The outcome of a sandboxed run.
+
+    Attributes:
+        returncode: The exit code, or the negated signal number.
+        stdout: The captured standard output (at most the output limit).
+        cpu_time: The CPU seconds (user + system) used by the program.
+        max_rss: The peak resident set size in KiB, as last sampled by the
+            watchdog (None if the program exited before the first sample).
+            `wait4` cannot be used for it: Linux carries the RSS of the
+            forking interpreter over the exec.
+        wall_time: The elapsed seconds.
+        signal: The name of the signal that killed the program, if any.
+        limit: Which limit was exceeded, if any.
+    """
+    def __init__(self, returncode: int, stdout: bytes, cpu_time: float,
+                 max_rss: int | None, wall_time: float, limit: str = None):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+        self.wall_time = wall_time
+        self.signal = signal.Signals(-returncode).name if returncode < 0 else None
+        self.limit = limit
+
+    @property
+    def timed_out(self) -> bool:
+        return self.limit in (CPU_TIME_EXCEEDED, WALL_TIME_EXCEEDED)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "cpu_time": round(self.cpu_time, 4),
+            "max_rss": self.max_rss,
+            "wall_time": round(self.wall_time, 4),
+            "returncode": self.returncode,
+            "signal": self.signal,
+            "limit": self.limit
+        }
+
+
+def run_sandboxed(cmd: list[str], cwd: str = None, cpu_time: float = 1,
+                  memory: int = None, output: int = None) -> RunResult:
+    """Run a test program under CPU time, memory and output size limits.
+
+    The verdict only depends on the CPU time used by the program, so it does
+    not change with the machine load. Standard output goes to an unlinked
+    temporary file limited by `RLIMIT_FSIZE`, and the program is reaped with
+    `wait4` to collect its CPU time. This call blocks; the execution
+    engine runs it in a worker thread.
+    """
+    memory = memory or MEMORY_LIMIT
+    output = output or OUTPUT_LIMIT
+    wall_limit = max(cpu_time * WALL_FACTOR, WALL_MIN)
+    poll = min(0.01, max(cpu_time / 20, 0.001))
+    limit = None
+    max_rss = max_vm = None
+    delay = 0.0005
+
+    with TemporaryFile(dir=cwd) as out:
+        start = time.time()
+        # without a preexec_fn the child is spawned with vfork, so its peak
+        # RSS is not inflated by a copy of this interpreter; the limits are
+        # applied with prlimit right after the spawn instead
+        process = subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL,
+                                   stdout=out, stderr=subprocess.DEVNULL,
+                                   start_new_session=True)
+        apply_limits(process.pid, cpu_time, memory, output)
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            rss, vm = _peak_memory(process.pid)
+            max_rss = rss or max_rss
+            max_vm = vm or max_vm
+            if limit is None:
+                if _cpu_time(process.pid) > cpu_time:
+                    limit = CPU_TIME_EXCEEDED
+                elif time.time() - start > wall_limit:
+                    limit = WALL_TIME_EXCEEDED
+                if limit is not None:
+                    os.killpg(process.pid, signal.SIGKILL)
+            # most test programs finish within milliseconds, poll them quickly
+            time.sleep(delay)
+            delay = min(delay * 2, poll)
+        wall_time = time.time() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        out.seek(0)
+        stdout = out.read(output)
+
+    returncode = process.returncode
+    if returncode == -signal.SIGXCPU:
+        limit = CPU_TIME_EXCEEDED
+    elif returncode == -signal.SIGXFSZ:
+        limit = OUTPUT_EXCEEDED
+    elif limit is None and returncode < 0 and \
+            (returncode == -signal.SIGKILL or (max_vm or 0) << 10 >= memory * MEMORY_MARGIN):
+        # killed by the OOM killer, or crashed on a failed allocation
+        limit = MEMORY_EXCEEDED
+    return RunResult(returncode, stdout, rusage.ru_utime + rusage.ru_stime,
+                     max_rss, wall_time, limit)
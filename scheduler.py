@@ -0,0 +1,98 @@
+import os
+import time
+
+from filemanager import CaseBuffer
+from stage import Stage
+
+
+def default_workers(budget: int = None) -> dict[str, int]:
+    """Split a budget of worker processes (defaults to the CPU count) over the stages.
+
+    The oracle gets the lion's share since compiling and running every
+    mutant at every opt level dominates the cost of a case.
+    """
+    budget = max(4, budget or os.cpu_count() or 1)
+    generator = max(1, budget // 8)
+    mutator = max(1, budget // 16)
+    reducer = max(1, budget // 16)
+    oracle = max(1, budget - generator - mutator - reducer)
+    return {"generator": generator, "mutator": mutator,
+            "oracle": oracle, "reducer": reducer}
+
+
+class StageScheduler:
+    """A `StageScheduler` rebalances the workers of a pipeline of stages.
+
+    The pipeline is a chain of stages connected by `CaseBuffer`s. Every
+    `interval` seconds, the scheduler computes a target size for each stage
+    proportional to its observed service time (every case passes through
+    every stage of the chain), then nudges it by the depth of the buffers:
+    a full output buffer means the stage is ahead of its consumer, an
+    empty one that its consumer is starving. Each stage moves at most one
+    worker per interval towards its target, and the total never exceeds
+    `budget`. Stages outside of the chain (e.g. the reducer) keep their size
+    but count towards the budget.
+
+    The scheduler has no thread of its own: its owner calls `tick` while it
+    waits, from the main thread. Growing a stage forks a worker, and a fork
+    from another thread while the main thread runs may leave the child
+    with locks held by threads it does not have.
+
+    Attributes:
+        pipeline: The stages of the chain, in order.
+        buffers: The buffers between two consecutive stages of the chain.
+        budget: The maximum total number of workers.
+        interval: The seconds between two rebalances.
+    """
+    def __init__(self, pipeline: list[Stage], buffers: list[CaseBuffer],
+                 budget: int = None, interval: float = 10,
+                 fixed: list[Stage] = None):
+        assert len(buffers) == len(pipeline) - 1
+        self.pipeline = pipeline
+        self.buffers = buffers
+        self.fixed = fixed or []
+        self.budget = budget or os.cpu_count() or 1
+        self.interval = interval
+        self._next = time.time() + interval
+
+    def targets(self) -> list[int]:
+        budget = max(len(self.pipeline),
+                     self.budget - sum(stage.size for stage in self.fixed))
+        service_times = [stage.service_time for stage in self.pipeline]
+        if any(t is None for t in service_times):
+            targets = [stage.size for stage in self.pipeline]
+        else:
+            total = sum(service_times) or 1
+            targets = [max(1, round(budget * t / total)) for t in service_times]
+
+        for i, buffer in enumerate(self.buffers):
+            if buffer.is_full():
+                targets[i] = max(1, targets[i] - 1)
+                targets[i + 1] += 1
+            elif buffer.is_empty():
+                targets[i] += 1
+                targets[i + 1] = max(1, targets[i + 1] - 1)
+
+        while sum(targets) > budget:
+            i = max(range(len(targets)), key=lambda j: targets[j])
+            if targets[i] == 1:
+                break
+            targets[i] -= 1
+        return targets
+
+    def rebalance(self):
+        targets = self.targets()
+        # shrink before growing so the budget is respected at any time
+        for stage, target in zip(self.pipeline, targets):
+            if target < stage.size:
+                stage.resize(stage.size - 1)
+        for stage, target in zip(self.pipeline, targets):
+            if target > stage.size:
+                stage.resize(stage.size + 1)
+
+    def tick(self):
+        """Rebalance the stages if `interval` seconds passed since the last time."""
+        now = time.time()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.rebalance()
@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+from tempfile import mkstemp
+
+from filemanager import CaseManager, FileINFO
+from configs import (SIMPLE_OPTS, COMPILE_TIMEOUT, COMPILER_CRASHED,
+                     RUNTIME_TIMEOUT, RUNTIME_CRASHED)
+
+ICE_MESSAGE = re.compile(r"internal compiler error: (.*)")
+# first frame of a gcc backtrace, e.g. `0x8a1e3f fold_binary_loc(unsigned int, ...)`
+BACKTRACE_FRAME = re.compile(r"^\s*0x[0-9a-f]+ ([^\s(]+)", re.M)
+# locations, addresses and numbers vary between two reports of the same crash
+NOISE = (
+    (re.compile(r"\S+\.[ch]:\d+(:\d+)?"), "<loc>"),
+    (re.compile(r"0x[0-9a-fA-F]+"), "<addr>"),
+    (re.compile(r"‘[^’]*’|'[^']*'"), "<id>"),
+    (re.compile(r"\d+"), "<n>"),
+)
+
+
+def normalize_ice(stderr: str) -> str | None:
+    """Reduce the stderr of a crashed compiler to its ICE message and first
+    backtrace frame (None if the compiler did not report an ICE)."""
+    match = ICE_MESSAGE.search(stderr)
+    if match is None:
+        return None
+    message = match.group(1).strip()
+    for pattern, repl in NOISE:
+        message = pattern.sub(repl, message)
+    frame = BACKTRACE_FRAME.search(stderr)
+    return f"{message} @ {frame.group(1)}" if frame else message
+
+
+def verdict(res: str, reference: str | None) -> str:
+    """Classify a result of a level, comparing checksums against `reference`."""
+    if res in (COMPILE_TIMEOUT, COMPILER_CRASHED, RUNTIME_TIMEOUT, RUNTIME_CRASHED):
+        return res
+    if reference is None or res == reference:
+        return "ok"
+    return "diff"
+
+
+def file_pattern(file: FileINFO, reference: dict[str : str]) -> tuple[tuple[str, str], ...]:
+    return tuple((opt, verdict(file.result_dict[opt], reference.get(opt)))
+                 for opt in SIMPLE_OPTS if opt in file.result_dict)
+
+
+def bug_signature(case: CaseManager) -> tuple[str, dict]:
+    """Compute the signature of the bug carried by an evaluated case.
+
+    The signature is made of:
+        kind: What went wrong (ICE, compiler crash/timeout, runtime
+            crash or wrong code).
+        ice: The normalized ICE messages and first backtrace frames.
+        levels: The opt levels where the bug shows up.
+        pattern: The verdicts seen at each failing level, over the orig and
+            the mutants, so it does not depend on which file or how many
+            files hit the bug.
+
+    Only an ICE is identified by its signature: its key is computed from
+    the kind and the ICE messages and frames alone, so the same ICE hit at
+    other levels keeps its key. The key of other bugs (wrong code, runtime
+    crashes) merely groups them by the levels and verdicts they show, so
+    two unrelated miscompiles can share a key.
+
+    Returns:
+        The signature key (a hex digest) and its components.
+    """
+    orig = case.orig
+    # the orig is compared against its own most common checksum
+    checksums = [res for res in orig.result_dict.values()
+                 if verdict(res, None) == "ok"]
+    majority = max(set(checksums), key=checksums.count) if checksums else None
+    patterns = {file_pattern(orig, {opt: majority for opt in orig.result_dict})}
+    for mutant in case.mutants:
+        if mutant.result_dict:
+            pattern = file_pattern(mutant, orig.result_dict)
+            if any(v != "ok" for _, v in pattern):
+                patterns.add(pattern)
+
+    failures = {}
+    for pattern in patterns:
+        for opt, v in pattern:
+            if v != "ok":
+                failures.setdefault(opt, set()).add(v)
+    levels = sorted(failures, key=SIMPLE_OPTS.index)
+    ice = sorted({ice for file in case.files
+                  for ice in map(normalize_ice, file.compile_errors.values()) if ice})
+    verdicts = set().union(*failures.values())
+    if ice:
+        kind = "ice"
+    else:
+        kind = next((v for v in (COMPILER_CRASHED, COMPILE_TIMEOUT, RUNTIME_CRASHED)
+                     if v in verdicts), "wrong code")
+
+    components = {
+        "kind": kind,
+        "ice": ice,
+        "levels": levels,
+        "pattern": {opt: sorted(failures[opt]) for opt in levels},
+    }
+    keyed = {"kind": kind, "ice": ice} if ice else components
+    key = hashlib.sha256(json.dumps(keyed, sort_keys=True).encode()).hexdigest()[:16]
+    return key, components
+
+
+class SignatureIndex:
+    """A persistent index of the bug signatures seen so far.
+
+    The index is a JSON file mapping a signature key to its components,
+    the number of cases that hit it and the first case saved for it.
+    Updates are serialized across processes (and concurrent runs) with an
+    `flock` on a sibling lock file.
+
+    Attributes:
+        path: The path of the index file.
+    """
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def load(self) -> dict[str : dict]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _dump(self, index: dict[str : dict]):
+        fd, tmp = mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def record(self, key: str, components: dict, case_dir: str) -> int:
+        """Count a hit of a signature.
+
+        Returns:
+            int: The number of hits of the signature so far (1 means a new bug)
+        """
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = self.load()
+            entry = index.get(key)
+            now = time.time()
+            if entry is None:
+                entry = index[key] = {"components": components, "count": 0,
+                                      "case_dir": case_dir, "first_seen": now}
+            entry["count"] += 1
+            entry["last_seen"] = now
+            self._dump(index)
+        return entry["count"]
+
+
+if __name__ == "__main__":
+    import sys
+    # list the signatures of an index, most frequent first
+    index = SignatureIndex(sys.argv[1] if len(sys.argv) > 1 else "signatures.json").load()
+    for key, entry in sorted(index.items(), key=lambda e: -e[1]["count"]):
+        components = entry["components"]
+        print(f"{key} {entry['count']:>6} {components['kind']:<16} "
+              f"{','.join(components['levels']):<24} {entry['case_dir']}")
+        for ice in components["ice"]:
+            print(f"    {ice}")
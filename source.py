@@ -0,0 +1,68 @@
+import re
+
+from configs import OPT_FORMAT, PREFIX_TEXT, SUFFIX_TEXT
+
+DECLARATION = re.compile(r"\n(.+?;)", re.S)
+NAME = re.compile(r"(\S*)\(.*\).*?;")
+
+
+class SourceModel:
+    """A `SourceModel` indexes where optimize attributes go in a program.
+
+    The forward declarations of a csmith program are parsed once. Each
+    declared function is mapped to its attribute slot: the text between
+    the closing parenthesis of its declaration and the semicolon. A
+    mutant is rendered by splicing attribute strings into the slots in a
+    single pass over the program. Whatever the slots held before is
+    replaced, so one model serves the orig and every mutant of it.
+
+    Attributes:
+        code: The program the model was built from.
+        spans: The (start, end) offsets in `code` of the attribute slot
+            of each function, in declaration order.
+    """
+    def __init__(self, code: str):
+        self.code = code
+        self.spans: dict[str, tuple[int, int]] = {}
+        scope = re.search(rf"{PREFIX_TEXT}(.+?){SUFFIX_TEXT}", code, re.S)
+        if scope is None:
+            return
+        for declaration in DECLARATION.finditer(code, scope.start(), scope.end()):
+            name = NAME.search(declaration.group(1))
+            if name is None or name.group(1) in self.spans:
+                continue
+            func = name.group(1)
+            slot = re.compile(rf"{re.escape(func)}\(.*?\)").search(
+                code, declaration.start(1), declaration.end(1))
+            if slot is not None:
+                self.spans[func] = (slot.end(), declaration.end(1) - 1)
+
+    @property
+    def functions(self) -> list[str]:
+        return list(self.spans)
+
+    def render(self, opt_dict: dict[str : list[str]]) -> str:
+        """The program with the options of `opt_dict` as function attributes.
+
+        Functions of `opt_dict` without a declaration in the model are
+        patched where they first appear, like `FileINFO.sub_opt` did.
+        """
+        pieces = []
+        last = 0
+        for func, (start, end) in self.spans.items():
+            if func not in opt_dict:
+                continue
+            pieces.append(self.code[last:start])
+            pieces.append(attribute(opt_dict[func]))
+            last = end
+        pieces.append(self.code[last:])
+        code = "".join(pieces)
+        for func, opts in opt_dict.items():
+            if func not in self.spans:
+                code = re.sub(rf"({re.escape(func)}\(.*?\)).*?;",
+                              lambda r: f"{r.group(1)}{attribute(opts)};", code, count=1)
+        return code
+
+
+def attribute(opts: list[str]) -> str:
+    return f" {OPT_FORMAT.format(','.join(opts))}" if opts else ""
@@ -0,0 +1,119 @@
+import re
+
+from configs import PREFIX_TEXT, SUFFIX_TEXT
+from source import SourceModel, attribute
+
+GLOBALS_TEXT = "/* --- GLOBAL VARIABLES --- */"
+GLOBAL = re.compile(r"static (.+?)(?: = .*)?;\s*(?:/\*.*\*/)?\s*$")
+DEFINITION = re.compile(r"^static [^\n;{}]*\)\s*\n\{", re.M)
+MAIN = re.compile(r"^int main\b", re.M)
+MAIN_UNIT = "main"
+
+
+class SplitProgram:
+    """A `SplitProgram` cuts a csmith program into separate translation units.
+
+    Each function becomes a unit of its own, and the global variables
+    are defined in the unit of `main`. Every unit starts with the text
+    before the globals (includes and types), then the globals (as
+    `extern` declarations outside the unit of `main`) and the forward
+    declarations, all with external linkage. A unit only carries the
+    attribute of its own function, so its text, hence its object, only
+    changes with the options of that function. Functions no longer see
+    each other's bodies, so nothing is inlined across functions.
+
+    Programs that do not have the layout of csmith (e.g. the markers
+    were reduced away) raise a `ValueError`.
+
+    Attributes:
+        model: The model of the program.
+        bodies: The definition of each function (with external linkage).
+    """
+    def __init__(self, model: SourceModel):
+        self.model = model
+        code = model.code
+        globals_start = code.find(GLOBALS_TEXT)
+        declarations = re.search(PREFIX_TEXT, code)
+        functions = re.search(SUFFIX_TEXT, code)
+        main = MAIN.search(code, functions.end()) if functions else None
+        if globals_start < 0 or declarations is None or main is None \
+                or not globals_start < declarations.start() < functions.start():
+            raise ValueError("not a csmith program")
+
+        self.prelude = code[:globals_start]
+        definitions, externs = [], []
+        for line in code[globals_start:declarations.start()].split("\n"):
+            if not line.startswith("static "):
+                definitions.append(line)
+                externs.append(line)
+                continue
+            match = GLOBAL.match(line)
+            if match is None:
+                raise ValueError(f"cannot declare the global `{line}`")
+            definitions.append(line[len("static "):])
+            externs.append(f"extern {match.group(1)};")
+        self.definitions = "\n".join(definitions)
+        self.externs = "\n".join(externs)
+
+        # forward declarations, split around the attribute slots
+        self.pieces: list[str] = []
+        last = declarations.start()
+        for start, end in model.spans.values():
+            self.pieces.append(self.external(code[last:start]))
+            last = end
+        self.pieces.append(self.external(code[last:functions.start()]))
+        self.slots = [code[start:end] for start, end in model.spans.values()]
+
+        starts = {}
+        for func in model.functions:
+            definition = re.compile(rf"^static [^\n;{{}}]*\b{re.escape(func)}\([^\n;{{}}]*\)\s*\n\{{",
+                                    re.M).search(code, functions.end(), main.start())
+            if definition is None:
+                raise ValueError(f"no definition of {func}")
+            starts[func] = definition.start()
+        if len(DEFINITION.findall(code, functions.end(), main.start())) != len(starts):
+            raise ValueError("functions defined without a forward declaration")
+        bounds = sorted([*starts.values(), main.start()])
+        self.bodies = {func: self.external(code[start:bounds[bounds.index(start) + 1]])
+                       for func, start in starts.items()}
+        self.main = code[main.start():]
+
+    @staticmethod
+    def external(text: str) -> str:
+        return re.sub(r"^static ", "", text, flags=re.M)
+
+    def declarations(self, func: str = None, opts: list[str] = None) -> str:
+        """The forward declarations, with the attribute of `func` only."""
+        pieces = [self.pieces[0]]
+        for i, name in enumerate(self.model.functions):
+            if name == func:
+                pieces.append(attribute(opts) if opts is not None else self.slots[i])
+            pieces.append(self.pieces[i + 1])
+        return "".join(pieces)
+
+    def units(self, opt_dict: dict[str : list[str]] = None) -> dict[str, str] | None:
+        """The text of every unit of the program with the options of `opt_dict`.
+
+        Functions missing from `opt_dict` keep the attribute they have in
+        the program. Returns None if `opt_dict` patches a function the
+        model does not know.
+        """
+        opt_dict = opt_dict or {}
+        if any(func not in self.bodies for func in opt_dict):
+            return None
+        units = {MAIN_UNIT: "".join([self.prelude, self.definitions,
+                                     self.declarations(), self.main])}
+        for func, body in self.bodies.items():
+            units[func] = "".join([self.prelude, self.externs,
+                                   self.declarations(func, opt_dict.get(func)), body])
+        return units
+
+
+def split_program(model: SourceModel) -> SplitProgram | None:
+    """The `SplitProgram` of `model`, built once per model (None if it cannot be split)."""
+    if not hasattr(model, "_split"):
+        try:
+            model._split = SplitProgram(model)
+        except ValueError:
+            model._split = None
+    return model._split
@@ -0,0 +1,106 @@
+import time
+from multiprocessing import Process, Event, Value
+
+import metrics
+
+
+class Stage:
+    """A `Stage` runs a resizable pool of worker processes.
+
+    Every worker runs `work(stop)` and must return soon after its `stop`
+    event is set (workers check it between two cases), so that a stage
+    can be shrunk without losing the case a worker is processing.
+
+    Attributes:
+        name: The name of the stage, as shown in logs and metrics.
+        num_workers: The number of workers started by `run`.
+        workers: The worker processes with their stop events.
+        busy_time: The total seconds spent processing cases, over all workers.
+        done: The total number of cases processed, over all workers.
+    """
+    name = "stage"
+    counter = None # the metrics counter of the cases handled by this stage
+
+    def __init__(self, num_workers: int = 1):
+        self.num_workers = max(1, num_workers)
+        self.workers: list[tuple[Process, Event]] = []
+        self.busy_time = Value('d', 0.0)
+        self.done = Value('i', 0)
+
+    def work(self, stop: Event):
+        raise NotImplementedError
+
+    def record(self, start: float):
+        """Account for one case processed since `start` (a `time.time()` value)."""
+        elapsed = time.time() - start
+        metrics.observe("stage_latency_seconds", self.name, elapsed)
+        if self.counter:
+            metrics.inc(self.counter)
+        with self.busy_time.get_lock():
+            self.busy_time.value += elapsed
+        with self.done.get_lock():
+            self.done.value += 1
+
+    @property
+    def service_time(self) -> float | None:
+        """The average seconds a worker spends on one case (None if unknown yet)."""
+        with self.done.get_lock():
+            done = self.done.value
+        if done == 0:
+            return None
+        return self.busy_time.value / done
+
+    @property
+    def size(self) -> int:
+        """The number of live workers that are not being stopped."""
+        return sum(1 for process, stop in self.workers
+                   if process.is_alive() and not stop.is_set())
+
+    def add_worker(self):
+        stop = Event()
+        process = Process(target=self.work, args=(stop,))
+        process.start()
+        self.workers.append((process, stop))
+
+    def remove_worker(self) -> bool:
+        for process, stop in reversed(self.workers):
+            if process.is_alive() and not stop.is_set():
+                stop.set()
+                return True
+        return False
+
+    def resize(self, num_workers: int):
+        num_workers = max(1, num_workers)
+        while self.size < num_workers:
+            self.add_worker()
+        while self.size > num_workers:
+            self.remove_worker()
+        self.workers = [(process, stop) for process, stop in self.workers
+                        if process.is_alive()]
+
+    def run(self):
+        for _ in range(self.num_workers):
+            self.add_worker()
+
+    def join(self):
+        # the list may grow while waiting (see `StageScheduler`)
+        while True:
+            alive = [process for process, _ in self.workers if process.is_alive()]
+            if not alive:
+                break
+            alive[0].join()
+
+    def stop(self, timeout: float = None):
+        """Ask every worker to return and wait up to `timeout` seconds for each."""
+        for _, stop in self.workers:
+            stop.set()
+        for process, _ in self.workers:
+            process.join(timeout)
+
+    def terminate(self):
+        for process, _ in self.workers:
+            if process.is_alive():
+                process.terminate()
+        for process, _ in self.workers:
+            process.join()
+        self.workers.clear()
@@ -4,22 +4,45 @@ import smtplib
 import os
 from email.message import EmailMessage
 
-from filemanager import FileINFO, MutantFileINFO, CaseManager
-from configs import (SIMPLE_OPTS, CSMITH_HOME, UNCOMPILED,
+from filemanager import FileINFO, MutantFileINFO, CaseManager, include_args
+from configs import (SIMPLE_OPTS, get_config, UNCOMPILED,
                      COMPILE_TIMEOUT, COMPILER_CRASHED,
                      RUNTIME_CRASHED, RUNTIME_TIMEOUT)
 
-def send_mail(config: dict, subject: str, content: str, attachment: str = None):
+def smtp_connect(config: dict, timeout: float = 30) -> smtplib.SMTP:
+    """Open a connection to the SMTP server of `config`.
+
+    The connection uses SSL unless `config["ssl"]` is false, and only logs
+    in if a password is configured. `timeout` bounds every socket operation,
+    so a hung server cannot block the caller forever.
+    """
+    if config.get("ssl", True):
+        server = smtplib.SMTP_SSL(config["smtp_server"], config["smtp_port"], timeout=timeout)
+    else:
+        server = smtplib.SMTP(config["smtp_server"], config["smtp_port"], timeout=timeout)
+    if config.get("password"):
+        server.login(config["sender"], config["password"])
+    return server
+
+
+def build_message(config: dict, subject: str, content: str,
+                  attachments: list[str] = None) -> EmailMessage:
     message = EmailMessage()
     message['From'] = config["From"]
     message['To'] = config["To"]
     message['Subject'] = subject
-    server = smtplib.SMTP_SSL(config["smtp_server"], config["smtp_port"])
-    server.login(config["sender"], config["password"])
     message.set_content(content)
-    if attachment is not None:
+    for attachment in attachments or []:
         with open(attachment, 'rb') as f:
-            message.add_attachment(f.read(), maintype='application', subtype='zip', filename=attachment)
+            message.add_attachment(f.read(), maintype='application', subtype='zip',
+                                   filename=os.path.basename(attachment))
+    return message
+
+
+def send_mail(config: dict, subject: str, content: str, attachment: str = None):
+    server = smtp_connect(config)
+    message = build_message(config, subject, content,
+                            [attachment] if attachment is not None else None)
     server.send_message(message, config["sender"], config["receiver"])
     server.quit()
 
@@ -52,7 +75,7 @@ def get_file_res_dict(file: str):
     res_dict = {}
     for opt in SIMPLE_OPTS:
         res = UNCOMPILED
-        cmd = ["gcc", opt, file, f"-I{CSMITH_HOME}/include", "-w"]
+        cmd = ["gcc", opt, file, *include_args("gcc", [opt]), "-w"]
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=os.path.dirname(file))
         try:
             process.communicate(timeout=60)
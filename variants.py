@@ -0,0 +1,101 @@
+import re
+
+# identifiers of a csmith program that would clash between variants: globals,
+# functions, struct and union tags, and main (locals and members are scoped).
+# String and character literals and comments are matched first and left as
+# they are: csmith passes the names of globals to `transparent_crc`, which
+# prints them
+IDENTIFIER = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|/\*.*?\*/|//[^\n]*'
+                        r"|\b(g_\d+|func_\d+|S\d+|U\d+|__undefined|main)\b", re.S)
+VARIANT_TEXT = "/* --- VARIANT {} --- */"
+MARKER = re.compile(rb"@@cbouncy variant (\d+) (-?\d+) (\d+) (\d+)\n")
+
+# csmith.h comes first, so that gcc can use its precompiled header (see
+# `pch.PCHCache`); gcc defines _DEFAULT_SOURCE itself unless a strict -std
+# is given, in which case the combined program falls back to single files
+PRELUDE = """#include "csmith.h"
+#include <stdio.h>
+#include <stdlib.h>
+#include <unistd.h>
+#include <sys/time.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+"""
+
+DRIVER = """
+/* --- MULTI-VARIANT DRIVER --- */
+static int (*const cbouncy_variants[])(int, char *[]) = {{{mains}}};
+
+int main(int argc, char *argv[])
+{{
+    int i;
+    for (i = 0; i < {count}; i++) {{
+        int status;
+        struct rusage usage;
+        pid_t pid;
+        fflush(stdout);
+        pid = fork();
+        if (pid == 0) {{
+            struct itimerval timer = {{{{0, 0}}, {{{seconds}, {microseconds}}}}};
+            struct rlimit cpu = {{{rlimit}, {rlimit} + 1}};
+            setrlimit(RLIMIT_CPU, &cpu);
+            setitimer(ITIMER_PROF, &timer, NULL);
+            exit(cbouncy_variants[i](argc, argv));
+        }}
+        if (pid < 0 || wait4(pid, &status, 0, &usage) < 0)
+            return 1;
+        printf("@@cbouncy variant %d %d %ld %ld\\n", i,
+               WIFEXITED(status) ? WEXITSTATUS(status) : -WTERMSIG(status),
+               (usage.ru_utime.tv_sec + usage.ru_stime.tv_sec) * 1000000L
+               + usage.ru_utime.tv_usec + usage.ru_stime.tv_usec,
+               usage.ru_maxrss);
+    }}
+    fflush(stdout);
+    return 0;
+}}
+"""
+
+
+def prefix(i: int) -> str:
+    return f"v{i}_"
+
+
+def rename(text: str, i: int) -> str:
+    """`text` with the global identifiers of variant `i` renamed."""
+    return IDENTIFIER.sub(lambda m: f"{prefix(i)}{m.group(1)}" if m.group(1) else m.group(0),
+                          text)
+
+
+def combine(texts: list[str], timeout: float) -> str:
+    """One program running each of the csmith programs `texts` in turn.
+
+    Every program gets its identifiers prefixed by its index, and a
+    driver `main` runs its `main` in a forked child, so each one starts
+    from its own initial state (csmith.h keeps a shared CRC context)
+    and a crash or a timeout only ends its child. Each child is limited
+    to `timeout` seconds of CPU time. After each child, the driver
+    prints a marker with its exit status (negated signal number if it
+    was killed), its CPU time in microseconds and its peak RSS in KiB.
+    """
+    pieces = [PRELUDE]
+    for i, text in enumerate(texts):
+        pieces.append(f"\n{VARIANT_TEXT.format(i)}\n")
+        pieces.append(rename(text, i))
+    seconds = int(timeout)
+    pieces.append(DRIVER.format(mains=", ".join(f"{prefix(i)}main" for i in range(len(texts))),
+                                count=len(texts), seconds=seconds,
+                                microseconds=int((timeout - seconds) * 1e6),
+                                rlimit=seconds + 1))
+    return "".join(pieces)
+
+
+def split_output(stdout: bytes) -> dict[int, tuple[bytes, int, float, int]]:
+    """The (output, exit status, CPU seconds, peak RSS) of each variant that
+    ran to its marker, by index."""
+    variants = {}
+    last = 0
+    for marker in MARKER.finditer(stdout):
+        index, status, cpu, rss = map(int, marker.groups())
+        variants[index] = (stdout[last:marker.start()], status, cpu / 1e6, rss)
+        last = marker.end()
+    return variants